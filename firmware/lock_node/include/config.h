@@ -11,6 +11,7 @@
 #define MQTT_USERNAME ""      // MQTT username (leave empty if no auth)
 #define MQTT_PASSWORD ""      // MQTT password (leave empty if no auth)
 #define MQTT_TOPIC_PREFIX "pinelock"
+#define MQTT_PAYLOAD_MSGPACK 0  // 1 = MessagePack payloads on "<topic>/mp" (smaller than JSON)
 
 // Device Configuration - SET UNIQUE ID FOR EACH LOCK!
 #define DEVICE_ID "domek_1"  // Unique identifier for this lock device
@@ -54,6 +55,8 @@
 #define HEARTBEAT_INTERVAL 60000  // Send heartbeat every 60 seconds
 #define LOCK_DURATION 5000         // Keep lock open for 5 seconds
 #define MQTT_RECONNECT_DELAY 5000  // Wait 5 seconds before MQTT reconnect
+#define CONFIG_RETAINED_WAIT 2000  // Wait for the retained config before asking for a sync
+#define SYNC_REQUEST_JITTER 3000   // Random extra delay of that sync request (reconnect storms)
 #define KEYPAD_DEBOUNCE_MS 200     // Debounce time for keypad (200ms allows fast repeat)
 #define RFID_CHECK_INTERVAL_MS 500 // RFID check interval
 #define BUZZER_WRONG_PIN_DURATION 1000  // Buzzer beep for 1 second on wrong PIN
@@ -63,5 +66,7 @@
 #define MAX_PIN_CODES 50
 #define MAX_RFID_CARDS 50
 #define PIN_LENGTH 10
+#define ONLINE_VERIFY 1            // Ask the server about PINs/cards not stored on the device
+#define VERIFY_TIMEOUT_MS 1500     // Deny if the server has not answered by then
 
 #endif // CONFIG_H
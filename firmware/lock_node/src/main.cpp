@@ -46,13 +46,29 @@ unsigned long buzzerStopTime = 0;
 bool buzzerActive = false;
 unsigned long lastVibrationTime = 0;
 String keyTagUID = "";  // UID of the key tag for presence detection
+String configVersion = "";  // Version of the last full config from the server
+uint32_t configSeq = 0;  // Config sequence held (0 = unknown, server sends a snapshot)
+int nextConfigChunk = 0;  // Next expected chunk of a config snapshot
+bool syncPending = false;  // Sync request due unless the retained config shows we are current
+unsigned long syncDueAt = 0;
+uint32_t verifyId = 0;  // Id of the last online verification request
+bool verifyPending = false;  // Waiting for the server's verdict
+unsigned long verifyDeadline = 0;
+String verifyType = "";  // "pin" or "rfid", and the credential being checked
+String verifyValue = "";
 
 // Function declarations
 void setupWiFi();
+String deviceTopic(const char* messageType);
+bool publishDoc(const char* messageType, const JsonDocument& doc);
 void setupMQTT();
 void setupHardware();
 void mqttCallback(char* topic, byte* payload, unsigned int length);
 void reconnectMQTT();
+void requestSync();
+bool requestVerification(const char* accessType, const String& value);
+void finishVerification(bool valid);
+void applyConfigOp(const char* op, JsonVariant value);
 void sendHeartbeat();
 void sendAccessEvent(const char* accessType, const char* method, bool success);
 void sendStatusUpdate();
@@ -108,6 +124,17 @@ void loop() {
     }
     mqttClient.loop();
     
+    // No (or an outdated) retained config after reconnecting: ask for a sync
+    if (syncPending && (long)(millis() - syncDueAt) >= 0) {
+        requestSync();
+    }
+    
+    // No verdict from the server in time: deny
+    if (verifyPending && (long)(millis() - verifyDeadline) >= 0) {
+        Serial.println("Online verification timed out");
+        finishVerification(false);
+    }
+    
     // Handle keypad input
     handleKeypad();
     
@@ -251,10 +278,15 @@ void mqttCallback(char* topic, byte* payload, unsigned int length) {
     }
     
     String messageType = topicStr.substring(prefix.length());
+    bool msgPack = messageType.endsWith("/mp");
+    if (msgPack) {
+        messageType.remove(messageType.length() - 3);
+    }
     
-    // Parse JSON payload
+    // Parse JSON or MessagePack payload
     StaticJsonDocument<256> doc;
-    DeserializationError error = deserializeJson(doc, payload, length);
+    DeserializationError error = msgPack ? deserializeMsgPack(doc, payload, length)
+                                         : deserializeJson(doc, payload, length);
     
     if (error) {
         Serial.print("JSON parse error: ");
@@ -262,6 +294,24 @@ void mqttCallback(char* topic, byte* payload, unsigned int length) {
         return;
     }
     
+    // Retained config, delivered by the broker right after subscribing
+    if (messageType == "config/retained") {
+        uint32_t seq = doc["seq"] | 0;
+        if (seq != 0 && seq == configSeq) {
+            syncPending = false;
+            Serial.print("Config current (retained), seq ");
+            Serial.println(configSeq);
+            return;
+        }
+        if (!doc.containsKey("access_codes")) {
+            // Too large for one message: only its sequence is retained
+            requestSync();
+            return;
+        }
+        syncPending = false;
+        messageType = "config";  // Complete snapshot, apply it below
+    }
+    
     // Handle different message types
     if (messageType == "command") {
         if (!doc.containsKey("action")) {
@@ -304,6 +354,8 @@ void mqttCallback(char* topic, byte* payload, unsigned int length) {
             Serial.println(added ? "PIN added via MQTT" : "Failed to add PIN via MQTT");
             sendAccessEvent("admin_pin_add", code.c_str(), added);
             if (added) {
+                configVersion = "";  // Local change: next sync needs the full config
+                configSeq = 0;
                 sendStatusUpdate();
             }
         } else if (action == "remove_pin") {
@@ -317,6 +369,8 @@ void mqttCallback(char* topic, byte* payload, unsigned int length) {
             Serial.println(removed ? "PIN removed via MQTT" : "Failed to remove PIN via MQTT");
             sendAccessEvent("admin_pin_remove", code.c_str(), removed);
             if (removed) {
+                configVersion = "";
+                configSeq = 0;
                 sendStatusUpdate();
             }
         } else if (action == "buzzer") {
@@ -327,12 +381,65 @@ void mqttCallback(char* topic, byte* payload, unsigned int length) {
         }
     } else if (messageType == "sync") {
         Serial.println("Sync request received - waiting for config data");
+    } else if (messageType == "verdict") {
+        // Answer to requestVerification: {"id": N, "valid": true|false}
+        if (verifyPending && (doc["id"] | 0UL) == verifyId) {
+            finishVerification(doc["valid"] | false);
+        }
+    } else if (messageType == "delta") {
+        // Incremental change: {"seq": N, "base": N-1, "ops": [[op, value], ...]}
+        uint32_t seq = doc["seq"] | 0;
+        uint32_t base = doc["base"] | 0;
+        if (seq <= configSeq) {
+            return;  // Already applied
+        }
+        if (configSeq == 0 || base != configSeq) {
+            Serial.print("Config delta gap (have ");
+            Serial.print(configSeq);
+            Serial.print(", delta base ");
+            Serial.print(base);
+            Serial.println(") - requesting sync");
+            requestSync();
+            return;
+        }
+        
+        for (JsonVariant op : doc["ops"].as<JsonArray>()) {
+            applyConfigOp(op[0] | "", op[1]);
+        }
+        configSeq = seq;
+        configVersion = "";  // Versions describe full configs only
+        Serial.print("Config delta applied, seq ");
+        Serial.println(configSeq);
     } else if (messageType == "config") {
-        Serial.println("Config received from server");
+        // Reply to a sync request that carried the current version or sequence
+        if (doc["up_to_date"] | false) {
+            Serial.print("Config up to date, seq ");
+            Serial.println(configSeq);
+            return;
+        }
+        
+        // Snapshots may arrive in chunks; a plain full config is a single chunk
+        int chunk = doc["chunk"] | 0;
+        int chunks = doc["chunks"] | 1;
+        if (chunk != nextConfigChunk && chunk != 0) {
+            Serial.println("Config chunk out of order - requesting sync");
+            nextConfigChunk = 0;
+            configSeq = 0;
+            requestSync();
+            return;
+        }
         
-        // Clear all existing PINs and RFID cards
-        accessControl.clearPINCodes();
-        accessControl.clearRFIDCards();
+        Serial.print("Config received from server, chunk ");
+        Serial.print(chunk + 1);
+        Serial.print("/");
+        Serial.println(chunks);
+        
+        if (chunk == 0) {
+            // Clear all existing PINs and RFID cards
+            accessControl.clearPINCodes();
+            accessControl.clearRFIDCards();
+            keyTagUID = "";
+        }
         
         // Process access_codes array
         if (doc.containsKey("access_codes")) {
@@ -342,11 +449,7 @@ void mqttCallback(char* topic, byte* payload, unsigned int length) {
             Serial.println(" PIN codes");
             
             for (JsonVariant codeVariant : codes) {
-                String code = codeVariant.as<String>();
-                bool added = accessControl.addPINCode(code.c_str(), true, false, DateTime(), DateTime());
-                Serial.print("  PIN ");
-                Serial.print(code);
-                Serial.println(added ? " - added" : " - failed");
+                applyConfigOp("add_pin", codeVariant);
             }
         }
         
@@ -358,28 +461,127 @@ void mqttCallback(char* topic, byte* payload, unsigned int length) {
             Serial.println(" RFID cards");
             
             for (JsonVariant cardVariant : cards) {
-                String cardUid = cardVariant.as<String>();
-                bool added = accessControl.addRFIDCard(cardUid.c_str(), true, false, DateTime(), DateTime());
-                Serial.print("  Card ");
-                Serial.print(cardUid);
-                Serial.println(added ? " - added" : " - failed");
+                applyConfigOp("add_card", cardVariant);
             }
         }
         
-        // Process key_tag
-        if (doc.containsKey("key_tag") && !doc["key_tag"].isNull()) {
-            keyTagUID = doc["key_tag"].as<String>();
-            Serial.print("Key tag UID configured: ");
-            Serial.println(keyTagUID);
-        } else {
-            keyTagUID = "";
-            Serial.println("No key tag configured");
+        // Process key_tag (first chunk only)
+        if (doc.containsKey("key_tag")) {
+            applyConfigOp("key_tag", doc["key_tag"]);
         }
         
+        if (chunk + 1 < chunks) {
+            nextConfigChunk = chunk + 1;
+            return;
+        }
+        nextConfigChunk = 0;
+        const char* version = doc["version"] | "";
+        configVersion = version;
+        configSeq = doc["seq"] | 0;
         Serial.println("Config sync completed!");
     }
 }
 
+// Apply one config change; shared by full configs, snapshots and deltas
+void applyConfigOp(const char* op, JsonVariant value) {
+    String item = value.isNull() ? String("") : value.as<String>();
+    bool ok = true;
+    
+    if (strcmp(op, "add_pin") == 0) {
+        ok = accessControl.addPINCode(item.c_str(), true, false, DateTime(), DateTime());
+    } else if (strcmp(op, "remove_pin") == 0) {
+        ok = accessControl.removePINCode(item.c_str());
+    } else if (strcmp(op, "add_card") == 0) {
+        ok = accessControl.addRFIDCard(item.c_str(), true, false, DateTime(), DateTime());
+    } else if (strcmp(op, "remove_card") == 0) {
+        ok = accessControl.removeRFIDCard(item.c_str());
+    } else if (strcmp(op, "key_tag") == 0) {
+        keyTagUID = item;
+    } else {
+        Serial.print("Unknown config op: ");
+        Serial.println(op);
+        return;
+    }
+    
+    Serial.print("  ");
+    Serial.print(op);
+    Serial.print(" ");
+    Serial.print(item);
+    Serial.println(ok ? " - ok" : " - failed");
+}
+
+// Ask the server for config changes since the sequence we hold
+void requestSync() {
+    syncPending = false;
+    StaticJsonDocument<96> syncDoc;
+    syncDoc["request"] = "sync";
+    syncDoc["since"] = configSeq;  // Server replies with deltas, a snapshot or "up_to_date"
+    if (configVersion.length() > 0) {
+        syncDoc["version"] = configVersion;
+    }
+    publishDoc("sync", syncDoc);
+    Serial.println("Sync requested");
+}
+
+// Ask the server whether a PIN or card not stored here opens this lock;
+// the verdict arrives on the "verdict" topic. False if not possible now.
+bool requestVerification(const char* accessType, const String& value) {
+#if !ONLINE_VERIFY
+    (void)accessType;
+    (void)value;
+    return false;
+#else
+    if (verifyPending || !mqttClient.connected()) {
+        return false;
+    }
+    StaticJsonDocument<96> verifyDoc;
+    verifyDoc["id"] = ++verifyId;
+    verifyDoc[strcmp(accessType, "pin") == 0 ? "pin" : "card"] = value;
+    if (!publishDoc("verify", verifyDoc)) {
+        return false;
+    }
+    verifyPending = true;
+    verifyDeadline = millis() + VERIFY_TIMEOUT_MS;
+    verifyType = accessType;
+    verifyValue = value;
+    Serial.println("Checking credential with the server...");
+    return true;
+#endif
+}
+
+void finishVerification(bool valid) {
+    verifyPending = false;
+    if (valid) {
+        Serial.println("Credential valid (server)! Unlocking...");
+        controlLock(false);
+    } else {
+        Serial.println("Credential invalid (server)!");
+        if (verifyType == "pin") {
+            activateBuzzer(BUZZER_WRONG_PIN_DURATION);
+        }
+    }
+    sendAccessEvent(verifyType.c_str(), verifyValue.c_str(), valid);
+}
+
+// Topic of this device, with the "/mp" suffix when MessagePack is enabled
+String deviceTopic(const char* messageType) {
+    String topic = String(MQTT_TOPIC_PREFIX) + "/" + String(DEVICE_ID) + "/" + messageType;
+#if MQTT_PAYLOAD_MSGPACK
+    topic += "/mp";
+#endif
+    return topic;
+}
+
+bool publishDoc(const char* messageType, const JsonDocument& doc) {
+    uint8_t buffer[256];
+#if MQTT_PAYLOAD_MSGPACK
+    size_t length = serializeMsgPack(doc, buffer, sizeof(buffer));
+#else
+    size_t length = serializeJson(doc, buffer, sizeof(buffer));
+#endif
+    return mqttClient.publish(deviceTopic(messageType).c_str(), buffer, length, false);
+}
+
 void reconnectMQTT() {
     // Loop until we're reconnected
     while (!mqttClient.connected()) {
@@ -413,28 +615,30 @@ void reconnectMQTT() {
         if (connected) {
             Serial.println("connected!");
             
-            // Subscribe to command, sync, and config topics
-            String commandTopic = String(MQTT_TOPIC_PREFIX) + "/" + String(DEVICE_ID) + "/command";
-            String syncTopic = String(MQTT_TOPIC_PREFIX) + "/" + String(DEVICE_ID) + "/sync";
-            String configTopic = String(MQTT_TOPIC_PREFIX) + "/" + String(DEVICE_ID) + "/config";
+            // Subscribe to command, sync, config, delta and verdict topics
+            String commandTopic = deviceTopic("command");
+            String syncTopic = deviceTopic("sync");
+            String configTopic = deviceTopic("config");
+            String deltaTopic = deviceTopic("delta");
+            String retainedTopic = deviceTopic("config/retained");
+            String verdictTopic = deviceTopic("verdict");
             
             mqttClient.subscribe(commandTopic.c_str());
             mqttClient.subscribe(syncTopic.c_str());
             mqttClient.subscribe(configTopic.c_str());
+            mqttClient.subscribe(deltaTopic.c_str());
+            mqttClient.subscribe(retainedTopic.c_str());
+            mqttClient.subscribe(verdictTopic.c_str());
             
             Serial.println("Subscribed to topics");
             
             // Send initial status
             sendStatusUpdate();
             
-            // Request sync
-            String syncRequestTopic = String(MQTT_TOPIC_PREFIX) + "/" + String(DEVICE_ID) + "/sync";
-            StaticJsonDocument<64> syncDoc;
-            syncDoc["request"] = "sync";
-            char syncBuffer[64];
-            serializeJson(syncDoc, syncBuffer);
-            mqttClient.publish(syncRequestTopic.c_str(), syncBuffer);
-            Serial.println("Sync requested");
+            // Sync only if the retained config does not show we are current;
+            // jitter spreads the requests of a fleet reconnecting at once
+            syncPending = true;
+            syncDueAt = millis() + CONFIG_RETAINED_WAIT + (esp_random() % SYNC_REQUEST_JITTER);
         } else {
             Serial.print("failed, rc=");
             Serial.print(mqttClient.state());
@@ -454,7 +658,6 @@ void sendHeartbeat() {
         return;
     }
     
-    String topic = String(MQTT_TOPIC_PREFIX) + "/" + String(DEVICE_ID) + "/heartbeat";
     StaticJsonDocument<128> doc;
     
     if (rtcFound) {
@@ -463,10 +666,7 @@ void sendHeartbeat() {
         doc["timestamp"] = millis() / 1000; // Fallback to uptime
     }
     
-    char buffer[128];
-    serializeJson(doc, buffer);
-    
-    mqttClient.publish(topic.c_str(), buffer);
+    publishDoc("heartbeat", doc);
     Serial.println("Heartbeat sent");
 }
 
@@ -475,7 +675,6 @@ void sendAccessEvent(const char* accessType, const char* method, bool success) {
         return;
     }
     
-    String topic = String(MQTT_TOPIC_PREFIX) + "/" + String(DEVICE_ID) + "/access";
     StaticJsonDocument<256> doc;
     doc["access_type"] = accessType;
     doc["access_method"] = method;
@@ -487,12 +686,9 @@ void sendAccessEvent(const char* accessType, const char* method, bool success) {
         doc["timestamp"] = millis() / 1000;
     }
     
-    char buffer[256];
-    serializeJson(doc, buffer);
-    
-    mqttClient.publish(topic.c_str(), buffer);
+    publishDoc("access", doc);
     Serial.print("Access event sent: ");
-    Serial.println(buffer);
+    Serial.println(accessType);
 }
 
 void sendStatusUpdate() {
@@ -500,7 +696,6 @@ void sendStatusUpdate() {
         return;
     }
 
-    String topic = String(MQTT_TOPIC_PREFIX) + "/" + String(DEVICE_ID) + "/status";
     StaticJsonDocument<128> doc;
     doc["is_locked"] = isLocked;
     doc["is_key_present"] = false; // Will be updated by RFID detection
@@ -511,10 +706,7 @@ void sendStatusUpdate() {
         doc["timestamp"] = millis() / 1000;
     }
 
-    char buffer[128];
-    serializeJson(doc, buffer);
-
-    mqttClient.publish(topic.c_str(), buffer);
+    publishDoc("status", doc);
     Serial.println("Status update sent");
 }
 
@@ -523,7 +715,6 @@ void sendKeyStatusUpdate(bool keyPresent, String cardUID) {
         return;
     }
 
-    String topic = String(MQTT_TOPIC_PREFIX) + "/" + String(DEVICE_ID) + "/status";
     StaticJsonDocument<256> doc;
     doc["is_locked"] = isLocked;
     doc["is_key_present"] = keyPresent;
@@ -537,10 +728,7 @@ void sendKeyStatusUpdate(bool keyPresent, String cardUID) {
         doc["timestamp"] = millis() / 1000;
     }
 
-    char buffer[256];
-    serializeJson(doc, buffer);
-
-    mqttClient.publish(topic.c_str(), buffer);
+    publishDoc("status", doc);
     Serial.print("Key status update sent: ");
     Serial.println(keyPresent ? "present" : "absent");
 }
@@ -615,6 +803,8 @@ void processPINEntry(char key) {
                 Serial.println("PIN valid! Unlocking...");
                 controlLock(false);
                 sendAccessEvent("pin", currentPIN.c_str(), true);
+            } else if (requestVerification("pin", currentPIN)) {
+                // Not stored here; the server's verdict decides
             } else {
                 Serial.println("PIN invalid!");
                 activateBuzzer(BUZZER_WRONG_PIN_DURATION);
@@ -728,6 +918,8 @@ void handleRFID() {
                     Serial.println("Valid access card - unlocking");
                     controlLock(false);
                     sendAccessEvent("rfid", currentCardUID.c_str(), true);
+                } else if (requestVerification("rfid", currentCardUID)) {
+                    // Not stored here; the server's verdict decides
                 } else {
                     Serial.println("Unknown RFID card");
                     sendAccessEvent("rfid", currentCardUID.c_str(), false);
@@ -854,15 +1046,12 @@ void handleVibration() {
                 activateBuzzer(BUZZER_WRONG_PIN_DURATION);
                 
                 // Send vibration alert via MQTT
-                String topic = String(MQTT_TOPIC_PREFIX) + "/" + String(DEVICE_ID) + "/alert";
                 StaticJsonDocument<128> doc;
                 doc["type"] = "vibration";
                 doc["message"] = "Vibration detected - possible tampering";
                 doc["timestamp"] = rtc.now().unixtime();
                 
-                String jsonString;
-                serializeJson(doc, jsonString);
-                mqttClient.publish(topic.c_str(), jsonString.c_str());
+                publishDoc("alert", doc);
                 
                 Serial.println("Vibration alert sent");
                 
@@ -900,15 +1089,12 @@ void handleDoorSensor() {
             Serial.println(isOpen ? "OPEN" : "CLOSED");
             
             // Send status update
-            String topic = String(MQTT_TOPIC_PREFIX) + "/" + String(DEVICE_ID) + "/status";
             StaticJsonDocument<128> doc;
             doc["is_locked"] = isLocked;
             doc["is_door_open"] = isOpen;
             doc["timestamp"] = rtc.now().unixtime();
             
-            String jsonString;
-            serializeJson(doc, jsonString);
-            mqttClient.publish(topic.c_str(), jsonString.c_str());
+            publishDoc("status", doc);
         }
     }
     
@@ -918,15 +1104,12 @@ void handleDoorSensor() {
             Serial.println("ALARM: Door open too long!");
             
             // Send alert
-            String topic = String(MQTT_TOPIC_PREFIX) + "/" + String(DEVICE_ID) + "/alert";
             StaticJsonDocument<128> doc;
             doc["type"] = "door_open_alert";
             doc["message"] = "Door has been open for more than 3 minutes";
             doc["timestamp"] = rtc.now().unixtime();
             
-            String jsonString;
-            serializeJson(doc, jsonString);
-            mqttClient.publish(topic.c_str(), jsonString.c_str());
+            publishDoc("alert", doc);
             
             alertSent = true;
             
@@ -0,0 +1,515 @@
+"""
+Time-partitioned access log storage.
+
+Access logs go into one table per calendar month (``access_logs_202406``, see
+``models.access_log_table``), created the first time a row for that month is
+written. ``access_log_store`` keeps the list of partitions and routes every
+query to the months its time range overlaps, newest first, stopping as soon as
+a listing has its rows: the latest 100 logs of a lock read one or two small
+tables however much history is kept.
+
+Retention (``access_log_retention_months``) drops whole partitions, a cheap
+DROP TABLE instead of a DELETE over millions of rows. On SQLite the freed pages
+are reused by new partitions; databases created by this release use
+incremental auto-vacuum, so the file also shrinks after a drop.
+
+Counts come from rollups maintained in the same transaction as each batch of
+logs: ``access_log_rollups`` per lock, hour, access type and outcome, and
+``access_log_totals`` per lock over everything retained. A time range is
+answered from the hourly rollups for its whole hours and from the partitions
+for the partial hours at its edges, so counts are exact and never scan logs.
+
+Log ids are unique within a partition; (timestamp, id) identifies a row.
+Listings page with keyset cursors on it (``page``): the next page continues
+below the last row through the (lock_id, timestamp) / (timestamp) indexes,
+so a page deep in the history costs the same as the first.
+"""
+import asyncio
+import base64
+import logging
+import re
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import MetaData, Table, bindparam, delete, func, insert, inspect, or_, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.config import settings
+from app.database import engine, read_engine
+from app.models import AccessLogRollup, AccessLogTotal, access_log_table
+
+logger = logging.getLogger(__name__)
+
+PARTITION_NAME = re.compile(r"^access_logs_(\d{4})(\d{2})$")
+
+# How often retention is applied
+RETENTION_INTERVAL = 3600.0
+
+# Partitions created by other server processes are picked up at most this late
+REFRESH_INTERVAL = 10.0
+
+# Columns COPY loads; ids come from each partition's sequence
+COPY_COLUMNS = ("lock_id", "access_type", "access_method", "success", "timestamp")
+
+
+def month_of(timestamp: datetime) -> datetime:
+    return datetime(timestamp.year, timestamp.month, 1)
+
+
+def add_months(month: datetime, months: int) -> datetime:
+    year, month_index = divmod(month.year * 12 + month.month - 1 + months, 12)
+    return datetime(year, month_index + 1, 1)
+
+
+def hour_of(timestamp: datetime) -> datetime:
+    return timestamp.replace(minute=0, second=0, microsecond=0)
+
+
+def partition_name(month: datetime) -> str:
+    return f"access_logs_{month:%Y%m}"
+
+
+def partition_table(month: datetime) -> Table:
+    return access_log_table(partition_name(month), MetaData())
+
+
+ROLLUPS = AccessLogRollup.__table__
+TOTALS = AccessLogTotal.__table__
+
+# Counts by (access_type, success)
+Counts = Dict[Tuple[str, bool], int]
+
+
+def _filtered(query, table: Table, lock_id: Optional[int], access_type: Optional[str], success: Optional[bool]):
+    if lock_id is not None:
+        query = query.where(table.c.lock_id == lock_id)
+    if access_type is not None:
+        query = query.where(table.c.access_type == access_type)
+    if success is not None:
+        query = query.where(table.c.success == success)
+    return query
+
+
+def _add_counts(table: Table, keys: List[str]):
+    """INSERT that adds ``count`` to an existing row with the same key."""
+    dialect_insert = postgresql.insert if engine.dialect.name == "postgresql" else sqlite.insert
+    statement = dialect_insert(table)
+    return statement.on_conflict_do_update(
+        index_elements=keys, set_={"count": table.c.count + statement.excluded.count}
+    )
+
+
+async def _copy_rows(session: AsyncSession, table: Table, rows: List[dict]):
+    """Load rows into ``table`` with COPY, on the session's asyncpg connection and transaction."""
+    connection = await session.connection()
+    raw = await connection.get_raw_connection()
+    await raw.driver_connection.copy_records_to_table(
+        table.name,
+        columns=COPY_COLUMNS,
+        records=[
+            (row["lock_id"], row["access_type"], row.get("access_method"), bool(row["success"]), row["timestamp"])
+            for row in rows
+        ],
+    )
+
+
+def encode_cursor(row) -> str:
+    """Opaque cursor for the rows after ``row`` in a newest-first listing."""
+    position = f"{row.timestamp.isoformat()}|{row.id}".encode()
+    return base64.urlsafe_b64encode(position).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    """(timestamp, id) of a cursor; ValueError if it is not one."""
+    try:
+        position = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        timestamp, row_id = position.split("|")
+        return datetime.fromisoformat(timestamp), int(row_id)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise ValueError(f"Invalid cursor: {cursor!r}") from e
+
+
+def summarize(counts: Counts) -> dict:
+    by_access_type: Dict[str, int] = {}
+    for (access_type, _), count in counts.items():
+        by_access_type[access_type] = by_access_type.get(access_type, 0) + count
+    successful = sum(count for (_, success), count in counts.items() if success)
+    total = sum(counts.values())
+    return {
+        "total": total,
+        "successful": successful,
+        "failed": total - successful,
+        "by_access_type": by_access_type,
+    }
+
+
+class AccessLogStore:
+    """Monthly access log partitions and the queries over them."""
+
+    def __init__(self, retention_months: int):
+        self.retention_months = retention_months
+        self._tables: Dict[datetime, Table] = {}
+        self._months: List[datetime] = []  # ascending
+        self._loaded_at: Optional[float] = None
+        self._ddl_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self.partitions_created = 0
+        self.partitions_dropped = 0
+        self.queries = 0
+        self.partitions_scanned = 0
+        self.batches_copied = 0
+
+    async def start(self):
+        await self.load()
+        await self.apply_retention()
+        if self.retention_months > 0:
+            self._task = asyncio.create_task(self._run())
+        logger.info(
+            f"Access log store started with {len(self._months)} partitions "
+            f"(retention {self.retention_months or 'unlimited'} months)"
+        )
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(RETENTION_INTERVAL)
+            try:
+                await self.apply_retention()
+            except Exception as e:
+                logger.error(f"Error applying access log retention: {e}")
+
+    # Partition catalogue
+
+    async def load(self):
+        """Read the list of partitions from the database."""
+        async with read_engine.connect() as conn:
+            names = await conn.run_sync(lambda sync_conn: inspect(sync_conn).get_table_names())
+        tables = {}
+        for name in names:
+            match = PARTITION_NAME.match(name)
+            if match:
+                month = datetime(int(match.group(1)), int(match.group(2)), 1)
+                tables[month] = self._tables[month] if month in self._tables else partition_table(month)
+        self._set_tables(tables)
+        self._loaded_at = time.monotonic()
+
+    def _set_tables(self, tables: Dict[datetime, Table]):
+        self._tables = tables
+        self._months = sorted(tables)
+
+    async def _refresh(self):
+        if self._loaded_at is None:
+            await self.load()
+        elif (
+            month_of(datetime.utcnow()) not in self._tables
+            and time.monotonic() - self._loaded_at > REFRESH_INTERVAL
+        ):
+            await self.load()
+
+    def partitions(self, start: Optional[datetime] = None, end: Optional[datetime] = None) -> List[Table]:
+        """Partitions overlapping [start, end), newest first."""
+        return [
+            self._tables[month] for month in reversed(self._months)
+            if (start is None or add_months(month, 1) > start) and (end is None or month < end)
+        ]
+
+    async def _ensure(self, months: Iterable[datetime]):
+        """Create the partitions of ``months`` that do not exist yet."""
+        if all(month in self._tables for month in months):
+            return
+        async with self._ddl_lock:
+            missing = [month for month in months if month not in self._tables]
+            if not missing:
+                return
+            created = {month: partition_table(month) for month in missing}
+            async with engine.begin() as conn:
+                for table in created.values():
+                    await conn.run_sync(table.create, checkfirst=True)
+            self._set_tables({**self._tables, **created})
+            self.partitions_created += len(created)
+            for table in created.values():
+                logger.info(f"Created access log partition {table.name}")
+
+    # Writes
+
+    async def insert(self, session: AsyncSession, rows: List[dict]):
+        """Insert rows (with ``timestamp`` set) into their months' partitions, in ``session``.
+
+        Must come first in the session: a missing partition is created on the
+        writer connection before the session takes it for the rows. On
+        PostgreSQL batches of ``access_log_copy_rows`` or more are loaded with
+        COPY.
+        """
+        by_month: Dict[datetime, List[dict]] = {}
+        for row in rows:
+            by_month.setdefault(month_of(row["timestamp"]), []).append(row)
+        await self._refresh()
+        await self._ensure(by_month)
+
+        hourly = Counter(
+            (row["lock_id"], hour_of(row["timestamp"]), row["access_type"], bool(row["success"])) for row in rows
+        )
+        totals = Counter()
+        for (lock_id, _, access_type, success), count in hourly.items():
+            totals[(lock_id, access_type, success)] += count
+        # Sorted, so concurrent writers update rows in the same order. Executed
+        # before the rows: this begins the transaction that COPY joins.
+        await session.execute(_add_counts(ROLLUPS, ["lock_id", "hour", "access_type", "success"]), [
+            {"lock_id": lock_id, "hour": hour, "access_type": access_type, "success": success, "count": count}
+            for (lock_id, hour, access_type, success), count in sorted(hourly.items())
+        ])
+        await session.execute(_add_counts(TOTALS, ["lock_id", "access_type", "success"]), [
+            {"lock_id": lock_id, "access_type": access_type, "success": success, "count": count}
+            for (lock_id, access_type, success), count in sorted(totals.items())
+        ])
+
+        copy = engine.dialect.name == "postgresql" and len(rows) >= settings.access_log_copy_rows
+        for month, group in by_month.items():
+            if copy:
+                await _copy_rows(session, self._tables[month], group)
+            else:
+                await session.execute(insert(self._tables[month]), group)
+        if copy:
+            self.batches_copied += 1
+
+    async def delete_lock(self, session: AsyncSession, lock_id: int):
+        """Delete the logs of a lock from every partition, in ``session``."""
+        await self._refresh()
+        for table in list(self.partitions()) + [ROLLUPS, TOTALS]:
+            await session.execute(delete(table).where(table.c.lock_id == lock_id))
+
+    # Reads
+
+    async def recent(
+        self,
+        session: AsyncSession,
+        lock_id: Optional[int] = None,
+        access_type: Optional[str] = None,
+        success: Optional[bool] = None,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+        before: Optional[Tuple[datetime, int]] = None,
+        limit: int = 100,
+    ) -> list:
+        """Newest logs matching the filters (and below ``before``), reading only as many partitions as needed."""
+        await self._refresh()
+        self.queries += 1
+        route_end = end
+        if before is not None and (end is None or before[0] < end):
+            route_end = before[0] + timedelta(microseconds=1)
+        rows = []
+        for table in self.partitions(start, route_end):
+            if len(rows) >= limit:
+                break
+            query = _filtered(select(table), table, lock_id, access_type, success)
+            if start is not None:
+                query = query.where(table.c.timestamp >= start)
+            if end is not None:
+                query = query.where(table.c.timestamp < end)
+            if before is not None:
+                # Range on the indexed timestamp, the id only breaks ties
+                query = query.where(
+                    table.c.timestamp <= before[0],
+                    or_(table.c.timestamp < before[0], table.c.id < before[1]),
+                )
+            query = query.order_by(table.c.timestamp.desc(), table.c.id.desc()).limit(limit - len(rows))
+            rows.extend((await session.execute(query)).all())
+            self.partitions_scanned += 1
+        return rows
+
+    async def page(
+        self, session: AsyncSession, cursor: Optional[str] = None, limit: int = 100, **filters
+    ) -> Tuple[list, Optional[str]]:
+        """A page of ``recent`` after ``cursor``, with the cursor of the next page (None at the end)."""
+        before = decode_cursor(cursor) if cursor else None
+        rows = await self.recent(session, before=before, limit=limit + 1, **filters)
+        if len(rows) <= limit:
+            return rows, None
+        return rows[:limit], encode_cursor(rows[limit - 1])
+
+    async def counts(
+        self,
+        session: AsyncSession,
+        lock_id: Optional[int] = None,
+        access_type: Optional[str] = None,
+        success: Optional[bool] = None,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+    ) -> Counts:
+        """Exact log counts by (access_type, success) in [start, end), from the rollups."""
+        if start is None and end is None:
+            return await self._rollup_counts(session, TOTALS, lock_id, access_type, success)
+        # Whole hours from the hourly rollups, the partial hours around them from the logs
+        first_hour = None if start is None else hour_of(start)
+        if first_hour is not None and first_hour < start:
+            first_hour += timedelta(hours=1)
+        last_hour = None if end is None else hour_of(end)
+        if first_hour is not None and last_hour is not None and first_hour >= last_hour:
+            return await self._log_counts(session, lock_id, access_type, success, start, end)
+        counts = Counter(await self._rollup_counts(
+            session, ROLLUPS, lock_id, access_type, success, first_hour, last_hour
+        ))
+        if start is not None and start < first_hour:
+            counts.update(await self._log_counts(session, lock_id, access_type, success, start, first_hour))
+        if end is not None and last_hour < end:
+            counts.update(await self._log_counts(session, lock_id, access_type, success, last_hour, end))
+        return dict(counts)
+
+    async def summary(self, session: AsyncSession, **filters) -> dict:
+        """``counts`` as total / successful / failed / by_access_type."""
+        return summarize(await self.counts(session, **filters))
+
+    async def hourly(
+        self,
+        session: AsyncSession,
+        start: datetime,
+        end: datetime,
+        lock_id: Optional[int] = None,
+        access_type: Optional[str] = None,
+    ) -> List[dict]:
+        """Successful and failed attempts per hour of [start, end), hours without logs left out."""
+        query = _filtered(
+            select(ROLLUPS.c.hour, ROLLUPS.c.success, func.sum(ROLLUPS.c.count)),
+            ROLLUPS, lock_id, access_type, None,
+        ).where(ROLLUPS.c.hour >= hour_of(start), ROLLUPS.c.hour < end)
+        query = query.group_by(ROLLUPS.c.hour, ROLLUPS.c.success).order_by(ROLLUPS.c.hour)
+        series: Dict[datetime, dict] = {}
+        for hour, success, count in (await session.execute(query)).all():
+            point = series.setdefault(hour, {"hour": hour, "successful": 0, "failed": 0})
+            point["successful" if success else "failed"] += count
+        return list(series.values())
+
+    async def _rollup_counts(
+        self,
+        session: AsyncSession,
+        table: Table,
+        lock_id: Optional[int],
+        access_type: Optional[str],
+        success: Optional[bool],
+        first_hour: Optional[datetime] = None,
+        last_hour: Optional[datetime] = None,
+    ) -> Counts:
+        query = _filtered(
+            select(table.c.access_type, table.c.success, func.sum(table.c.count)),
+            table, lock_id, access_type, success,
+        )
+        if first_hour is not None:
+            query = query.where(table.c.hour >= first_hour)
+        if last_hour is not None:
+            query = query.where(table.c.hour < last_hour)
+        query = query.group_by(table.c.access_type, table.c.success)
+        return {
+            (access_type, bool(success)): count
+            for access_type, success, count in (await session.execute(query)).all() if count
+        }
+
+    async def _log_counts(
+        self,
+        session: AsyncSession,
+        lock_id: Optional[int],
+        access_type: Optional[str],
+        success: Optional[bool],
+        start: Optional[datetime],
+        end: Optional[datetime],
+    ) -> Counts:
+        await self._refresh()
+        counts = Counter()
+        for table in self.partitions(start, end):
+            query = _filtered(
+                select(table.c.access_type, table.c.success, func.count()),
+                table, lock_id, access_type, success,
+            )
+            if start is not None:
+                query = query.where(table.c.timestamp >= start)
+            if end is not None:
+                query = query.where(table.c.timestamp < end)
+            query = query.group_by(table.c.access_type, table.c.success)
+            for row_type, row_success, count in (await session.execute(query)).all():
+                counts[(row_type, bool(row_success))] += count
+        return dict(counts)
+
+    # Retention
+
+    async def drop_partitions(self, before: Optional[datetime] = None) -> List[str]:
+        """Drop every partition of a month before ``before`` (all when None)."""
+        await self._refresh()
+        async with self._ddl_lock:
+            doomed = [month for month in self._months if before is None or month < before]
+            if not doomed:
+                return []
+            async with engine.begin() as conn:
+                for month in doomed:
+                    await conn.run_sync(self._tables[month].drop, checkfirst=True)
+                await self._drop_rollups(conn, before)
+            self._set_tables({month: table for month, table in self._tables.items() if month not in doomed})
+        self.partitions_dropped += len(doomed)
+        names = [partition_name(month) for month in doomed]
+        logger.info(f"Dropped access log partitions: {', '.join(names)}")
+        if engine.dialect.name == "sqlite":
+            async with engine.connect() as conn:
+                # Gives the pages back to the file system under incremental auto-vacuum;
+                # run as a script, a plain execute frees a single page per step
+                if (await conn.exec_driver_sql("PRAGMA auto_vacuum")).scalar() == 2:
+                    raw = await conn.get_raw_connection()
+                    await raw.driver_connection.executescript("PRAGMA incremental_vacuum")
+        return names
+
+    async def _drop_rollups(self, conn, before: Optional[datetime]):
+        """Take the dropped logs out of the rollups, in the transaction dropping them."""
+        if before is None:
+            await conn.execute(delete(ROLLUPS))
+            await conn.execute(delete(TOTALS))
+            return
+        expired = (await conn.execute(
+            select(ROLLUPS.c.lock_id, ROLLUPS.c.access_type, ROLLUPS.c.success, func.sum(ROLLUPS.c.count))
+            .where(ROLLUPS.c.hour < before)
+            .group_by(ROLLUPS.c.lock_id, ROLLUPS.c.access_type, ROLLUPS.c.success)
+        )).all()
+        if expired:
+            await conn.execute(
+                update(TOTALS)
+                .where(
+                    TOTALS.c.lock_id == bindparam("b_lock_id"),
+                    TOTALS.c.access_type == bindparam("b_access_type"),
+                    TOTALS.c.success == bindparam("b_success"),
+                )
+                .values(count=TOTALS.c.count - bindparam("b_count")),
+                [
+                    {"b_lock_id": lock_id, "b_access_type": access_type, "b_success": success, "b_count": count}
+                    for lock_id, access_type, success, count in expired
+                ],
+            )
+            await conn.execute(delete(TOTALS).where(TOTALS.c.count <= 0))
+        await conn.execute(delete(ROLLUPS).where(ROLLUPS.c.hour < before))
+
+    async def apply_retention(self, now: Optional[datetime] = None) -> List[str]:
+        """Drop partitions older than ``retention_months`` full months."""
+        if self.retention_months <= 0:
+            return []
+        cutoff = add_months(month_of(now or datetime.utcnow()), -self.retention_months)
+        return await self.drop_partitions(before=cutoff)
+
+    def stats(self) -> dict:
+        return {
+            "partitions": len(self._months),
+            "oldest": partition_name(self._months[0]) if self._months else None,
+            "newest": partition_name(self._months[-1]) if self._months else None,
+            "retention_months": self.retention_months,
+            "partitions_created": self.partitions_created,
+            "partitions_dropped": self.partitions_dropped,
+            "queries": self.queries,
+            "partitions_scanned": self.partitions_scanned,
+            "batches_copied": self.batches_copied,
+        }
+
+
+# Global access log store instance
+access_log_store = AccessLogStore(retention_months=settings.access_log_retention_months)
@@ -0,0 +1,233 @@
+"""
+Streaming bulk import of locks, PINs and key tags.
+
+The request body is read chunk by chunk as CSV (header row first) or NDJSON,
+one row per line. Every row has a ``kind``:
+
+    kind,device_id,name,location,code,card_uid
+    lock,domek_7,Domek 7,Plaża,,
+    pin,domek_7,,,482913,
+    key_tag,domek_7,,,,04A1B2C3
+
+Rows are validated with the ``Import*Row`` schemas as they arrive and written
+in transactions of ``import_batch_size`` rows with Core bulk inserts, applying
+the same rules as the API (unique ``device_id``, one PIN and one key tag per
+lock). Invalid rows are skipped and reported with their line number; the rest
+of the import goes on. When the stream ends, one bulk sync job covers every
+lock that got new credentials. Only the current batch is held in memory.
+"""
+import codecs
+import csv
+import json
+import logging
+from typing import AsyncIterator, Dict, List, Optional, Set, Tuple
+
+from pydantic import Field, TypeAdapter, ValidationError
+from sqlalchemy import insert, select
+from typing_extensions import Annotated
+
+from app.config import settings
+from app.config_cache import config_cache
+from app.credentials import credential_index
+from app.database import async_session_maker
+from app.fleet import fleet_state
+from app.models import AccessCode, Lock, RFIDCard
+from app.schemas import ImportKeyTagRow, ImportLockRow, ImportPinRow, ImportResult, ImportRow, ImportRowError
+from app.sync_engine import sync_engine
+from app.validity import validity_scheduler
+
+logger = logging.getLogger(__name__)
+
+FORMATS = ("csv", "ndjson")
+
+_row_adapter = TypeAdapter(Annotated[ImportRow, Field(discriminator="kind")])
+
+
+async def iter_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    """Decode a byte stream into lines without buffering more than one line."""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    pending = ""
+    async for chunk in chunks:
+        pending += decoder.decode(chunk)
+        if "\n" not in pending:
+            continue
+        *lines, pending = pending.split("\n")
+        for line in lines:
+            yield line.rstrip("\r")
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield pending.rstrip("\r")
+
+
+async def iter_records(chunks: AsyncIterator[bytes], fmt: str) -> AsyncIterator[Tuple[int, Optional[dict], Optional[str]]]:
+    """(line number, row dict, parse error) for every non-empty line.
+
+    CSV fields must not contain line breaks; empty CSV fields count as missing.
+    """
+    header: Optional[List[str]] = None
+    line_no = 0
+    async for line in iter_lines(chunks):
+        line_no += 1
+        if not line.strip():
+            continue
+        if fmt == "ndjson":
+            try:
+                data = json.loads(line)
+            except ValueError as e:
+                yield line_no, None, f"Invalid JSON: {e}"
+                continue
+            if not isinstance(data, dict):
+                yield line_no, None, "Expected a JSON object"
+                continue
+            yield line_no, data, None
+            continue
+
+        values = next(csv.reader([line]))
+        if header is None:
+            header = [name.strip() for name in values]
+            continue
+        if len(values) > len(header):
+            yield line_no, None, f"Expected {len(header)} columns, got {len(values)}"
+            continue
+        yield line_no, {name: value for name, value in zip(header, values) if value != ""}, None
+
+
+def _validation_message(error: ValidationError) -> str:
+    return "; ".join(
+        f"{'.'.join(str(part) for part in item['loc'])}: {item['msg']}" if item["loc"] else item["msg"]
+        for item in error.errors()
+    )
+
+
+class BulkImporter:
+    """Validates and writes one import stream."""
+
+    def __init__(self, batch_size: int, max_errors: int):
+        self.batch_size = max(1, batch_size)
+        self.max_errors = max_errors
+        self.result = ImportResult(
+            rows=0, locks_created=0, pins_created=0, key_tags_created=0, failed=0, errors=[],
+        )
+        # Locks that got new credentials and need one sync at the end
+        self.affected_lock_ids: Set[int] = set()
+
+    def _error(self, line: int, message: str):
+        self.result.failed += 1
+        if len(self.result.errors) < self.max_errors:
+            self.result.errors.append(ImportRowError(line=line, error=message))
+
+    async def run(self, chunks: AsyncIterator[bytes], fmt: str) -> ImportResult:
+        batch: List[Tuple[int, ImportRow]] = []
+        async for line, data, parse_error in iter_records(chunks, fmt):
+            self.result.rows += 1
+            if parse_error:
+                self._error(line, parse_error)
+                continue
+            try:
+                batch.append((line, _row_adapter.validate_python(data)))
+            except ValidationError as e:
+                self._error(line, _validation_message(e))
+                continue
+            if len(batch) >= self.batch_size:
+                await self._write_batch(batch)
+                batch = []
+        if batch:
+            await self._write_batch(batch)
+
+        if self.affected_lock_ids:
+            job = sync_engine.start_job(lock_ids=self.affected_lock_ids, reason="bulk_import")
+            self.result.sync_job_id = job.id
+        logger.info(
+            f"Bulk import: {self.result.rows} rows, {self.result.locks_created} locks, "
+            f"{self.result.pins_created} PINs, {self.result.key_tags_created} key tags, "
+            f"{self.result.failed} failed"
+        )
+        return self.result
+
+    async def _write_batch(self, batch: List[Tuple[int, ImportRow]]):
+        errors: List[Tuple[int, str]] = []
+        async with async_session_maker() as session:
+            try:
+                device_ids = {row.device_id for _, row in batch}
+                lock_ids: Dict[str, int] = dict((await session.execute(
+                    select(Lock.device_id, Lock.id).where(Lock.device_id.in_(device_ids))
+                )).all())
+
+                # Locks first, so credentials in the same batch can refer to them
+                new_locks = {}
+                for line, row in batch:
+                    if not isinstance(row, ImportLockRow):
+                        continue
+                    if row.device_id in lock_ids or row.device_id in new_locks:
+                        errors.append((line, "Lock with this device_id already exists"))
+                        continue
+                    new_locks[row.device_id] = row.model_dump(exclude={"kind"})
+                created_locks = []
+                if new_locks:
+                    await session.execute(insert(Lock), list(new_locks.values()))
+                    created_locks = (await session.execute(
+                        select(Lock).where(Lock.device_id.in_(list(new_locks)))
+                    )).scalars().all()
+                    lock_ids.update((lock.device_id, lock.id) for lock in created_locks)
+
+                referenced = list(set(lock_ids.values()))
+                with_pin = set((await session.execute(
+                    select(AccessCode.lock_id).where(AccessCode.lock_id.in_(referenced))
+                )).scalars())
+                with_tag = set((await session.execute(
+                    select(RFIDCard.lock_id).where(RFIDCard.lock_id.in_(referenced), RFIDCard.card_type == "key_tag")
+                )).scalars())
+
+                pins, tags = [], []
+                for line, row in batch:
+                    if isinstance(row, ImportLockRow):
+                        continue
+                    lock_id = lock_ids.get(row.device_id)
+                    if lock_id is None:
+                        errors.append((line, f"Lock {row.device_id} not found"))
+                    elif isinstance(row, ImportPinRow):
+                        if lock_id in with_pin:
+                            errors.append((line, "PIN already exists for this lock. Only one PIN per lock is allowed."))
+                            continue
+                        with_pin.add(lock_id)
+                        pins.append({**row.model_dump(exclude={"kind", "device_id"}), "lock_id": lock_id})
+                    elif isinstance(row, ImportKeyTagRow):
+                        if lock_id in with_tag:
+                            errors.append((line, "Key Tag already exists for this lock. Only one Key Tag per lock is allowed."))
+                            continue
+                        with_tag.add(lock_id)
+                        tags.append({**row.model_dump(exclude={"kind", "device_id"}), "lock_id": lock_id, "card_type": "key_tag"})
+
+                if pins:
+                    await session.execute(insert(AccessCode), pins)
+                if tags:
+                    await session.execute(insert(RFIDCard), tags)
+                await session.commit()
+            except Exception as e:
+                await session.rollback()
+                logger.error(f"Bulk import batch failed: {e}")
+                for line, _ in batch:
+                    self._error(line, f"Batch not written: {e}")
+                return
+
+        for line, message in sorted(errors):
+            self._error(line, message)
+        for lock in created_locks:
+            fleet_state.add(lock)
+        changed = {row["lock_id"] for row in pins} | {row["lock_id"] for row in tags}
+        # Core inserts bypass the session events that keep the cache current
+        config_cache.invalidate(changed)
+        await credential_index.reload_locks(changed)
+        validity_scheduler.notify(
+            (row[bound], row["lock_id"]) for row in pins for bound in ("valid_from", "valid_until") if row[bound]
+        )
+        self.affected_lock_ids |= changed
+        self.result.locks_created += len(created_locks)
+        self.result.pins_created += len(pins)
+        self.result.key_tags_created += len(tags)
+
+
+async def import_stream(chunks: AsyncIterator[bytes], fmt: str) -> ImportResult:
+    """Import a CSV or NDJSON byte stream, see the module docstring."""
+    importer = BulkImporter(settings.import_batch_size, settings.import_max_errors)
+    return await importer.run(chunks, fmt)
@@ -0,0 +1,120 @@
+"""
+MQTT payload codecs.
+
+Devices publish JSON on ``pinelock/<device_id>/<type>`` or a compact binary
+encoding on ``pinelock/<device_id>/<type>/<suffix>`` (``/mp`` for MessagePack).
+The server decodes by topic suffix, remembers which codec each device last used
+and replies to it in the same encoding. Devices can also be pinned to a codec
+with ``MQTT_DEVICE_CODECS``.
+"""
+import json
+import logging
+from typing import Dict, List, Optional
+
+from app.config import settings
+
+try:
+    import msgpack
+except ImportError:  # optional, JSON keeps working without it
+    msgpack = None
+
+logger = logging.getLogger(__name__)
+
+
+class Codec:
+    """Encodes payload dicts to bytes and back."""
+
+    name = ""
+    suffix: Optional[str] = None  # topic suffix, None for the default encoding
+
+    def encode(self, payload: dict) -> bytes:
+        raise NotImplementedError
+
+    def decode(self, payload: bytes) -> dict:
+        raise NotImplementedError
+
+
+class JsonCodec(Codec):
+    name = "json"
+
+    def __init__(self):
+        self._encoder = json.JSONEncoder(separators=(",", ":"))
+        self._decoder = json.JSONDecoder()
+
+    def encode(self, payload: dict) -> bytes:
+        return self._encoder.encode(payload).encode()
+
+    def decode(self, payload: bytes) -> dict:
+        data = self._decoder.decode(payload.decode())
+        if not isinstance(data, dict):
+            raise ValueError("payload is not an object")
+        return data
+
+
+class MsgpackCodec(Codec):
+    name = "msgpack"
+    suffix = "mp"
+
+    def __init__(self):
+        self._packer = msgpack.Packer()
+
+    def encode(self, payload: dict) -> bytes:
+        return self._packer.pack(payload)
+
+    def decode(self, payload: bytes) -> dict:
+        data = msgpack.unpackb(payload, raw=False)
+        if not isinstance(data, dict):
+            raise ValueError("payload is not a map")
+        return data
+
+
+class CodecRegistry:
+    """Selects codecs by topic suffix and remembers each device's choice."""
+
+    def __init__(self, default: str = "json", device_codecs: str = ""):
+        self._by_name: Dict[str, Codec] = {}
+        self._by_suffix: Dict[Optional[str], Codec] = {}
+        self._pinned: Dict[str, Codec] = {}
+        self._learned: Dict[str, Codec] = {}
+        self.register(JsonCodec())
+        if msgpack is not None:
+            self.register(MsgpackCodec())
+        self.default = self._by_name.get(default) or self._by_name["json"]
+        if default not in self._by_name:
+            logger.warning(f"Unknown MQTT codec '{default}', using json")
+        for entry in filter(None, (item.strip() for item in device_codecs.split(","))):
+            device_id, _, name = entry.partition("=")
+            codec = self._by_name.get(name.strip())
+            if codec is None:
+                logger.warning(f"Unknown MQTT codec '{name}' for device {device_id}")
+                continue
+            self._pinned[device_id.strip()] = codec
+
+    def register(self, codec: Codec):
+        self._by_name[codec.name] = codec
+        self._by_suffix[codec.suffix] = codec
+
+    def for_suffix(self, suffix: Optional[str]) -> Optional[Codec]:
+        """Codec for an inbound topic suffix (None: plain topic, i.e. JSON)."""
+        return self._by_suffix.get(suffix)
+
+    def codecs(self) -> List[Codec]:
+        return list(self._by_name.values())
+
+    def for_device(self, device_id: str) -> Codec:
+        """Codec for outbound messages to ``device_id``."""
+        return self._pinned.get(device_id) or self._learned.get(device_id) or self.default
+
+    def remember(self, device_id: str, codec: Codec):
+        if self._learned.get(device_id) is not codec:
+            self._learned[device_id] = codec
+
+    def topic(self, base_topic: str, codec: Codec) -> str:
+        return f"{base_topic}/{codec.suffix}" if codec.suffix else base_topic
+
+
+# Global codec registry instance
+codec_registry = CodecRegistry(
+    default=settings.mqtt_default_codec,
+    device_codecs=settings.mqtt_device_codecs,
+)
@@ -0,0 +1,152 @@
+"""
+Per-device config cache.
+
+Every lock's config payload is cached together with a content hash, its
+``version``. The version is sent inside each config; a node that reconnects
+reports it in its sync request and gets ``{"up_to_date": true}`` back instead
+of the full config when nothing changed.
+
+Entries are invalidated from SQLAlchemy session events whenever a lock's
+AccessCode or RFIDCard rows change (all entries when a Master PIN changes), so
+API, UI and any other writer going through the ORM keep the cache correct.
+Core-level bulk writes must call ``invalidate`` themselves.
+
+Across several server processes (``MQTT_SHARED_GROUP``) other members cannot
+see local invalidations, so caching is off there; versions are still computed
+and compared, which keeps the small "up_to_date" replies.
+"""
+import hashlib
+import json
+import logging
+from typing import Dict, Iterable, Optional, Set, Tuple
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.models import AccessCode, Lock, RFIDCard
+
+logger = logging.getLogger(__name__)
+
+# Marker in the pending invalidation set meaning "every lock"
+ALL_LOCKS = None
+
+
+def config_version(payload: dict) -> str:
+    """Content hash of a config payload (without its version field)."""
+    canonical = json.dumps(payload, sort_keys=True, separators=(",", ":"))
+    return hashlib.blake2b(canonical.encode(), digest_size=8).hexdigest()
+
+
+class ConfigEntry:
+    __slots__ = ("device_id", "payload", "version", "encoded", "recorded")
+
+    def __init__(self, device_id: str, payload: dict, version: str):
+        self.device_id = device_id
+        self.payload = payload
+        self.version = version
+        self.encoded: Dict[str, bytes] = {}  # codec name -> serialized payload, see MQTTClient.publish
+        # (seq, delta_enabled) once config_sequencer recorded this payload, see services.sync_device
+        self.recorded: Optional[Tuple[int, bool]] = None
+
+
+class ConfigCache:
+    """Config payloads and versions keyed by lock id."""
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self._entries: Dict[int, ConfigEntry] = {}
+        # Bumped on every invalidation; stores that started before it are dropped
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.up_to_date = 0
+        self.invalidations = 0
+
+    def generation(self) -> int:
+        return self._generation
+
+    def get(self, lock_id: int) -> Optional[ConfigEntry]:
+        entry = self._entries.get(lock_id) if self.enabled else None
+        if entry is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return entry
+
+    def store(self, lock_id: int, device_id: str, payload: dict, generation: int) -> ConfigEntry:
+        """Wrap ``payload`` (built from data read at ``generation``) with its version.
+
+        The payload gets a ``version`` field. It is only cached if no
+        invalidation happened since ``generation``.
+        """
+        version = config_version(payload)
+        payload["version"] = version
+        entry = ConfigEntry(device_id, payload, version)
+        if self.enabled and generation == self._generation:
+            self._entries[lock_id] = entry
+        return entry
+
+    def invalidate(self, lock_ids: Iterable[Optional[int]]):
+        """Drop entries of ``lock_ids``; ``ALL_LOCKS`` (None) clears everything."""
+        lock_ids = set(lock_ids)
+        if not lock_ids:
+            return
+        self._generation += 1
+        self.invalidations += 1
+        if ALL_LOCKS in lock_ids:
+            self._entries.clear()
+            logger.debug("Config cache cleared")
+            return
+        for lock_id in lock_ids:
+            self._entries.pop(lock_id, None)
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "up_to_date": self.up_to_date,
+            "invalidations": self.invalidations,
+        }
+
+
+def _changed_lock_ids(session: Session) -> Set[Optional[int]]:
+    """Lock ids whose config is affected by the objects flushed in ``session``."""
+    lock_ids: Set[Optional[int]] = set()
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, Lock) and obj in session.deleted:
+            # Its config sequence goes with it
+            lock_ids.add(obj.id)
+            continue
+        if not isinstance(obj, (AccessCode, RFIDCard)):
+            continue
+        lock_ids.add(obj.lock_id)
+        # Moved to another lock: the old one changes too
+        history = inspect(obj).attrs.lock_id.history
+        lock_ids.update(history.deleted or ())
+    return lock_ids
+
+
+@event.listens_for(Session, "before_flush")
+def _collect_changes(session, flush_context, instances):
+    changed = _changed_lock_ids(session)
+    if changed:
+        session.info.setdefault("config_cache_changed", set()).update(changed)
+
+
+@event.listens_for(Session, "after_commit")
+def _apply_changes(session):
+    changed = session.info.pop("config_cache_changed", None)
+    if changed:
+        config_cache.invalidate(changed)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_changes(session):
+    session.info.pop("config_cache_changed", None)
+
+
+# Global config cache instance
+config_cache = ConfigCache(enabled=settings.config_cache_enabled and not settings.mqtt_shared_group)
@@ -0,0 +1,305 @@
+"""
+Sequenced delta config.
+
+Every lock has a config sequence (``DeviceConfigState.seq``) that only grows.
+When its config changes, the difference to the config at the previous sequence
+is stored as small add/remove deltas (``ConfigDelta``), one sequence number
+each, and only those are published:
+
+    pinelock/<device_id>/delta   {"seq": 12, "base": 11, "ops": [["add_pin", "1234"], ["remove_card", "04A1B2C3"]]}
+
+Ops: ``add_pin``, ``remove_pin``, ``add_card``, ``remove_card`` and
+``key_tag`` (value None clears it). A node applies a delta only if ``base`` is
+the sequence it holds; otherwise it asks for a sync ``since`` its sequence and
+gets the missing deltas, or a chunked full snapshot when they are no longer
+kept (or it has none):
+
+    pinelock/<device_id>/config  {"seq": 12, "chunk": 0, "chunks": 3, "access_codes": [...], "rfid_cards": [...], "key_tag": ...}
+
+Messages are sized for the firmware's 256-byte JSON document
+(``CONFIG_DELTA_MAX_OPS``, ``CONFIG_SNAPSHOT_CHUNK_ITEMS``). Nodes that never
+sent ``since`` keep receiving the full config list.
+
+Whenever the sequence moves, the current config (or only its sequence, when it
+does not fit one message) is also published retained on
+``pinelock/<device_id>/config/retained``, so a reconnecting node learns whether
+it is current straight from the broker (``CONFIG_RETAINED``).
+"""
+import asyncio
+import logging
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import select, insert, delete, bindparam
+
+from app.config import settings
+from app.database import async_session_maker, read_session_maker
+from app.models import DeviceConfigState, ConfigDelta
+from app.mqtt_client import mqtt_client
+
+logger = logging.getLogger(__name__)
+
+CONFIG_KEYS = ("access_codes", "rfid_cards", "key_tag")
+
+
+def config_of(payload: dict) -> dict:
+    """The credential part of a config payload (drops ``version`` and the like)."""
+    return {key: payload.get(key) for key in CONFIG_KEYS}
+
+
+def diff_ops(old: dict, new: dict) -> List[list]:
+    """Ops turning config ``old`` into ``new``; removals first to free node slots."""
+    ops: List[list] = []
+    for field, add, remove in (("access_codes", "add_pin", "remove_pin"), ("rfid_cards", "add_card", "remove_card")):
+        before, after = old.get(field) or [], new.get(field) or []
+        before_set, after_set = set(before), set(after)
+        ops.extend([remove, value] for value in dict.fromkeys(before) if value not in after_set)
+        ops.extend([add, value] for value in dict.fromkeys(after) if value not in before_set)
+    if old.get("key_tag") != new.get("key_tag"):
+        ops.append(["key_tag", new.get("key_tag")])
+    # Removals of both kinds before any addition
+    return sorted(ops, key=lambda op: not op[0].startswith("remove"))
+
+
+class Advance:
+    """Result of recording one lock's current config."""
+    __slots__ = ("lock_id", "device_id", "config", "previous_seq", "seq", "deltas", "delta_enabled")
+
+    def __init__(self, lock_id: int, device_id: str, config: dict, previous_seq: int):
+        self.lock_id = lock_id
+        self.device_id = device_id
+        self.config = config
+        self.previous_seq = previous_seq
+        self.seq = previous_seq
+        self.deltas: List[Tuple[int, list]] = []  # (seq, ops) created by this advance
+        self.delta_enabled = False
+
+    @property
+    def changed(self) -> bool:
+        return self.seq != self.previous_seq
+
+
+class ConfigSequencer:
+    """Keeps per-lock config sequences and delta history, builds delta/snapshot messages."""
+
+    def __init__(self, max_ops: int, chunk_items: int, history: int, retain: bool = True):
+        self.max_ops = max(1, max_ops)
+        self.chunk_items = max(1, chunk_items)
+        self.history = max(1, history)
+        self.retain = retain
+        # Serializes read-modify-write of sequences
+        self._lock = asyncio.Lock()
+        self.deltas_created = 0
+        self.deltas_published = 0
+        self.snapshots_published = 0
+        self.catch_ups = 0
+        self.retained_published = 0
+        self.unchanged = 0
+
+    async def advance(
+        self,
+        items: Iterable[Tuple[int, str, dict]],
+        delta_capable: Iterable[int] = (),
+    ) -> Dict[int, Advance]:
+        """Record the current config of each (lock_id, device_id, payload).
+
+        Changes since the stored snapshot become new deltas with the next
+        sequence numbers. Locks in ``delta_capable`` are marked as understanding
+        deltas. All of it happens in one transaction, which is skipped when
+        nothing changed: a reconnect storm of up-to-date nodes only reads.
+        """
+        items = list(items)
+        delta_capable = set(delta_capable)
+        results: Dict[int, Advance] = {}
+        if not items:
+            return results
+        lock_ids = [lock_id for lock_id, _, _ in items]
+
+        async with read_session_maker() as session:
+            unchanged = self._unchanged(items, delta_capable, await self._states(session, lock_ids))
+        if unchanged is not None:
+            self.unchanged += 1
+            return unchanged
+
+        async with self._lock, async_session_maker() as session:
+            states = await self._states(session, lock_ids)
+            rows = []
+            now = datetime.utcnow()
+            for lock_id, device_id, payload in items:
+                config = config_of(payload)
+                state = states.get(lock_id)
+                if state is None:
+                    state = DeviceConfigState(lock_id=lock_id, seq=0, snapshot=None, delta_enabled=False)
+                    session.add(state)
+                    states[lock_id] = state
+                result = Advance(lock_id, device_id, config, state.seq)
+                if lock_id in delta_capable and not state.delta_enabled:
+                    state.delta_enabled = True
+
+                if state.snapshot is None:
+                    # Nothing to diff against: nodes behind this get a snapshot
+                    state.seq += 1
+                    state.snapshot = config
+                    state.updated_at = now
+                else:
+                    ops = diff_ops(state.snapshot, config)
+                    for start in range(0, len(ops), self.max_ops):
+                        state.seq += 1
+                        chunk = ops[start:start + self.max_ops]
+                        result.deltas.append((state.seq, chunk))
+                        rows.append({"lock_id": lock_id, "seq": state.seq, "ops": chunk, "created_at": now})
+                    if ops:
+                        state.snapshot = config
+                        state.updated_at = now
+
+                result.seq = state.seq
+                result.delta_enabled = bool(state.delta_enabled)
+                results[lock_id] = result
+
+            if rows:
+                await session.execute(insert(ConfigDelta.__table__), rows)
+                table = ConfigDelta.__table__
+                await session.execute(
+                    delete(table).where(
+                        table.c.lock_id == bindparam("b_lock_id"),
+                        table.c.seq <= bindparam("b_oldest"),
+                    ),
+                    [
+                        {"b_lock_id": r.lock_id, "b_oldest": r.seq - self.history}
+                        for r in results.values() if r.deltas
+                    ],
+                )
+                self.deltas_created += len(rows)
+            await session.commit()
+        return results
+
+    @staticmethod
+    async def _states(session, lock_ids: List[int]) -> Dict[int, DeviceConfigState]:
+        return {
+            state.lock_id: state
+            for state in (await session.execute(
+                select(DeviceConfigState).where(DeviceConfigState.lock_id.in_(lock_ids))
+            )).scalars()
+        }
+
+    def _unchanged(
+        self, items: List[Tuple[int, str, dict]], delta_capable: Set[int], states: Dict[int, DeviceConfigState]
+    ) -> Optional[Dict[int, Advance]]:
+        """Advances of ``items`` if every config is recorded as it is, else None."""
+        results: Dict[int, Advance] = {}
+        for lock_id, device_id, payload in items:
+            state = states.get(lock_id)
+            config = config_of(payload)
+            if (
+                state is None or state.snapshot is None or diff_ops(state.snapshot, config)
+                or (lock_id in delta_capable and not state.delta_enabled)
+            ):
+                return None
+            results[lock_id] = self.unchanged_advance(lock_id, device_id, config, state.seq, state.delta_enabled)
+        return results
+
+    @staticmethod
+    def unchanged_advance(lock_id: int, device_id: str, config: dict, seq: int, delta_enabled: bool) -> Advance:
+        """An ``Advance`` for a config already recorded at ``seq``."""
+        result = Advance(lock_id, device_id, config, seq)
+        result.delta_enabled = bool(delta_enabled)
+        return result
+
+    async def deltas_since(self, lock_id: int, since: int, seq: int) -> Optional[List[Tuple[int, list]]]:
+        """Deltas ``since + 1 .. seq`` of a lock, or None if any of them is gone."""
+        if since <= 0 or since >= seq:
+            return None
+        async with read_session_maker() as session:
+            deltas = (await session.execute(
+                select(ConfigDelta.seq, ConfigDelta.ops)
+                .where(ConfigDelta.lock_id == lock_id, ConfigDelta.seq > since, ConfigDelta.seq <= seq)
+                .order_by(ConfigDelta.seq)
+            )).all()
+        if len(deltas) != seq - since:
+            return None
+        return [(delta_seq, ops) for delta_seq, ops in deltas]
+
+    def snapshot_messages(self, config: dict, seq: int) -> List[dict]:
+        """``config`` at ``seq`` split into chunks; the first one carries the key tag."""
+        items = [("access_codes", code) for code in dict.fromkeys(config.get("access_codes") or [])]
+        items += [("rfid_cards", uid) for uid in dict.fromkeys(config.get("rfid_cards") or [])]
+        chunks = [items[start:start + self.chunk_items] for start in range(0, len(items), self.chunk_items)] or [[]]
+        messages = []
+        for index, chunk in enumerate(chunks):
+            message = {"seq": seq, "chunk": index, "chunks": len(chunks), "access_codes": [], "rfid_cards": []}
+            for field, value in chunk:
+                message[field].append(value)
+            if index == 0:
+                message["key_tag"] = config.get("key_tag")
+            messages.append(message)
+        return messages
+
+    @staticmethod
+    def delta_messages(deltas: List[Tuple[int, list]]) -> List[dict]:
+        return [{"seq": seq, "base": seq - 1, "ops": ops} for seq, ops in deltas]
+
+    async def publish_deltas(self, device_id: str, deltas: List[Tuple[int, list]]) -> bool:
+        ok = True
+        for message in self.delta_messages(deltas):
+            ok = await mqtt_client.publish(device_id, "delta", message) and ok
+        self.deltas_published += len(deltas)
+        return ok
+
+    async def publish_snapshot(self, device_id: str, config: dict, seq: int) -> bool:
+        messages = self.snapshot_messages(config, seq)
+        ok = True
+        for message in messages:
+            ok = await mqtt_client.publish(device_id, "config", message) and ok
+        self.snapshots_published += 1
+        logger.info(f"Sent config snapshot of {device_id} at seq {seq} in {len(messages)} chunks")
+        return ok
+
+    def retained_message(self, config: dict, seq: int) -> dict:
+        """What a node finds on ``config/retained`` when it subscribes.
+
+        The whole snapshot when it fits one chunk, otherwise just its sequence;
+        a node holding that sequence needs no sync request at all.
+        """
+        messages = self.snapshot_messages(config, seq)
+        if len(messages) == 1:
+            return messages[0]
+        return {"seq": seq, "chunks": len(messages)}
+
+    async def publish_retained(self, advance: Advance) -> bool:
+        if not self.retain:
+            return True
+        self.retained_published += 1
+        return await mqtt_client.publish(
+            advance.device_id, "config/retained",
+            self.retained_message(advance.config, advance.seq), retain=True,
+        )
+
+    async def catch_up(self, advance: Advance, since: int) -> bool:
+        """Bring a node that holds sequence ``since`` to ``advance.seq``."""
+        self.catch_ups += 1
+        if since == advance.seq:
+            return await mqtt_client.publish(advance.device_id, "config", {"up_to_date": True, "seq": advance.seq})
+        deltas = await self.deltas_since(advance.lock_id, since, advance.seq)
+        if deltas is not None:
+            logger.info(f"Sending {len(deltas)} deltas to {advance.device_id} ({since} -> {advance.seq})")
+            return await self.publish_deltas(advance.device_id, deltas)
+        return await self.publish_snapshot(advance.device_id, advance.config, advance.seq)
+
+    def stats(self) -> dict:
+        return {
+            "deltas_created": self.deltas_created,
+            "deltas_published": self.deltas_published,
+            "snapshots_published": self.snapshots_published,
+            "catch_ups": self.catch_ups,
+            "retained_published": self.retained_published,
+            "unchanged": self.unchanged,
+        }
+
+
+# Global config sequencer instance
+config_sequencer = ConfigSequencer(
+    max_ops=settings.config_delta_max_ops,
+    chunk_items=settings.config_snapshot_chunk_items,
+    history=settings.config_delta_history,
+    retain=settings.config_retained,
+)
@@ -0,0 +1,253 @@
+"""
+Online credential verification.
+
+Nodes hold at most ``MAX_PIN_CODES``/``MAX_RFID_CARDS`` credentials. When a
+PIN or card is not in its local list, a node can ask the server on
+``<prefix>/<device_id>/verify`` (``{"id": 7, "pin": "1234"}`` or
+``{"id": 7, "card": "04:a1:b2:c3"}``) and gets ``{"id": 7, "valid": true}``
+back on ``<prefix>/<device_id>/verdict``.
+
+``credential_index`` answers from memory: active PINs and lock-assigned RFID
+cards are kept in dicts keyed by code / UID, each entry listing the locks it
+opens (``None`` for Master PINs) and its validity window, which is checked at
+lookup time. Key tags only report whether a key is in its lock and open
+nothing, so they are left out. The index is loaded once at startup and kept
+current from SQLAlchemy session events on AccessCode, RFIDCard and Lock rows
+(as in ``config_cache``); Core-level bulk writes call ``reload_locks``. Entries
+are replaced, never mutated, so the ``thread`` transport can read them from
+paho's network thread.
+
+Across several server processes (``MQTT_SHARED_GROUP``) other members cannot
+see local changes, so the index is off there and each request is answered
+with an indexed database query instead.
+"""
+import logging
+import time
+from datetime import datetime
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+from sqlalchemy import event, or_, select
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.database import read_session_maker
+from app.delivery import LatencyHistogram
+from app.models import AccessCode, Lock, RFIDCard, naive_utc
+from app.sync_engine import valid_at
+
+logger = logging.getLogger(__name__)
+
+# Verification is answered in-process, so the buckets start well below 1 ms
+VERIFY_BUCKETS_MS = (0.02, 0.05, 0.1, 0.2, 0.5, 1, 2, 5, 10, 50)
+
+PIN = "pin"
+CARD = "card"
+
+
+class Grant(NamedTuple):
+    row_id: int
+    lock_id: Optional[int]  # None: Master PIN, valid at every lock
+    valid_from: Optional[datetime]
+    valid_until: Optional[datetime]
+
+    def valid_at(self, now: datetime) -> bool:
+        return (
+            (self.valid_from is None or self.valid_from <= now)
+            and (self.valid_until is None or self.valid_until > now)
+        )
+
+
+class CredentialIndex:
+    """Active PINs and cards by value, with the locks they open."""
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self._grants: Dict[str, Dict[str, Tuple[Grant, ...]]] = {PIN: {}, CARD: {}}
+        # (kind, row id) -> indexed value, to find the entry again on change
+        self._values: Dict[Tuple[str, int], str] = {}
+        self._by_lock: Dict[int, Set[Tuple[str, int]]] = {}
+        self.latency = LatencyHistogram(VERIFY_BUCKETS_MS)
+        self.requests = 0
+        self.granted = 0
+        self.denied = 0
+        self.unknown_devices = 0
+        self.updates = 0
+
+    # Lookups
+
+    def verify(self, lock_id: int, kind: str, value: str, now: Optional[datetime] = None) -> bool:
+        """Whether ``value`` (a PIN or card UID) opens ``lock_id`` right now."""
+        grants = self._grants[kind].get(value)
+        if not grants:
+            return False
+        now = now or datetime.utcnow()
+        return any(
+            (grant.lock_id == lock_id or (grant.lock_id is None and kind == PIN)) and grant.valid_at(now)
+            for grant in grants
+        )
+
+    async def verify_from_db(self, lock_id: int, kind: str, value: str) -> bool:
+        """Same answer as ``verify``, from the database."""
+        now = datetime.utcnow()
+        if kind == PIN:
+            query = select(AccessCode.id).where(
+                AccessCode.code == value,
+                AccessCode.is_active == True,
+                or_(AccessCode.lock_id == lock_id, AccessCode.lock_id == None),
+                valid_at(AccessCode, now),
+            )
+        else:
+            query = select(RFIDCard.id).where(
+                RFIDCard.card_uid == value,
+                RFIDCard.lock_id == lock_id,
+                RFIDCard.is_active == True,
+                RFIDCard.card_type != 'key_tag',
+                valid_at(RFIDCard, now),
+            )
+        async with read_session_maker() as session:
+            return (await session.execute(query.limit(1))).first() is not None
+
+    def record(self, valid: bool, started: float):
+        self.requests += 1
+        if valid:
+            self.granted += 1
+        else:
+            self.denied += 1
+        self.latency.observe(time.perf_counter() - started)
+
+    # Maintenance
+
+    def _put(self, kind: str, value: str, grant: Grant):
+        key = (kind, grant.row_id)
+        self._drop(key)
+        table = self._grants[kind]
+        table[value] = table.get(value, ()) + (grant,)
+        self._values[key] = value
+        if grant.lock_id is not None:
+            self._by_lock.setdefault(grant.lock_id, set()).add(key)
+
+    def _drop(self, key: Tuple[str, int]):
+        value = self._values.pop(key, None)
+        if value is None:
+            return
+        kind, row_id = key
+        table = self._grants[kind]
+        grants = tuple(grant for grant in table.get(value, ()) if grant.row_id != row_id)
+        for grant in table.get(value, ()):
+            if grant.row_id == row_id and grant.lock_id is not None:
+                self._by_lock.get(grant.lock_id, set()).discard(key)
+        if grants:
+            table[value] = grants
+        else:
+            table.pop(value, None)
+
+    def _drop_lock(self, lock_id: int):
+        for key in self._by_lock.pop(lock_id, set()):
+            self._drop(key)
+
+    def apply(self, changes: Iterable[tuple]):
+        """Apply row snapshots collected from a committed session."""
+        for change in changes:
+            self.updates += 1
+            if change[0] == "lock":
+                self._drop_lock(change[1])
+                continue
+            kind, row_id, value, lock_id, is_active, valid_from, valid_until, deleted = change
+            if deleted or not is_active or (kind == CARD and lock_id is None):
+                self._drop((kind, row_id))
+            else:
+                self._put(kind, value, Grant(row_id, lock_id, valid_from, valid_until))
+
+    async def _load(self, lock_ids: Optional[List[int]] = None) -> int:
+        pins = select(
+            AccessCode.id, AccessCode.code, AccessCode.lock_id, AccessCode.valid_from, AccessCode.valid_until
+        ).where(AccessCode.is_active == True)
+        cards = select(
+            RFIDCard.id, RFIDCard.card_uid, RFIDCard.lock_id, RFIDCard.valid_from, RFIDCard.valid_until
+        ).where(RFIDCard.is_active == True, RFIDCard.lock_id != None, RFIDCard.card_type != 'key_tag')
+        if lock_ids is not None:
+            pins = pins.where(AccessCode.lock_id.in_(lock_ids))
+            cards = cards.where(RFIDCard.lock_id.in_(lock_ids))
+        count = 0
+        async with read_session_maker() as session:
+            for kind, query in ((PIN, pins), (CARD, cards)):
+                for row_id, value, lock_id, valid_from, valid_until in (await session.execute(query)).all():
+                    self._put(kind, value, Grant(row_id, lock_id, naive_utc(valid_from), naive_utc(valid_until)))
+                    count += 1
+        return count
+
+    async def load(self):
+        if not self.enabled:
+            return
+        count = await self._load()
+        logger.info(f"Credential index loaded: {count} credentials")
+
+    async def reload_locks(self, lock_ids: Iterable[int]):
+        """Re-read the credentials of ``lock_ids`` after a Core-level bulk write."""
+        lock_ids = list(lock_ids)
+        if not self.enabled or not lock_ids:
+            return
+        for lock_id in lock_ids:
+            self._drop_lock(lock_id)
+        await self._load(lock_ids)
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "pins": len(self._grants[PIN]),
+            "cards": len(self._grants[CARD]),
+            "requests": self.requests,
+            "granted": self.granted,
+            "denied": self.denied,
+            "unknown_devices": self.unknown_devices,
+            "updates": self.updates,
+            "latency": self.latency.snapshot(),
+        }
+
+
+def _snapshot(obj, deleted: bool) -> Optional[tuple]:
+    # Grants are compared with naive utcnow(); an aware bound would raise in verify
+    if isinstance(obj, AccessCode):
+        return (
+            PIN, obj.id, obj.code, obj.lock_id, obj.is_active,
+            naive_utc(obj.valid_from), naive_utc(obj.valid_until), deleted,
+        )
+    if isinstance(obj, RFIDCard):
+        # A key tag is indexed like an inactive card: dropped if it was a card before
+        return (
+            CARD, obj.id, obj.card_uid, obj.lock_id, obj.is_active and obj.card_type != 'key_tag',
+            naive_utc(obj.valid_from), naive_utc(obj.valid_until), deleted,
+        )
+    if isinstance(obj, Lock) and deleted:
+        return ("lock", obj.id)
+    return None
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_credentials(session, flush_context):
+    # Row ids are assigned by now; new/dirty/deleted still describe the flush
+    changes = [
+        change for change in (
+            [_snapshot(obj, False) for obj in list(session.new) + list(session.dirty)]
+            + [_snapshot(obj, True) for obj in session.deleted]
+        )
+        if change is not None
+    ]
+    if changes:
+        session.info.setdefault("credential_changes", []).extend(changes)
+
+
+@event.listens_for(Session, "after_commit")
+def _apply_credentials(session):
+    changes = session.info.pop("credential_changes", None)
+    if changes and credential_index.enabled:
+        credential_index.apply(changes)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_credentials(session):
+    session.info.pop("credential_changes", None)
+
+
+# Global credential index instance
+credential_index = CredentialIndex(enabled=not settings.mqtt_shared_group)
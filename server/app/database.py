@@ -1,28 +1,187 @@
+"""
+Database engines and sessions.
+
+On SQLite (the default) the server runs a single-writer profile:
+
+- ``engine`` / ``async_session_maker`` / ``get_session`` write. The pool holds
+  one connection, so write transactions queue for it in arrival order (for at
+  most ``database_write_timeout`` seconds) instead of racing for SQLite's file
+  lock and failing with "database is locked".
+- ``read_engine`` / ``read_session_maker`` / ``get_read_session`` read, over a
+  pool of ``database_read_pool_size`` connections with ``PRAGMA query_only``.
+  HTTP GET routes and background loads use them; under the WAL journal
+  readers never wait for the writer or block it.
+
+Every connection gets the ``sqlite_*`` pragmas on connect. With
+``database_single_writer`` off (or for an in-memory database, or another
+backend) both names point at one engine with a regular pool.
+
+On PostgreSQL (``postgresql+asyncpg://``; plain ``postgresql://`` URLs get the
+asyncpg driver) there is one engine: PostgreSQL handles concurrent writers
+itself, so reads and writes share a pool of ``database_pool_size`` connections
+plus ``database_max_overflow`` under bursts.
+"""
+import time
+
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
 from app.config import settings
-from app.models import Base
+from app.migrations import migrate
 
-# Create async engine
-engine = create_async_engine(
-    settings.database_url,
-    echo=True,
-    future=True
+_url = make_url(settings.database_url)
+if _url.drivername in ("postgres", "postgresql"):
+    _url = _url.set(drivername="postgresql+asyncpg")
+_sqlite = _url.get_backend_name() == "sqlite"
+_single_writer = (
+    settings.database_single_writer and _sqlite and _url.database not in (None, "", ":memory:")
 )
 
-# Create async session factory
+
+def _sqlite_pragmas(read_only: bool):
+    statements = [
+        f"PRAGMA busy_timeout = {settings.sqlite_busy_timeout_ms}",
+        f"PRAGMA synchronous = {settings.sqlite_synchronous}",
+        f"PRAGMA cache_size = -{settings.sqlite_cache_size_kb}",
+        f"PRAGMA mmap_size = {settings.sqlite_mmap_size}",
+    ]
+    if read_only:
+        statements.append("PRAGMA query_only = ON")
+    else:
+        # Persistent in the file; set from the writer so readers open it in WAL mode
+        statements.insert(0, f"PRAGMA journal_mode = {settings.sqlite_journal_mode}")
+
+    def on_connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for statement in statements:
+            cursor.execute(statement)
+        cursor.close()
+
+    return on_connect
+
+
+class WriterStats:
+    """How long write transactions hold the writer connection."""
+
+    def __init__(self):
+        self.checkouts = 0
+        self.in_use = 0
+        self.total_hold_ms = 0.0
+        self.max_hold_ms = 0.0
+
+    def checkout(self, dbapi_connection, connection_record, connection_proxy):
+        self.checkouts += 1
+        self.in_use += 1
+        connection_record.info["checked_out_at"] = time.perf_counter()
+
+    def checkin(self, dbapi_connection, connection_record):
+        started = connection_record.info.pop("checked_out_at", None)
+        if started is None:
+            return
+        self.in_use -= 1
+        held_ms = (time.perf_counter() - started) * 1000
+        self.total_hold_ms += held_ms
+        self.max_hold_ms = max(self.max_hold_ms, held_ms)
+
+    def snapshot(self) -> dict:
+        return {
+            "checkouts": self.checkouts,
+            "in_use": self.in_use,
+            "avg_hold_ms": round(self.total_hold_ms / (self.checkouts or 1), 3),
+            "max_hold_ms": round(self.max_hold_ms, 3),
+        }
+
+
+# Create async engines (aiosqlite defaults to opening a connection per session)
+if _single_writer:
+    engine = create_async_engine(
+        _url,
+        echo=settings.database_echo,
+        poolclass=AsyncAdaptedQueuePool,
+        pool_size=1,
+        max_overflow=0,
+        pool_timeout=settings.database_write_timeout,
+    )
+    read_engine = create_async_engine(
+        _url,
+        echo=settings.database_echo,
+        poolclass=AsyncAdaptedQueuePool,
+        pool_size=settings.database_read_pool_size,
+        max_overflow=0,
+    )
+elif _url.get_backend_name() == "postgresql":
+    engine = read_engine = create_async_engine(
+        _url,
+        echo=settings.database_echo,
+        pool_size=settings.database_pool_size,
+        max_overflow=settings.database_max_overflow,
+        pool_timeout=settings.database_pool_timeout,
+        pool_recycle=settings.database_pool_recycle,
+        connect_args={
+            "prepared_statement_cache_size": settings.database_statement_cache_size,
+            # JIT compilation only pays off for long analytical queries
+            "server_settings": {"application_name": "pinelock", "jit": "off"},
+        },
+    )
+else:
+    engine = read_engine = create_async_engine(_url, echo=settings.database_echo)
+
+writer_stats = WriterStats()
+event.listen(engine.sync_engine.pool, "checkout", writer_stats.checkout)
+event.listen(engine.sync_engine.pool, "checkin", writer_stats.checkin)
+if _sqlite:
+    event.listen(engine.sync_engine, "connect", _sqlite_pragmas(read_only=False))
+    if read_engine is not engine:
+        event.listen(read_engine.sync_engine, "connect", _sqlite_pragmas(read_only=True))
+
+# Create async session factories
 async_session_maker = sessionmaker(
     engine, class_=AsyncSession, expire_on_commit=False
 )
+read_session_maker = sessionmaker(
+    read_engine, class_=AsyncSession, expire_on_commit=False
+)
 
 
 async def init_db():
-    """Initialize database tables."""
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
+    """Create missing tables and apply pending schema migrations."""
+    await migrate(engine)
+
+
+async def close_db():
+    """Close every pooled connection."""
+    await engine.dispose()
+    if read_engine is not engine:
+        await read_engine.dispose()
 
 
 async def get_session() -> AsyncSession:
     """Dependency for getting async database sessions."""
     async with async_session_maker() as session:
         yield session
+
+
+async def get_read_session() -> AsyncSession:
+    """Dependency for read-only database sessions (GET routes)."""
+    async with read_session_maker() as session:
+        yield session
+
+
+def _pool_stats(pool) -> dict:
+    if not isinstance(pool, QueuePool):
+        return {}
+    return {"size": pool.size(), "checked_out": pool.checkedout(), "overflow": max(pool.overflow(), 0)}
+
+
+def database_stats() -> dict:
+    """Engine profile, pool and writer connection usage for the metrics endpoint."""
+    return {
+        "backend": engine.dialect.name,
+        "single_writer": _single_writer,
+        "read_pool_size": settings.database_read_pool_size if _single_writer else None,
+        "pool": _pool_stats(engine.sync_engine.pool),
+        # Shared by reads and writes unless single_writer
+        "writer": writer_stats.snapshot(),
+    }
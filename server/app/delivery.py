@@ -0,0 +1,190 @@
+"""
+QoS 1 delivery tracking for server publishes.
+
+``MQTTClient.publish_future`` hands out an asyncio future per publish. It is
+resolved with True from paho's ``on_publish`` once the broker acknowledged the
+message (PUBACK), or with False when the publish fails or is not acknowledged
+within ``mqtt_publish_timeout`` seconds. At most ``mqtt_max_inflight`` tracked
+publishes are unacknowledged at a time; further ones wait for a free slot.
+Acknowledgement latency is kept in a histogram per message type.
+
+With the thread transport the PUBACK can reach ``on_publish`` (paho's network
+thread) before ``publish`` has returned the mid to be tracked. While a publish
+is between ``begin`` and ``track``, acks of unknown mids are remembered, and
+``track`` resolves the publish if its ack came after ``begin``. Everything
+remembered is dropped when the window closes, so a later publish reusing a mid
+(paho cycles through 65535) never picks up an old ack.
+"""
+import asyncio
+import bisect
+import threading
+import time
+from typing import Dict, List, Optional
+
+# Upper bounds of the latency buckets, in milliseconds (last bucket is open)
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+
+class LatencyHistogram:
+    """Fixed-bucket latency histogram."""
+
+    def __init__(self, bounds_ms=LATENCY_BUCKETS_MS):
+        self.bounds = list(bounds_ms)
+        self.counts: List[int] = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def observe(self, seconds: float):
+        ms = seconds * 1000
+        self.counts[bisect.bisect_left(self.bounds, ms)] += 1
+        self.count += 1
+        self.total_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket holding quantile ``q`` (max for the open bucket)."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                bound = self.bounds[index] if index < len(self.bounds) else self.max_ms
+                return round(min(bound, self.max_ms), 3)
+        return round(self.max_ms, 3)
+
+    def snapshot(self) -> dict:
+        labels = [f"le_{bound}ms" for bound in self.bounds] + ["inf"]
+        return {
+            "count": self.count,
+            "avg_ms": round(self.total_ms / self.count, 3) if self.count else 0.0,
+            "p50_ms": self.quantile(0.5),
+            "p99_ms": self.quantile(0.99),
+            "max_ms": round(self.max_ms, 3),
+            "buckets": {label: count for label, count in zip(labels, self.counts) if count},
+        }
+
+
+class _Delivery:
+    __slots__ = ("message_type", "future", "loop", "started", "timer")
+
+    def __init__(self, message_type: str, future: asyncio.Future, loop, started: float):
+        self.message_type = message_type
+        self.future = future
+        self.loop = loop
+        self.started = started
+        self.timer: Optional[asyncio.TimerHandle] = None
+
+
+class DeliveryTracker:
+    """Maps paho message ids to futures and enforces the in-flight window."""
+
+    def __init__(self, max_in_flight: int, timeout: float):
+        self.max_in_flight = max(1, max_in_flight)
+        self.timeout = timeout
+        self._pending: Dict[int, _Delivery] = {}
+        # mid -> ack time, only while a publish is between begin and track
+        self._early_acks: Dict[int, float] = {}
+        self._publishing = 0
+        # on_publish runs on paho's network thread with the thread transport
+        self._lock = threading.Lock()
+        self._window: Optional[asyncio.Semaphore] = None
+        self.histograms: Dict[str, LatencyHistogram] = {}
+        self.acked = 0
+        self.timeouts = 0
+        self.failed = 0
+        self.window_waits = 0
+        self.early_acks = 0
+
+    async def acquire(self):
+        """Wait for an in-flight slot (publishes run on the server loop)."""
+        if self._window is None:
+            self._window = asyncio.Semaphore(self.max_in_flight)
+        if self._window.locked():
+            self.window_waits += 1
+        await self._window.acquire()
+
+    def release(self):
+        self._window.release()
+
+    def begin(self) -> float:
+        """Call right before paho's ``publish``; returns the start of its ack latency."""
+        with self._lock:
+            self._publishing += 1
+        return time.perf_counter()
+
+    def abort(self):
+        """End a ``begin`` whose publish failed."""
+        with self._lock:
+            self._close_window()
+
+    def track(self, mid: int, message_type: str, future: asyncio.Future, started: float,
+              timeout: Optional[float] = None):
+        """Register the publish ``begin`` returned ``started`` for, once paho handed out its ``mid``."""
+        loop = asyncio.get_running_loop()
+        delivery = _Delivery(message_type, future, loop, started)
+        delivery.timer = loop.call_later(self.timeout if timeout is None else timeout, self._expire, mid)
+        with self._lock:
+            acked_at = self._early_acks.pop(mid, None)
+            self._close_window()
+            if acked_at is None or acked_at < started:
+                self._pending[mid] = delivery
+                return
+        self.early_acks += 1
+        self._resolve(delivery, True)
+
+    def _close_window(self):
+        # Called with the lock held
+        self._publishing -= 1
+        if not self._publishing:
+            self._early_acks.clear()
+
+    def fail(self, future: asyncio.Future):
+        self.failed += 1
+        self.release()
+        if not future.done():
+            future.set_result(False)
+
+    def on_publish(self, mid: int):
+        """paho callback: the broker acknowledged ``mid``."""
+        with self._lock:
+            delivery = self._pending.pop(mid, None)
+            if delivery is None and self._publishing:
+                # Maybe the publish ``track`` is about to register
+                self._early_acks[mid] = time.perf_counter()
+        if delivery is not None:
+            delivery.loop.call_soon_threadsafe(self._resolve, delivery, True)
+
+    def _expire(self, mid: int):
+        with self._lock:
+            delivery = self._pending.pop(mid, None)
+        if delivery is not None:
+            self._resolve(delivery, False)
+
+    def _resolve(self, delivery: _Delivery, acked: bool):
+        delivery.timer.cancel()
+        if acked:
+            self.acked += 1
+            histogram = self.histograms.get(delivery.message_type)
+            if histogram is None:
+                histogram = self.histograms[delivery.message_type] = LatencyHistogram()
+            histogram.observe(time.perf_counter() - delivery.started)
+        else:
+            self.timeouts += 1
+        self.release()
+        if not delivery.future.done():
+            delivery.future.set_result(acked)
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": len(self._pending),
+            "max_in_flight": self.max_in_flight,
+            "acked": self.acked,
+            "timeouts": self.timeouts,
+            "failed": self.failed,
+            "window_waits": self.window_waits,
+            "early_acks": self.early_acks,
+            "ack_latency": {name: histogram.snapshot() for name, histogram in self.histograms.items()},
+        }
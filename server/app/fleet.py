@@ -0,0 +1,225 @@
+"""
+In-memory fleet state.
+
+``fleet_state`` is the authoritative view of every registered lock while the
+server runs. It is loaded from the ``locks`` table at startup, updated in O(1)
+by MQTT handlers and served directly by read endpoints. Live fields are written
+back to the database in bulk by a background flusher; in a consumer group every
+member keeps the same state from status messages and only the leader writes it.
+"""
+import asyncio
+import logging
+from typing import Dict, List, Optional, Set
+
+from sqlalchemy import select, update, bindparam
+
+from app.config import settings
+from app.database import async_session_maker, read_session_maker
+from app.leadership import leadership
+from app.models import Lock
+
+logger = logging.getLogger(__name__)
+
+_locks_table = Lock.__table__
+
+# One executemany UPDATE for every dirty lock
+_persist_statement = (
+    update(_locks_table)
+    .where(_locks_table.c.id == bindparam("lock_id"))
+    .values(
+        is_online=bindparam("is_online"),
+        is_locked=bindparam("is_locked"),
+        is_key_present=bindparam("is_key_present"),
+        is_door_open=bindparam("is_door_open"),
+        last_seen=bindparam("last_seen"),
+    )
+)
+
+
+class LockState:
+    """Compact per-lock record."""
+
+    __slots__ = (
+        "id", "device_id", "name", "location", "description",
+        "is_online", "is_locked", "is_key_present", "is_door_open",
+        "last_seen", "created_at",
+    )
+
+    def __init__(self, lock: Lock):
+        self.id = lock.id
+        self.device_id = lock.device_id
+        self.is_online = bool(lock.is_online)
+        self.is_locked = bool(lock.is_locked) if lock.is_locked is not None else True
+        self.is_key_present = bool(lock.is_key_present)
+        self.is_door_open = bool(lock.is_door_open)
+        self.last_seen = lock.last_seen
+        self.created_at = lock.created_at
+        self.set_metadata(lock)
+
+    def set_metadata(self, lock: Lock):
+        """Copy user-editable fields from a Lock row."""
+        self.name = lock.name
+        self.location = lock.location
+        self.description = lock.description
+
+    def to_dict(self) -> dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def status_payload(self) -> dict:
+        """Payload for ``status_update`` SSE events."""
+        return {
+            "lock_id": self.id,
+            "device_id": self.device_id,
+            "is_locked": self.is_locked,
+            "is_key_present": self.is_key_present,
+            "is_door_open": self.is_door_open,
+            "is_online": self.is_online
+        }
+
+
+class FleetState:
+    """Registry of LockState records keyed by device_id and lock id."""
+
+    def __init__(self, flush_interval: float):
+        self.flush_interval = flush_interval
+        self._by_device: Dict[str, LockState] = {}
+        self._by_id: Dict[int, LockState] = {}
+        self._dirty: Set[int] = set()
+        self._task: Optional[asyncio.Task] = None
+        self.flushes = 0
+        self.rows_persisted = 0
+
+    async def load(self):
+        """Load every lock from the database."""
+        async with read_session_maker() as session:
+            result = await session.execute(select(Lock))
+            locks = result.scalars().all()
+        self._by_device.clear()
+        self._by_id.clear()
+        for lock in locks:
+            self.add(lock)
+        logger.info(f"Fleet state loaded: {len(self._by_id)} locks")
+
+    # Lookups
+    def get(self, device_id: str) -> Optional[LockState]:
+        return self._by_device.get(device_id)
+
+    def get_by_id(self, lock_id: int) -> Optional[LockState]:
+        return self._by_id.get(lock_id)
+
+    def all(self) -> List[LockState]:
+        return sorted(self._by_id.values(), key=lambda record: record.id)
+
+    def __len__(self):
+        return len(self._by_id)
+
+    # Registry changes (made by API/UI after the Lock row is committed)
+    def add(self, lock: Lock) -> LockState:
+        record = LockState(lock)
+        self._by_device[record.device_id] = record
+        self._by_id[record.id] = record
+        return record
+
+    async def refresh(self, device_id: str) -> Optional[LockState]:
+        """Load a lock missing from the registry, e.g. one created through
+        another server process of the same consumer group."""
+        async with read_session_maker() as session:
+            result = await session.execute(select(Lock).where(Lock.device_id == device_id))
+            lock = result.scalar_one_or_none()
+        return self.add(lock) if lock else None
+
+    def update_metadata(self, lock: Lock) -> Optional[LockState]:
+        record = self._by_id.get(lock.id)
+        if record:
+            record.set_metadata(lock)
+        return record
+
+    def remove(self, lock_id: int):
+        record = self._by_id.pop(lock_id, None)
+        if record:
+            self._by_device.pop(record.device_id, None)
+        self._dirty.discard(lock_id)
+
+    # Live updates from MQTT (last_seen is owned by the liveness tracker)
+    def mark_dirty(self, lock_id: int):
+        self._dirty.add(lock_id)
+
+    def update_status(self, device_id: str, is_locked: bool,
+                      is_key_present: Optional[bool] = None,
+                      is_door_open: Optional[bool] = None) -> Optional[LockState]:
+        """Apply a status report; optional fields keep their previous value."""
+        record = self._by_device.get(device_id)
+        if record:
+            record.is_locked = is_locked
+            if is_key_present is not None:
+                record.is_key_present = is_key_present
+            if is_door_open is not None:
+                record.is_door_open = is_door_open
+            self._dirty.add(record.id)
+        return record
+
+    # Write-behind persistence
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def flush(self):
+        """Persist live fields of all dirty locks in one transaction."""
+        if not self._dirty:
+            return
+        if not leadership.is_leader:
+            # The leader has the same changes and writes them
+            self._dirty.clear()
+            return
+        dirty, self._dirty = self._dirty, set()
+        params = []
+        for lock_id in dirty:
+            record = self._by_id.get(lock_id)
+            if record:
+                params.append({
+                    "lock_id": record.id,
+                    "is_online": record.is_online,
+                    "is_locked": record.is_locked,
+                    "is_key_present": record.is_key_present,
+                    "is_door_open": record.is_door_open,
+                    "last_seen": record.last_seen,
+                })
+        if not params:
+            return
+        try:
+            async with async_session_maker() as session:
+                await session.execute(_persist_statement, params)
+                await session.commit()
+            self.flushes += 1
+            self.rows_persisted += len(params)
+        except Exception as e:
+            logger.error(f"Error persisting fleet state ({len(params)} locks): {e}")
+            self._dirty |= dirty
+
+    def stats(self) -> dict:
+        return {
+            "locks": len(self._by_id),
+            "online": sum(1 for record in self._by_id.values() if record.is_online),
+            "dirty": len(self._dirty),
+            "flushes": self.flushes,
+            "rows_persisted": self.rows_persisted,
+        }
+
+
+# Global fleet state instance
+fleet_state = FleetState(flush_interval=settings.fleet_flush_interval)
@@ -0,0 +1,184 @@
+"""
+Write-behind ingestion of access logs.
+
+MQTT handlers hand rows to ``access_log_writer`` instead of committing them one
+by one. Rows are buffered in memory and written as a single multi-row INSERT
+per transaction (COPY on PostgreSQL for large batches), either when a batch
+fills up or when the oldest buffered row reaches the configured max latency.
+Rows go to their month's partition (``access_log_store``).
+"""
+import asyncio
+import logging
+import time
+from datetime import datetime, timezone
+from typing import Callable, List, Optional
+
+from app.access_logs import access_log_store
+from app.config import settings
+from app.database import async_session_maker
+
+logger = logging.getLogger(__name__)
+
+
+class AccessLogWriter:
+    """Buffers access log rows and flushes them in batches."""
+
+    def __init__(self, batch_size: int, max_latency: float, max_pending: int):
+        self.batch_size = batch_size
+        self.max_latency = max_latency
+        self.max_pending = max_pending
+        self._rows: List[dict] = []
+        self._has_rows = asyncio.Event()
+        self._batch_full = asyncio.Event()
+        self._has_space = asyncio.Event()
+        self._has_space.set()
+        self._flush_lock = asyncio.Lock()
+        self._stopping = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._flush_listeners: List[Callable[[List[dict]], None]] = []
+
+        # Counters
+        self.rows_written = 0
+        self.batches_flushed = 0
+        self.flush_errors = 0
+        self.last_batch_size = 0
+        self.max_batch_size = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self.total_flush_ms = 0.0
+
+    async def add(self, lock_id: int, access_type: str, access_method: Optional[str],
+                  success: bool, timestamp: Optional[datetime] = None):
+        """Queue an access log row; waits while the buffer is full."""
+        while len(self._rows) >= self.max_pending:
+            # Bounded memory: apply backpressure until the flusher catches up
+            self._has_space.clear()
+            self._batch_full.set()
+            await self._has_space.wait()
+
+        if timestamp is not None and timestamp.tzinfo is not None:
+            # Device epoch timestamps decode as aware UTC; columns hold naive UTC
+            timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+        self._rows.append({
+            "lock_id": lock_id,
+            "access_type": access_type,
+            "access_method": access_method,
+            "success": success,
+            "timestamp": timestamp or datetime.utcnow(),
+        })
+        self._has_rows.set()
+        if len(self._rows) >= self.batch_size:
+            self._batch_full.set()
+
+    def add_flush_listener(self, listener: Callable[[List[dict]], None]):
+        """Call ``listener(rows)`` after every committed batch (used by benchmarks)."""
+        self._flush_listeners.append(listener)
+
+    async def start(self):
+        """Start the background flusher."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+            logger.info(
+                f"Access log writer started (batch={self.batch_size}, "
+                f"max_latency={self.max_latency}s, max_pending={self.max_pending})"
+            )
+
+    async def stop(self):
+        """Stop the flusher and write out everything still buffered."""
+        if self._task:
+            # Not cancelled: a batch being inserted right now must finish
+            self._stopping.set()
+            self._has_rows.set()
+            self._batch_full.set()
+            await self._task
+            self._task = None
+            self._stopping.clear()
+        while self._rows:
+            if not await self.flush():
+                logger.error(f"Dropping {len(self._rows)} access logs that could not be written on shutdown")
+                break
+        logger.info("Access log writer stopped")
+
+    async def _run(self):
+        while not self._stopping.is_set():
+            await self._has_rows.wait()
+            try:
+                await asyncio.wait_for(self._batch_full.wait(), timeout=self.max_latency)
+            except asyncio.TimeoutError:
+                pass
+            if self._stopping.is_set():
+                # stop() writes out the rest
+                break
+            if not await self.flush():
+                # Keep the rows and retry after a pause instead of spinning
+                try:
+                    await asyncio.wait_for(self._stopping.wait(), timeout=self.max_latency)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def flush(self) -> bool:
+        """Write buffered rows in one transaction. Returns False on failure."""
+        async with self._flush_lock:
+            rows, self._rows = self._rows, []
+            self._has_rows.clear()
+            self._batch_full.clear()
+            if not rows:
+                return True
+
+            started = time.perf_counter()
+            try:
+                async with async_session_maker() as session:
+                    await access_log_store.insert(session, rows)
+                    await session.commit()
+            except asyncio.CancelledError:
+                # Keep the batch for the next flush rather than losing it
+                self._rows[:0] = rows
+                self._has_rows.set()
+                raise
+            except Exception as e:
+                self.flush_errors += 1
+                logger.error(f"Error flushing {len(rows)} access logs: {e}")
+                # Put the batch back in front of anything queued meanwhile
+                self._rows[:0] = rows
+                self._has_rows.set()
+                return False
+            finally:
+                if len(self._rows) < self.max_pending:
+                    self._has_space.set()
+
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            self.rows_written += len(rows)
+            self.batches_flushed += 1
+            self.last_batch_size = len(rows)
+            self.max_batch_size = max(self.max_batch_size, len(rows))
+            self.last_flush_ms = elapsed_ms
+            self.max_flush_ms = max(self.max_flush_ms, elapsed_ms)
+            self.total_flush_ms += elapsed_ms
+            logger.debug(f"Flushed {len(rows)} access logs in {elapsed_ms:.1f} ms")
+            for listener in self._flush_listeners:
+                listener(rows)
+            return True
+
+    def stats(self) -> dict:
+        """Counters for the metrics endpoint."""
+        batches = self.batches_flushed or 1
+        return {
+            "pending": len(self._rows),
+            "rows_written": self.rows_written,
+            "batches_flushed": self.batches_flushed,
+            "flush_errors": self.flush_errors,
+            "last_batch_size": self.last_batch_size,
+            "max_batch_size": self.max_batch_size,
+            "avg_batch_size": round(self.rows_written / batches, 2),
+            "last_flush_ms": round(self.last_flush_ms, 3),
+            "max_flush_ms": round(self.max_flush_ms, 3),
+            "avg_flush_ms": round(self.total_flush_ms / batches, 3),
+        }
+
+
+# Global writer instance
+access_log_writer = AccessLogWriter(
+    batch_size=settings.access_log_batch_size,
+    max_latency=settings.access_log_flush_interval,
+    max_pending=settings.access_log_max_pending,
+)
@@ -0,0 +1,185 @@
+"""
+Per-device ordered ingest scheduling.
+
+Inbound MQTT messages are sharded by ``device_id``. Each shard has one worker,
+so messages from the same lock are handled strictly in arrival order while
+different locks are processed concurrently across shards.
+
+Shard queues are bounded. Under overload heartbeats are shed first, status and
+sync messages are coalesced per device, and access events, alerts and verify
+requests are never dropped (they may exceed the bound instead): a node waits
+for every verdict with a user at the reader.
+"""
+import asyncio
+import logging
+import zlib
+from collections import OrderedDict, deque
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Never dropped
+CRITICAL_TYPES = {"access", "alert", "verify"}
+# Shed first when a shard is full
+SHEDDABLE_TYPES = {"heartbeat"}
+# A newer message replaces a pending one for the same device
+COALESCED_TYPES = {"heartbeat", "sync"}
+# Coalesced only while the shard is full, so transitions are not hidden otherwise
+COALESCED_UNDER_LOAD_TYPES = {"status"}
+
+
+class _Job:
+    __slots__ = ("message_type", "device_id", "handler", "data")
+
+    def __init__(self, message_type: str, device_id: str, handler: Callable, data: dict):
+        self.message_type = message_type
+        self.device_id = device_id
+        self.handler = handler
+        self.data = data
+
+
+class _Shard:
+    __slots__ = ("index", "queue", "size", "pending", "heartbeats", "wakeup", "task", "processed")
+
+    def __init__(self, index: int):
+        self.index = index
+        self.queue: Deque[_Job] = deque()
+        self.size = 0  # live jobs; cancelled ones stay in the deque until popped
+        self.pending: Dict[Tuple[str, str], _Job] = {}
+        self.heartbeats: "OrderedDict[str, _Job]" = OrderedDict()
+        self.wakeup = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+        self.processed = 0
+
+
+class IngestScheduler:
+    """Shards handler work by device_id with bounded queues and load shedding."""
+
+    def __init__(self, shards: int, max_queue: int):
+        self.max_queue = max_queue
+        self._shards: List[_Shard] = [_Shard(i) for i in range(shards)]
+        self.submitted = 0
+        self.coalesced = 0
+        self.over_limit = 0
+        self.dropped: Dict[str, int] = {}
+
+    def _shard_for(self, device_id: str) -> _Shard:
+        return self._shards[zlib.crc32(device_id.encode()) % len(self._shards)]
+
+    def submit(self, message_type: str, device_id: str, handler: Callable, data: dict) -> bool:
+        """Queue a handler call. Must run on the event loop. Returns False if shed."""
+        self.submitted += 1
+        shard = self._shard_for(device_id)
+        key = (device_id, message_type)
+        full = shard.size >= self.max_queue
+
+        pending = shard.pending.get(key)
+        if pending and (message_type in COALESCED_TYPES or
+                        (full and message_type in COALESCED_UNDER_LOAD_TYPES)):
+            pending.data = data
+            self.coalesced += 1
+            return True
+
+        if full:
+            if message_type in SHEDDABLE_TYPES:
+                self._drop(message_type)
+                return False
+            if not self._shed_heartbeat(shard):
+                if message_type in CRITICAL_TYPES:
+                    self.over_limit += 1
+                else:
+                    self._drop(message_type)
+                    return False
+
+        job = _Job(message_type, device_id, handler, data)
+        shard.queue.append(job)
+        shard.size += 1
+        if message_type in COALESCED_TYPES or message_type in COALESCED_UNDER_LOAD_TYPES:
+            shard.pending[key] = job
+        if message_type in SHEDDABLE_TYPES:
+            shard.heartbeats[device_id] = job
+        shard.wakeup.set()
+        return True
+
+    def _drop(self, message_type: str):
+        self.dropped[message_type] = self.dropped.get(message_type, 0) + 1
+
+    def _shed_heartbeat(self, shard: _Shard) -> bool:
+        """Cancel the oldest queued heartbeat in ``shard`` to make room."""
+        if not shard.heartbeats:
+            return False
+        device_id, job = shard.heartbeats.popitem(last=False)
+        shard.pending.pop((device_id, job.message_type), None)
+        job.handler = None
+        shard.size -= 1
+        self._drop(job.message_type)
+        return True
+
+    async def _worker(self, shard: _Shard):
+        while True:
+            if not shard.queue:
+                shard.wakeup.clear()
+                await shard.wakeup.wait()
+                continue
+            job = shard.queue.popleft()
+            if job.handler is None:
+                continue
+            shard.size -= 1
+            key = (job.device_id, job.message_type)
+            if shard.pending.get(key) is job:
+                del shard.pending[key]
+            if shard.heartbeats.get(job.device_id) is job:
+                del shard.heartbeats[job.device_id]
+            try:
+                await job.handler(job.device_id, job.data)
+            except Exception as e:
+                logger.error(f"Error in {job.message_type} handler for {job.device_id}: {e}", exc_info=True)
+            shard.processed += 1
+
+    async def start(self):
+        for shard in self._shards:
+            if shard.task is None:
+                shard.task = asyncio.create_task(self._worker(shard))
+        logger.info(f"Ingest scheduler started ({len(self._shards)} shards, max_queue={self.max_queue})")
+
+    async def stop(self, timeout: float = 10.0):
+        """Drain queued work (up to ``timeout`` seconds), then stop the workers."""
+        deadline = asyncio.get_running_loop().time() + timeout
+        while self.depth() and asyncio.get_running_loop().time() < deadline:
+            await asyncio.sleep(0.05)
+        if self.depth():
+            logger.warning(f"Ingest scheduler stopped with {self.depth()} queued messages")
+        for shard in self._shards:
+            if shard.task:
+                shard.task.cancel()
+                try:
+                    await shard.task
+                except asyncio.CancelledError:
+                    pass
+                shard.task = None
+
+    def depth(self) -> int:
+        return sum(shard.size for shard in self._shards)
+
+    def stats(self) -> dict:
+        depths = [shard.size for shard in self._shards]
+        return {
+            "shards": len(self._shards),
+            "max_queue": self.max_queue,
+            "depth": sum(depths),
+            "max_shard_depth": max(depths) if depths else 0,
+            "submitted": self.submitted,
+            "processed": sum(shard.processed for shard in self._shards),
+            "coalesced": self.coalesced,
+            "over_limit": self.over_limit,
+            "dropped": dict(self.dropped),
+        }
+
+
+# Global scheduler instance
+ingest_scheduler = IngestScheduler(
+    shards=settings.ingest_shards,
+    max_queue=settings.ingest_queue_size,
+)
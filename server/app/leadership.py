@@ -0,0 +1,157 @@
+"""
+Leader election within a consumer group.
+
+Every member of a consumer group (``MQTT_SHARED_GROUP``) receives all status
+and heartbeat messages, so each one would also persist the same fleet state and
+fire the same validity boundaries, publishing every resulting sync N times.
+Those singleton jobs run on one member only: the holder of a lease row in
+``leader_leases``. Members try to take or renew it every ``leader_lease_renew``
+seconds; a lease not renewed for ``leader_lease_ttl`` seconds (a crashed
+leader) is taken over by the next member that tries. A member stopping cleanly
+gives the lease up right away.
+
+Jobs register ``on_elected``/``on_deposed`` callbacks, or check ``is_leader``.
+Without a consumer group the process is always the leader.
+"""
+import asyncio
+import logging
+import os
+import socket
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, List, Optional
+
+from sqlalchemy import delete, insert, or_, update
+from sqlalchemy.exc import IntegrityError
+
+from app.config import settings
+from app.database import async_session_maker
+from app.models import LeaderLease
+
+logger = logging.getLogger(__name__)
+
+LEASE_NAME = "singleton_jobs"
+
+
+class Leadership:
+    """Holds, renews and gives up the leader lease of this process."""
+
+    def __init__(self, enabled: bool, holder: str, ttl: float, renew: float):
+        self.enabled = enabled
+        self.holder = holder
+        self.ttl = ttl
+        self.renew = min(renew, ttl / 2)
+        self.is_leader = not enabled
+        self._on_elected: List[Callable[[], Awaitable]] = []
+        self._on_deposed: List[Callable[[], Awaitable]] = []
+        self._task: Optional[asyncio.Task] = None
+        self.elections = 0
+        self.renew_errors = 0
+
+    def register(self, on_elected: Callable[[], Awaitable], on_deposed: Callable[[], Awaitable]):
+        """Run ``on_elected`` when this process becomes leader, ``on_deposed`` when it stops being one."""
+        self._on_elected.append(on_elected)
+        self._on_deposed.append(on_deposed)
+
+    async def start(self):
+        if not self.enabled:
+            await self._run_callbacks(self._on_elected)
+            return
+        await self._update()
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self.is_leader:
+            await self._run_callbacks(self._on_deposed)
+            if self.enabled:
+                self.is_leader = False
+                await self._release()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.renew)
+            await self._update()
+
+    async def _update(self):
+        try:
+            leader = await self._acquire()
+        except Exception as e:
+            self.renew_errors += 1
+            logger.error(f"Error renewing leader lease: {e}")
+            # Step down before the lease can expire under us
+            leader = False
+        if leader and not self.is_leader:
+            self.is_leader = True
+            self.elections += 1
+            logger.info(f"Elected leader of consumer group {settings.mqtt_shared_group} ({self.holder})")
+            await self._run_callbacks(self._on_elected)
+        elif not leader and self.is_leader:
+            self.is_leader = False
+            logger.warning(f"Lost the leader lease of consumer group {settings.mqtt_shared_group}")
+            await self._run_callbacks(self._on_deposed)
+
+    async def _acquire(self) -> bool:
+        """Take or renew the lease; True if this process holds it afterwards."""
+        now = datetime.utcnow()
+        expires_at = now + timedelta(seconds=self.ttl)
+        async with async_session_maker() as session:
+            result = await session.execute(
+                update(LeaderLease)
+                .where(
+                    LeaderLease.name == LEASE_NAME,
+                    or_(LeaderLease.holder == self.holder, LeaderLease.expires_at < now),
+                )
+                .values(holder=self.holder, expires_at=expires_at)
+            )
+            if result.rowcount:
+                await session.commit()
+                return True
+            try:
+                await session.execute(
+                    insert(LeaderLease).values(name=LEASE_NAME, holder=self.holder, expires_at=expires_at)
+                )
+                await session.commit()
+                return True
+            except IntegrityError:
+                # Another member holds it
+                await session.rollback()
+                return False
+
+    async def _release(self):
+        try:
+            async with async_session_maker() as session:
+                await session.execute(
+                    delete(LeaderLease).where(LeaderLease.name == LEASE_NAME, LeaderLease.holder == self.holder)
+                )
+                await session.commit()
+        except Exception as e:
+            logger.error(f"Error releasing leader lease: {e}")
+
+    async def _run_callbacks(self, callbacks: List[Callable[[], Awaitable]]):
+        for callback in callbacks:
+            try:
+                await callback()
+            except Exception as e:
+                logger.error(f"Error in leadership callback {callback.__qualname__}: {e}")
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "holder": self.holder,
+            "is_leader": self.is_leader,
+            "elections": self.elections,
+            "renew_errors": self.renew_errors,
+        }
+
+
+# Global leadership instance
+leadership = Leadership(
+    enabled=bool(settings.mqtt_shared_group),
+    holder=f"{socket.gethostname()}_{os.getpid()}",
+    ttl=settings.leader_lease_ttl,
+    renew=settings.leader_lease_renew,
+)
@@ -0,0 +1,239 @@
+"""
+Device liveness tracking.
+
+Heartbeats only carry "this device is alive", so they are not committed one by
+one. ``liveness_tracker`` keeps ``last_seen`` in the fleet state records and
+persists every device seen since the previous flush with a single bulk UPDATE
+every ``last_seen_flush_interval`` seconds, plus an exact flush on shutdown
+(by the leader only in a consumer group, as for ``fleet_state``).
+
+Devices that miss ``offline_after_missed_heartbeats`` heartbeats are marked
+offline. Deadlines live in a hashed timing wheel, so a sweep only visits the
+devices expiring in that tick instead of scanning the whole fleet.
+"""
+import asyncio
+import logging
+import math
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Set
+
+from sqlalchemy import update, bindparam
+
+from app.config import settings
+from app.database import async_session_maker
+from app.leadership import leadership
+from app.fleet import FleetState, LockState, fleet_state
+from app.models import Lock
+from app.sse import sse_broadcaster
+
+logger = logging.getLogger(__name__)
+
+_locks_table = Lock.__table__
+
+_last_seen_statement = (
+    update(_locks_table)
+    .where(_locks_table.c.id == bindparam("lock_id"))
+    .values(last_seen=bindparam("last_seen"), is_online=bindparam("is_online"))
+)
+
+
+class TimingWheel:
+    """Hashed timing wheel of device deadlines with O(1) reschedule."""
+
+    def __init__(self, tick: float, horizon: float):
+        self.tick = tick
+        # Large enough that a deadline never wraps past a slot still pending
+        self.size = int(math.ceil(horizon / tick)) + 2
+        self._slots: List[Set[int]] = [set() for _ in range(self.size)]
+        self._tick_of: Dict[int, int] = {}
+        self._last_tick = self._tick_for(time.monotonic())
+
+    def _tick_for(self, when: float) -> int:
+        return int(when // self.tick)
+
+    def schedule(self, key: int, deadline: float):
+        """(Re)schedule ``key`` to expire at monotonic time ``deadline``."""
+        tick = self._tick_for(deadline) + 1
+        previous = self._tick_of.get(key)
+        if previous == tick:
+            return
+        if previous is not None:
+            self._slots[previous % self.size].discard(key)
+        self._slots[tick % self.size].add(key)
+        self._tick_of[key] = tick
+
+    def cancel(self, key: int):
+        previous = self._tick_of.pop(key, None)
+        if previous is not None:
+            self._slots[previous % self.size].discard(key)
+
+    def advance(self, now: float) -> List[int]:
+        """Pop every key whose deadline tick has passed."""
+        current = self._tick_for(now)
+        expired = []
+        # After a long stall one full revolution visits every slot
+        start = max(self._last_tick + 1, current - self.size + 1)
+        for tick in range(start, current + 1):
+            slot = self._slots[tick % self.size]
+            if not slot:
+                continue
+            for key in [key for key in slot if self._tick_of[key] <= tick]:
+                slot.discard(key)
+                del self._tick_of[key]
+                expired.append(key)
+        self._last_tick = max(self._last_tick, current)
+        return expired
+
+    def __len__(self):
+        return len(self._tick_of)
+
+
+class LivenessTracker:
+    """Keeps last_seen in memory, writes it back in batches and expires silent devices."""
+
+    def __init__(self, fleet: FleetState, flush_interval: float, timeout: float, tick: float):
+        self.fleet = fleet
+        self.flush_interval = flush_interval
+        self.timeout = timeout
+        self.wheel = TimingWheel(tick=tick, horizon=timeout)
+        self._dirty: Set[int] = set()
+        self._came_online: Set[int] = set()
+        self._task: Optional[asyncio.Task] = None
+        self._sweep_task: Optional[asyncio.Task] = None
+        self.touches = 0
+        self.flushes = 0
+        self.rows_persisted = 0
+        self.went_offline = 0
+        self.came_online = 0
+        self.last_sweep_expired = 0
+
+    def touch(self, device_id: str) -> Optional[LockState]:
+        """Record that a device was seen now. Returns None for unknown devices."""
+        record = self.fleet.get(device_id)
+        if record is None:
+            return None
+        if not record.is_online:
+            # Coming back online is a state change, persist it with the fleet flush
+            record.is_online = True
+            self.fleet.mark_dirty(record.id)
+            self._came_online.add(record.id)
+        record.last_seen = datetime.utcnow()
+        self.wheel.schedule(record.id, time.monotonic() + self.timeout)
+        self._dirty.add(record.id)
+        self.touches += 1
+        return record
+
+    async def start(self):
+        # Devices persisted as online get one full timeout to check in again
+        deadline = time.monotonic() + self.timeout
+        for record in self.fleet.all():
+            if record.is_online:
+                self.wheel.schedule(record.id, deadline)
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+        if self._sweep_task is None:
+            self._sweep_task = asyncio.create_task(self._sweep_loop())
+
+    async def stop(self):
+        for task in (self._task, self._sweep_task):
+            if task:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._task = None
+        self._sweep_task = None
+        await self.flush()
+
+    async def _sweep_loop(self):
+        while True:
+            await asyncio.sleep(self.wheel.tick)
+            try:
+                await self.sweep()
+            except Exception as e:
+                logger.error(f"Error in liveness sweep: {e}")
+
+    async def sweep(self, now: Optional[float] = None):
+        """Mark expired devices offline and announce online/offline transitions."""
+        expired = self.wheel.advance(time.monotonic() if now is None else now)
+        self.last_sweep_expired = len(expired)
+
+        changed = []
+        for lock_id in expired:
+            record = self.fleet.get_by_id(lock_id)
+            if record and record.is_online:
+                record.is_online = False
+                # Persisted in bulk by the next fleet state flush
+                self.fleet.mark_dirty(lock_id)
+                self.went_offline += 1
+                changed.append(record)
+                logger.info(f"Lock {record.device_id} went offline (no heartbeat for {self.timeout:.0f}s)")
+
+        came_online, self._came_online = self._came_online, set()
+        for lock_id in came_online:
+            record = self.fleet.get_by_id(lock_id)
+            if record and record.is_online:
+                self.came_online += 1
+                changed.append(record)
+
+        for record in changed:
+            await sse_broadcaster.broadcast("status_update", record.status_payload())
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def flush(self):
+        """Persist last_seen of every device seen since the last flush."""
+        if not self._dirty:
+            return
+        if not leadership.is_leader:
+            self._dirty.clear()
+            return
+        dirty, self._dirty = self._dirty, set()
+        params = []
+        for lock_id in dirty:
+            record = self.fleet.get_by_id(lock_id)
+            if record:
+                params.append({
+                    "lock_id": record.id,
+                    "last_seen": record.last_seen,
+                    "is_online": record.is_online,
+                })
+        if not params:
+            return
+        try:
+            async with async_session_maker() as session:
+                await session.execute(_last_seen_statement, params)
+                await session.commit()
+            self.flushes += 1
+            self.rows_persisted += len(params)
+            logger.debug(f"Persisted last_seen for {len(params)} locks")
+        except Exception as e:
+            logger.error(f"Error persisting last_seen ({len(params)} locks): {e}")
+            self._dirty |= dirty
+
+    def stats(self) -> dict:
+        return {
+            "touches": self.touches,
+            "dirty": len(self._dirty),
+            "flushes": self.flushes,
+            "rows_persisted": self.rows_persisted,
+            "coalesced": self.touches - self.rows_persisted - len(self._dirty),
+            "tracked": len(self.wheel),
+            "went_offline": self.went_offline,
+            "came_online": self.came_online,
+            "last_sweep_expired": self.last_sweep_expired,
+        }
+
+
+# Global liveness tracker instance
+liveness_tracker = LivenessTracker(
+    fleet_state,
+    flush_interval=settings.last_seen_flush_interval,
+    timeout=settings.heartbeat_interval * settings.offline_after_missed_heartbeats,
+    tick=settings.liveness_tick,
+)
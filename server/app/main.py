@@ -1,4 +1,5 @@
 from pathlib import Path
+import asyncio
 from fastapi import FastAPI
 from contextlib import asynccontextmanager
 import logging
@@ -6,9 +7,22 @@ from starlette.middleware.sessions import SessionMiddleware
 from fastapi.staticfiles import StaticFiles
 
 from app.config import settings
-from app.database import init_db
+from app.database import close_db, database_stats, init_db
+from app.access_logs import access_log_store
+from app.ingest import access_log_writer
+from app.fleet import fleet_state
+from app.liveness import liveness_tracker
 from app.routes import router as api_router
 from app.mqtt_client import mqtt_client
+from app.ingest_scheduler import ingest_scheduler
+from app.sync_engine import sync_engine
+from app.sync_coordinator import sync_coordinator
+from app.sync_admission import sync_admission
+from app.validity import validity_scheduler
+from app.leadership import leadership
+from app.config_cache import config_cache
+from app.config_deltas import config_sequencer
+from app.credentials import credential_index
 from app.mqtt_handlers import setup_mqtt_handlers
 from app.ui_routes import router as ui_router
 
@@ -36,10 +50,22 @@ async def lifespan(app: FastAPI):
     await init_db()
     logger.info("Database initialized")
     
+    await fleet_state.load()
+    await credential_index.load()
+    await fleet_state.start()
+    await liveness_tracker.start()
+    await access_log_store.start()
+    await access_log_writer.start()
+    await ingest_scheduler.start()
+    await sync_admission.start()
+    # Singleton jobs: run here unless another consumer group member leads
+    leadership.register(validity_scheduler.start, validity_scheduler.stop)
+    await leadership.start()
+    
     # Connect to MQTT broker and setup handlers
     try:
-        mqtt_client.connect()
         setup_mqtt_handlers(mqtt_client)
+        mqtt_client.connect(loop=asyncio.get_running_loop())
         logger.info("MQTT client connected and handlers registered")
     except Exception as e:
         logger.error(f"Failed to setup MQTT: {e}")
@@ -57,7 +83,19 @@ async def lifespan(app: FastAPI):
     
     # Shutdown
     logger.info("Shutting down PineLock Server...")
+    await sync_coordinator.stop()
+    await sync_admission.stop()
+    await validity_scheduler.stop()
+    await sync_engine.stop()
     mqtt_client.disconnect()
+    await ingest_scheduler.stop()
+    await access_log_writer.stop()
+    await access_log_store.stop()
+    await liveness_tracker.stop()
+    await fleet_state.stop()
+    # Held until the last fleet state flush, then handed to another member
+    await leadership.stop()
+    await close_db()
 
 
 # Create FastAPI app
@@ -93,3 +131,25 @@ async def health():
         "status": "healthy",
         "mqtt_connected": mqtt_client.is_connected
     }
+
+
+@app.get("/metrics")
+async def metrics():
+    """Ingestion and fleet state counters."""
+    return {
+        "ingest_scheduler": ingest_scheduler.stats(),
+        "access_log_writer": access_log_writer.stats(),
+        "access_logs": access_log_store.stats(),
+        "database": database_stats(),
+        "fleet_state": fleet_state.stats(),
+        "liveness": liveness_tracker.stats(),
+        "sync_engine": sync_engine.stats(),
+        "sync_coordinator": sync_coordinator.stats(),
+        "sync_admission": sync_admission.stats(),
+        "validity": validity_scheduler.stats(),
+        "leadership": leadership.stats(),
+        "mqtt_publish": mqtt_client.deliveries.stats(),
+        "config_cache": config_cache.stats(),
+        "config_deltas": config_sequencer.stats(),
+        "credentials": credential_index.stats()
+    }
@@ -0,0 +1,354 @@
+"""
+Versioned schema migrations.
+
+``create_all`` only creates missing tables, so a production database created
+by an older release never gets new indexes or columns. Migrations are
+numbered functions that run in order at startup (``init_db``), each in its own
+transaction together with the row recording it in ``schema_version``. The
+models stay the source of truth: a fresh database is created from them and
+stamped with the latest version without running anything.
+
+Add a migration by appending a ``@migration(<next version>, "...")`` function
+taking a synchronous connection. Use plain DDL (``CREATE INDEX IF NOT
+EXISTS``, ``ALTER TABLE``) rather than model objects, so a migration keeps
+doing the same thing after the models change.
+
+``python -m app.migrations`` shows the applied versions; ``--check`` runs
+EXPLAIN (QUERY PLAN) on the hot queries and fails if one does not use its index
+(access log queries are checked against the newest monthly partition). On
+PostgreSQL sequential scans are disabled for the check, since the planner
+rightly scans small tables; it shows that each index can serve its query.
+"""
+import argparse
+import asyncio
+import logging
+import re
+import sys
+from datetime import datetime
+from typing import Callable, List, Tuple
+
+from sqlalchemy import (
+    Boolean, Column, DateTime, Index, Integer, MetaData, String, Table, func, insert, inspect, or_, select, update,
+)
+from sqlalchemy.engine import Connection
+
+from app.models import AccessCode, AccessLogRollup, Base, RFIDCard
+
+logger = logging.getLogger(__name__)
+
+schema_version = Table(
+    "schema_version",
+    MetaData(),
+    Column("version", Integer, primary_key=True),
+    Column("description", String, nullable=False),
+    Column("applied_at", DateTime, nullable=False),
+)
+
+# Monthly access log partitions (access_logs_YYYYMM), as migration 4 names them
+_PARTITION_NAME = re.compile(r"^access_logs_(\d{4})(\d{2})$")
+
+
+class Migration:
+    def __init__(self, version: int, description: str, upgrade: Callable[[Connection], None]):
+        self.version = version
+        self.description = description
+        self.upgrade = upgrade
+
+
+MIGRATIONS: List[Migration] = []
+
+
+def migration(version: int, description: str):
+    """Register the decorated function as migration ``version``."""
+    def register(upgrade: Callable[[Connection], None]):
+        if MIGRATIONS and version != MIGRATIONS[-1].version + 1:
+            raise ValueError(f"Migration {version} must follow {MIGRATIONS[-1].version}")
+        MIGRATIONS.append(Migration(version, description, upgrade))
+        return upgrade
+    return register
+
+
+def _execute_all(conn: Connection, statements: Tuple[str, ...]):
+    for statement in statements:
+        conn.exec_driver_sql(statement)
+
+
+@migration(1, "Composite indexes for config builds, key tag checks and access log listings")
+def _hot_path_indexes(conn: Connection):
+    _execute_all(conn, (
+        "CREATE INDEX IF NOT EXISTS ix_access_codes_lock_id_is_active ON access_codes (lock_id, is_active)",
+        "CREATE INDEX IF NOT EXISTS ix_rfid_cards_lock_id_card_type ON rfid_cards (lock_id, card_type)",
+        "CREATE INDEX IF NOT EXISTS ix_access_logs_lock_id_timestamp ON access_logs (lock_id, timestamp)",
+        "CREATE INDEX IF NOT EXISTS ix_access_logs_timestamp ON access_logs (timestamp)",
+    ))
+
+
+@migration(2, "Indexes on credential validity boundaries")
+def _validity_indexes(conn: Connection):
+    _execute_all(conn, (
+        "CREATE INDEX IF NOT EXISTS ix_access_codes_valid_from ON access_codes (valid_from)",
+        "CREATE INDEX IF NOT EXISTS ix_access_codes_valid_until ON access_codes (valid_until)",
+        "CREATE INDEX IF NOT EXISTS ix_rfid_cards_valid_from ON rfid_cards (valid_from)",
+        "CREATE INDEX IF NOT EXISTS ix_rfid_cards_valid_until ON rfid_cards (valid_until)",
+    ))
+
+
+@migration(3, "Index on access code values for online verification")
+def _access_code_index(conn: Connection):
+    _execute_all(conn, (
+        "CREATE INDEX IF NOT EXISTS ix_access_codes_code ON access_codes (code)",
+    ))
+
+
+def _access_log_partition(month: datetime) -> Table:
+    """An access log partition as migration 4 creates it; frozen, unlike the models."""
+    name = f"access_logs_{month:%Y%m}"
+    return Table(
+        name,
+        MetaData(),
+        Column("id", Integer, primary_key=True),
+        Column("lock_id", Integer, nullable=False),
+        Column("access_type", String, nullable=False),
+        Column("access_method", String),
+        Column("success", Boolean, nullable=False),
+        Column("timestamp", DateTime, nullable=False),
+        Index(f"ix_{name}_lock_id_timestamp", "lock_id", "timestamp"),
+        Index(f"ix_{name}_timestamp", "timestamp"),
+    )
+
+
+@migration(4, "Move access logs into monthly partitions")
+def _partition_access_logs(conn: Connection):
+    if not inspect(conn).has_table("access_logs"):
+        return
+    legacy = Table("access_logs", MetaData(), autoload_with=conn)
+    columns = ["id", "lock_id", "access_type", "access_method", "success", "timestamp"]
+    first = conn.execute(select(func.min(legacy.c.timestamp))).scalar()
+    conn.execute(update(legacy).where(legacy.c.timestamp == None).values(timestamp=first or datetime.utcnow()))
+    first, last = conn.execute(select(func.min(legacy.c.timestamp), func.max(legacy.c.timestamp))).one()
+    month = datetime(first.year, first.month, 1) if first else None
+    while month is not None and month <= last:
+        end = datetime(month.year + month.month // 12, month.month % 12 + 1, 1)
+        rows = select(*(legacy.c[name] for name in columns)).where(
+            legacy.c.timestamp >= month, legacy.c.timestamp < end
+        )
+        if conn.execute(rows.limit(1)).first() is not None:
+            partition = _access_log_partition(month)
+            partition.create(conn, checkfirst=True)
+            conn.execute(insert(partition).from_select(columns, rows))
+            if conn.dialect.name == "postgresql":
+                # Rows keep their ids; move the partition's sequence past them
+                conn.execute(select(func.setval(
+                    func.pg_get_serial_sequence(partition.name, "id"), select(func.max(partition.c.id)).scalar_subquery()
+                )))
+        month = end
+    legacy.drop(conn)
+
+
+@migration(5, "Backfill access log rollups from the partitions")
+def _backfill_access_log_rollups(conn: Connection):
+    rollups = Table("access_log_rollups", MetaData(), autoload_with=conn)
+    totals = Table("access_log_totals", MetaData(), autoload_with=conn)
+    conn.execute(rollups.delete())
+    conn.execute(totals.delete())
+    for name in inspect(conn).get_table_names():
+        if not _PARTITION_NAME.match(name):
+            continue
+        partition = Table(name, MetaData(), autoload_with=conn)
+        if conn.dialect.name == "postgresql":
+            hour = func.date_trunc("hour", partition.c.timestamp)
+        else:
+            # The text layout SQLAlchemy stores DateTime values in
+            hour = func.strftime("%Y-%m-%d %H:00:00.000000", partition.c.timestamp)
+        conn.execute(insert(rollups).from_select(
+            ["lock_id", "hour", "access_type", "success", "count"],
+            select(partition.c.lock_id, hour, partition.c.access_type, partition.c.success, func.count())
+            .group_by(partition.c.lock_id, hour, partition.c.access_type, partition.c.success),
+        ))
+    conn.execute(insert(totals).from_select(
+        ["lock_id", "access_type", "success", "count"],
+        select(rollups.c.lock_id, rollups.c.access_type, rollups.c.success, func.sum(rollups.c.count))
+        .group_by(rollups.c.lock_id, rollups.c.access_type, rollups.c.success),
+    ))
+
+
+def head() -> int:
+    return MIGRATIONS[-1].version if MIGRATIONS else 0
+
+
+def current_version(conn: Connection) -> int:
+    if not inspect(conn).has_table(schema_version.name):
+        return 0
+    return conn.execute(select(func.max(schema_version.c.version))).scalar() or 0
+
+
+def _begin(conn: Connection):
+    # pysqlite does not open a transaction before DDL by itself
+    if conn.dialect.name == "sqlite":
+        conn.exec_driver_sql("BEGIN")
+
+
+def _record(conn: Connection, migration_: Migration):
+    conn.execute(schema_version.insert().values(
+        version=migration_.version,
+        description=migration_.description,
+        applied_at=datetime.utcnow(),
+    ))
+
+
+def _prepare(conn: Connection) -> List[Migration]:
+    """Create missing tables; return the migrations this database still needs."""
+    fresh = not inspect(conn).has_table("locks")
+    if fresh and conn.dialect.name == "sqlite":
+        # Lets dropped access log partitions shrink the file; only settable before the first table
+        conn.exec_driver_sql("PRAGMA auto_vacuum = INCREMENTAL")
+    schema_version.create(conn, checkfirst=True)
+    Base.metadata.create_all(conn)
+    if fresh:
+        for migration_ in MIGRATIONS:
+            _record(conn, migration_)
+        return []
+    version = current_version(conn)
+    if version > head():
+        raise RuntimeError(f"Database schema version {version} is newer than this server ({head()})")
+    return [migration_ for migration_ in MIGRATIONS if migration_.version > version]
+
+
+def _apply(conn: Connection, migration_: Migration):
+    migration_.upgrade(conn)
+    _record(conn, migration_)
+
+
+async def migrate(engine):
+    """Bring the database behind ``engine`` up to the latest schema version."""
+    async with engine.connect() as conn:
+        await conn.run_sync(_begin)
+        pending = await conn.run_sync(_prepare)
+        await conn.commit()
+    for migration_ in pending:
+        logger.info(f"Applying migration {migration_.version}: {migration_.description}")
+        async with engine.connect() as conn:
+            await conn.run_sync(_begin)
+            await conn.run_sync(_apply, migration_)
+            await conn.commit()
+    if pending:
+        logger.info(f"Database schema at version {pending[-1].version}")
+
+
+# Hot queries and the index each must use, as (name, statement, index)
+HOT_QUERIES = [
+    (
+        "config build: active PINs of a lock and master PINs",
+        select(AccessCode.lock_id, AccessCode.code).where(
+            AccessCode.is_active == True,
+            or_(AccessCode.lock_id.in_([1, 2]), AccessCode.lock_id == None),
+        ),
+        "ix_access_codes_lock_id_is_active",
+    ),
+    (
+        "key tag of a lock",
+        select(RFIDCard.id).where(RFIDCard.lock_id == 1, RFIDCard.card_type == "key_tag"),
+        "ix_rfid_cards_lock_id_card_type",
+    ),
+    (
+        "next validity boundaries",
+        select(AccessCode.valid_until, AccessCode.lock_id)
+        .where(AccessCode.valid_until >= datetime(2024, 1, 1), AccessCode.is_active == True)
+        .order_by(AccessCode.valid_until).limit(500),
+        "ix_access_codes_valid_until",
+    ),
+    (
+        "hourly access counts of a time range",
+        select(AccessLogRollup.success, func.sum(AccessLogRollup.count))
+        .where(AccessLogRollup.hour >= datetime(2024, 1, 1), AccessLogRollup.hour < datetime(2024, 1, 2))
+        .group_by(AccessLogRollup.success),
+        "ix_access_log_rollups_hour",
+    ),
+    (
+        "online verification of a PIN",
+        select(AccessCode.id).where(
+            AccessCode.code == "1234",
+            AccessCode.is_active == True,
+            or_(AccessCode.lock_id == 1, AccessCode.lock_id == None),
+        ).limit(1),
+        "ix_access_codes_code",
+    ),
+]
+
+
+def _access_log_queries(partition: Table) -> list:
+    """Hot queries on one access log partition."""
+    return [
+        (
+            f"access logs of a lock, newest first ({partition.name})",
+            select(partition).where(partition.c.lock_id == 1)
+            .order_by(partition.c.timestamp.desc(), partition.c.id.desc()).limit(100),
+            f"ix_{partition.name}_lock_id_timestamp",
+        ),
+        (
+            f"next page of a lock's access logs ({partition.name})",
+            select(partition).where(
+                partition.c.lock_id == 1,
+                partition.c.timestamp <= datetime(2024, 1, 1),
+                or_(partition.c.timestamp < datetime(2024, 1, 1), partition.c.id < 100),
+            ).order_by(partition.c.timestamp.desc(), partition.c.id.desc()).limit(100),
+            f"ix_{partition.name}_lock_id_timestamp",
+        ),
+        (
+            f"recent access logs ({partition.name})",
+            select(partition).order_by(partition.c.timestamp.desc(), partition.c.id.desc()).limit(100),
+            f"ix_{partition.name}_timestamp",
+        ),
+    ]
+
+
+def _explain(conn: Connection, sql: str, index: str) -> Tuple[str, bool]:
+    if conn.dialect.name == "postgresql":
+        plan = "; ".join(row[0].strip() for row in conn.exec_driver_sql(f"EXPLAIN {sql}"))
+        return plan, f"using {index} " in plan or f"on {index} " in plan
+    plan = "; ".join(row[-1] for row in conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {sql}"))
+    return plan, f"INDEX {index}" in plan
+
+
+def check_query_plans(conn: Connection) -> List[Tuple[str, str, bool]]:
+    """Query plan of every hot query as (name, plan, uses its index). SQLite and PostgreSQL."""
+    queries = list(HOT_QUERIES)
+    partitions = sorted(name for name in inspect(conn).get_table_names() if _PARTITION_NAME.match(name))
+    if partitions:
+        queries += _access_log_queries(Table(partitions[-1], MetaData(), autoload_with=conn))
+    if conn.dialect.name == "postgresql":
+        conn.exec_driver_sql("SET LOCAL enable_seqscan = off")
+    results = []
+    for name, statement, index in queries:
+        sql = str(statement.compile(dialect=conn.dialect, compile_kwargs={"literal_binds": True}))
+        plan, uses_index = _explain(conn, sql, index)
+        results.append((name, plan, uses_index))
+    return results
+
+
+async def _main(args) -> int:
+    from app.database import close_db, engine
+
+    failed = 0
+    try:
+        if args.upgrade:
+            await migrate(engine)
+        async with engine.connect() as conn:
+            version = await conn.run_sync(current_version)
+            print(f"schema version {version} (latest {head()})")
+            if args.check and engine.dialect.name not in ("sqlite", "postgresql"):
+                print(f"query plan check is not implemented for {engine.dialect.name}")
+            elif args.check:
+                for name, plan, ok in await conn.run_sync(check_query_plans):
+                    print(f"{'ok  ' if ok else 'SCAN'} {name}: {plan}")
+                    failed += not ok
+    finally:
+        await close_db()
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="PineLock schema migrations")
+    parser.add_argument("--upgrade", action="store_true", help="apply pending migrations first")
+    parser.add_argument("--check", action="store_true", help="verify hot queries use their indexes")
+    sys.exit(asyncio.run(_main(parser.parse_args())))
@@ -1,11 +1,21 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey
+from sqlalchemy import (
+    Column, Integer, String, Boolean, DateTime, ForeignKey, Index, JSON, MetaData, Table, UniqueConstraint,
+)
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
-from datetime import datetime
+from datetime import datetime, timezone
+from typing import Optional
 
 Base = declarative_base()
 
 
+def naive_utc(value: Optional[datetime]) -> Optional[datetime]:
+    """DateTime columns hold naive UTC; convert offset-aware values like ``...Z``."""
+    if value is not None and value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
 class Lock(Base):
     """Lock device model."""
     __tablename__ = "locks"
@@ -25,20 +35,22 @@ class Lock(Base):
     # Relationships
     access_codes = relationship("AccessCode", back_populates="lock", cascade="all, delete-orphan")
     rfid_cards = relationship("RFIDCard", back_populates="lock", cascade="all, delete-orphan")
-    access_logs = relationship("AccessLog", back_populates="lock", cascade="all, delete-orphan")
+    config_state = relationship("DeviceConfigState", uselist=False, cascade="all, delete-orphan")
+    config_deltas = relationship("ConfigDelta", cascade="all, delete-orphan")
 
 
 class AccessCode(Base):
     """PIN access code model."""
     __tablename__ = "access_codes"
+    __table_args__ = (Index("ix_access_codes_lock_id_is_active", "lock_id", "is_active"),)
     
     id = Column(Integer, primary_key=True, index=True)
     lock_id = Column(Integer, ForeignKey("locks.id"), nullable=True)  # Nullable for Master PINs
-    code = Column(String, nullable=False)
+    code = Column(String, nullable=False, index=True)
     name = Column(String)
     is_active = Column(Boolean, default=True)
-    valid_from = Column(DateTime, nullable=True)
-    valid_until = Column(DateTime, nullable=True)
+    valid_from = Column(DateTime, nullable=True, index=True)
+    valid_until = Column(DateTime, nullable=True, index=True)
     created_at = Column(DateTime, default=datetime.utcnow)
     
     # Relationships
@@ -48,6 +60,7 @@ class AccessCode(Base):
 class RFIDCard(Base):
     """RFID card model."""
     __tablename__ = "rfid_cards"
+    __table_args__ = (Index("ix_rfid_cards_lock_id_card_type", "lock_id", "card_type"),)
     
     id = Column(Integer, primary_key=True, index=True)
     lock_id = Column(Integer, ForeignKey("locks.id"), nullable=True)  # Nullable for Master Cards
@@ -55,27 +68,84 @@ class RFIDCard(Base):
     name = Column(String)
     card_type = Column(String, default="key_tag")  # Only 'key_tag' allowed
     is_active = Column(Boolean, default=True)
-    valid_from = Column(DateTime, nullable=True)
-    valid_until = Column(DateTime, nullable=True)
+    valid_from = Column(DateTime, nullable=True, index=True)
+    valid_until = Column(DateTime, nullable=True, index=True)
     created_at = Column(DateTime, default=datetime.utcnow)
     
     # Relationships
     lock = relationship("Lock", back_populates="rfid_cards")
 
 
-class AccessLog(Base):
-    """Access log model."""
-    __tablename__ = "access_logs"
-    
+def access_log_table(name: str, metadata: MetaData) -> Table:
+    """Access log partition ``name``; one table per month, see ``app.access_logs``."""
+    return Table(
+        name,
+        metadata,
+        Column("id", Integer, primary_key=True),  # unique within the partition
+        # No foreign key: partitions are created and dropped on their own and
+        # rows of a deleted lock are removed by ``access_log_store.delete_lock``
+        Column("lock_id", Integer, nullable=False),
+        Column("access_type", String, nullable=False),  # 'pin', 'rfid', 'remote'
+        Column("access_method", String),  # PIN code or RFID UID
+        Column("success", Boolean, nullable=False),
+        Column("timestamp", DateTime, nullable=False, default=datetime.utcnow),
+        Index(f"ix_{name}_lock_id_timestamp", "lock_id", "timestamp"),
+        Index(f"ix_{name}_timestamp", "timestamp"),
+    )
+
+
+class AccessLogRollup(Base):
+    """Access log counts per lock, hour, access type and outcome."""
+    __tablename__ = "access_log_rollups"
+    __table_args__ = (Index("ix_access_log_rollups_hour", "hour"),)
+
+    lock_id = Column(Integer, primary_key=True)
+    hour = Column(DateTime, primary_key=True)  # start of the hour
+    access_type = Column(String, primary_key=True)
+    success = Column(Boolean, primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+
+
+class AccessLogTotal(Base):
+    """Access log counts per lock, access type and outcome over all retained logs."""
+    __tablename__ = "access_log_totals"
+
+    lock_id = Column(Integer, primary_key=True)
+    access_type = Column(String, primary_key=True)
+    success = Column(Boolean, primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+
+
+class DeviceConfigState(Base):
+    """Config sequence of a lock and the config it was last sent."""
+    __tablename__ = "device_config_states"
+
+    lock_id = Column(Integer, ForeignKey("locks.id"), primary_key=True)
+    seq = Column(Integer, nullable=False, default=0)
+    snapshot = Column(JSON)  # access_codes / rfid_cards / key_tag at seq
+    delta_enabled = Column(Boolean, default=False)  # node understands delta messages
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+
+class ConfigDelta(Base):
+    """Add/remove operations that take a lock's config from seq - 1 to seq."""
+    __tablename__ = "config_deltas"
+    __table_args__ = (UniqueConstraint("lock_id", "seq"),)
+
     id = Column(Integer, primary_key=True, index=True)
-    lock_id = Column(Integer, ForeignKey("locks.id"), nullable=False)
-    access_type = Column(String, nullable=False)  # 'pin', 'rfid', 'remote'
-    access_method = Column(String)  # PIN code or RFID UID
-    success = Column(Boolean, nullable=False)
-    timestamp = Column(DateTime, default=datetime.utcnow)
-    
-    # Relationships
-    lock = relationship("Lock", back_populates="access_logs")
+    lock_id = Column(Integer, ForeignKey("locks.id"), nullable=False, index=True)
+    seq = Column(Integer, nullable=False)
+    ops = Column(JSON, nullable=False)  # [[op, value], ...]
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
+class LeaderLease(Base):
+    """Which consumer group member runs the singleton jobs, until when."""
+    __tablename__ = "leader_leases"
+
+    name = Column(String, primary_key=True)
+    holder = Column(String, nullable=False)
+    expires_at = Column(DateTime, nullable=False)
 
 
 class PendingDevice(Base):
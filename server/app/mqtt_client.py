@@ -1,36 +1,153 @@
 import paho.mqtt.client as mqtt
-import json
 import logging
 import asyncio
 import inspect
 import os
-from typing import Callable, Optional
-from concurrent.futures import ThreadPoolExecutor
+import socket
+import threading
+from typing import Callable, Dict, List, Optional
+from app.codec import codec_registry
 from app.config import settings
+from app.delivery import DeliveryTracker
+from app.ingest_scheduler import ingest_scheduler
+from app.payloads import decode_payload
 
 logger = logging.getLogger(__name__)
 
+# Every server process subscribes to these: they drive its in-memory fleet state
+STATE_TOPICS = ("status", "heartbeat")
+# These write rows or publish replies, so a consumer group handles each one once
+WORK_TOPICS = ("access", "sync", "alert", "verify")
+
+
+def subscription_topics(prefix: str, shared_group: Optional[str] = None) -> List[str]:
+    """Topic filters the server subscribes to.
+    
+    With ``shared_group`` the work topics become ``$share/<group>/...`` shared
+    subscriptions, so the broker hands each message to one group member. The
+    trailing ``#`` also matches codec suffixes such as ``.../status/mp``.
+    """
+    topics = [f"{prefix}/+/{message_type}/#" for message_type in STATE_TOPICS]
+    for message_type in WORK_TOPICS:
+        topic = f"{prefix}/+/{message_type}/#"
+        topics.append(f"$share/{shared_group}/{topic}" if shared_group else topic)
+    return topics
+
+
+class AsyncioTransport:
+    """Drives a paho client's socket from an asyncio event loop.
+    
+    Socket reads and writes run as reader/writer callbacks on the loop, and a
+    small task handles keepalive pings and reconnects, so no paho network
+    thread is needed. Only the blocking TCP (re)connect is run in an executor.
+    """
+    
+    def __init__(self, client: mqtt.Client, loop: asyncio.AbstractEventLoop):
+        self.client = client
+        self.loop = loop
+        self._loop_thread = threading.get_ident()
+        self._misc_task: Optional[asyncio.Task] = None
+        
+        client.on_socket_open = self._on_socket_open
+        client.on_socket_close = self._on_socket_close
+        client.on_socket_register_write = self._on_socket_register_write
+        client.on_socket_unregister_write = self._on_socket_unregister_write
+    
+    def _call(self, func, *args):
+        # paho calls these from the executor during reconnect
+        if threading.get_ident() == self._loop_thread:
+            func(*args)
+        else:
+            self.loop.call_soon_threadsafe(func, *args)
+    
+    def _on_socket_open(self, client, userdata, sock):
+        self._call(self.loop.add_reader, sock, client.loop_read)
+    
+    def _on_socket_close(self, client, userdata, sock):
+        self._call(self.loop.remove_reader, sock)
+    
+    def _on_socket_register_write(self, client, userdata, sock):
+        self._call(self.loop.add_writer, sock, client.loop_write)
+    
+    def _on_socket_unregister_write(self, client, userdata, sock):
+        self._call(self.loop.remove_writer, sock)
+    
+    def start(self):
+        if self._misc_task is None:
+            self._misc_task = self.loop.create_task(self._misc_loop())
+    
+    def stop(self):
+        if self._misc_task:
+            self._misc_task.cancel()
+            self._misc_task = None
+        # Flush the DISCONNECT packet; paho closes the socket once it is written
+        if self.client.socket() is not None:
+            self.client.loop_write()
+    
+    async def _misc_loop(self):
+        delay = 1
+        while True:
+            if self.client.socket() is None:
+                try:
+                    await self.loop.run_in_executor(None, self.client.reconnect)
+                    delay = 1
+                except Exception as e:
+                    logger.warning(f"MQTT reconnect failed: {e}, retrying in {delay}s")
+                    await asyncio.sleep(delay)
+                    delay = min(delay * 2, 60)
+                    continue
+            self.client.loop_misc()
+            await asyncio.sleep(1)
+
 
 class MQTTClient:
     """MQTT client for communicating with lock devices."""
     
-    def __init__(self):
+    def __init__(self, client_id: Optional[str] = None):
         self.client: Optional[mqtt.Client] = None
+        self.client_id = client_id
         self.message_handlers = {}
         self.is_connected = False
-        self.executor = ThreadPoolExecutor(max_workers=5)
+        self.transport_mode = settings.mqtt_transport
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.transport: Optional[AsyncioTransport] = None
+        self.shared_group = settings.mqtt_shared_group
+        self.deliveries = DeliveryTracker(settings.mqtt_max_inflight, settings.mqtt_publish_timeout)
     
-    def connect(self):
-        """Connect to MQTT broker."""
+    def connect(self, loop: Optional[asyncio.AbstractEventLoop] = None):
+        """Connect to MQTT broker.
+        
+        With the ``asyncio`` transport the socket is driven by ``loop`` (normally
+        the uvicorn loop) and handlers run there with no thread hops. With the
+        ``thread`` transport paho runs its own network thread and async handlers
+        are handed over to ``loop``, so they always run on the server loop next
+        to the singletons they use. Without ``loop`` only sync handlers can run.
+        """
         try:
+            self.loop = loop
+            if self.loop is None:
+                self.transport_mode = "thread"
+            
             # Use unique client ID per process to avoid conflicts with uvicorn reload
-            client_id = f"pinelock_server_{os.getpid()}"
-            self.client = mqtt.Client(client_id=client_id)
+            client_id = self.client_id or f"pinelock_server_{os.getpid()}"
+            if self.shared_group:
+                # Group members may run on several hosts; shared subscriptions need v5
+                client_id = self.client_id or f"pinelock_server_{socket.gethostname()}_{os.getpid()}"
+                self.client = mqtt.Client(client_id=client_id, protocol=mqtt.MQTTv5)
+            else:
+                self.client = mqtt.Client(client_id=client_id)
+            if self.transport_mode == "asyncio":
+                self.transport = AsyncioTransport(self.client, self.loop)
+                # Started before connecting so a failed first attempt is retried
+                self.transport.start()
             
             # Set callbacks
             self.client.on_connect = self._on_connect
             self.client.on_disconnect = self._on_disconnect
             self.client.on_message = self._on_message
+            self.client.on_publish = self._on_publish
+            # paho queues publishes beyond its own in-flight limit; match our window
+            self.client.max_inflight_messages_set(settings.mqtt_max_inflight)
             
             # Set credentials if provided
             if settings.mqtt_username and settings.mqtt_password:
@@ -47,9 +164,15 @@ class MQTTClient:
             )
             
             # Start network loop in background
-            self.client.loop_start()
+            if self.transport is None:
+                self.client.loop_start()
             
-            logger.info(f"Connecting to MQTT broker at {settings.mqtt_broker_host}:{settings.mqtt_broker_port}")
+            mode = f"{self.transport_mode} transport"
+            if self.shared_group:
+                mode += f", consumer group {self.shared_group}"
+            logger.info(
+                f"Connecting to MQTT broker at {settings.mqtt_broker_host}:{settings.mqtt_broker_port} ({mode})"
+            )
             
         except Exception as e:
             logger.error(f"Failed to connect to MQTT broker: {e}")
@@ -58,32 +181,33 @@ class MQTTClient:
     def disconnect(self):
         """Disconnect from MQTT broker."""
         if self.client:
-            self.client.loop_stop()
-            self.client.disconnect()
-            self.executor.shutdown(wait=True)
+            if self.transport:
+                self.client.disconnect()
+                self.transport.stop()
+            else:
+                self.client.loop_stop()
+                self.client.disconnect()
             logger.info("Disconnected from MQTT broker")
     
-    def _on_connect(self, client, userdata, flags, rc):
+    def _on_connect(self, client, userdata, flags, rc, properties=None):
         """Callback for when client connects to broker."""
         if rc == 0:
             self.is_connected = True
             logger.info("Connected to MQTT broker successfully")
             
             # Subscribe to relevant topics
-            topics = [
-                f"{settings.mqtt_topic_prefix}/+/status",
-                f"{settings.mqtt_topic_prefix}/+/access",
-                f"{settings.mqtt_topic_prefix}/+/heartbeat",
-                f"{settings.mqtt_topic_prefix}/+/sync",
-                f"{settings.mqtt_topic_prefix}/+/alert"
-            ]
+            topics = subscription_topics(settings.mqtt_topic_prefix, self.shared_group)
             for topic in topics:
                 self.client.subscribe(topic)
                 logger.info(f"Subscribed to topic: {topic}")
         else:
             logger.error(f"Failed to connect to MQTT broker with code: {rc}")
     
-    def _on_disconnect(self, client, userdata, rc):
+    def _on_publish(self, client, userdata, mid):
+        """Callback for when the broker acknowledged a QoS 1 publish."""
+        self.deliveries.on_publish(mid)
+    
+    def _on_disconnect(self, client, userdata, rc, properties=None):
         """Callback for when client disconnects from broker."""
         self.is_connected = False
         if rc != 0:
@@ -91,45 +215,51 @@ class MQTTClient:
         else:
             logger.info("Disconnected from MQTT broker")
     
-    def _run_async_handler(self, handler, device_id, data):
-        """Run async handler in a new event loop."""
-        try:
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            try:
-                loop.run_until_complete(handler(device_id, data))
-            finally:
-                loop.close()
-        except Exception as e:
-            logger.error(f"Error running async handler: {e}", exc_info=True)
+    def _dispatch(self, handler, message_type, device_id, data):
+        """Hand an async handler off to the ingest scheduler on the server loop."""
+        if self.transport is not None:
+            # Already on the event loop
+            ingest_scheduler.submit(message_type, device_id, handler, data)
+        elif self.loop is not None and not self.loop.is_closed():
+            # Thread-safe handoff from paho's network thread, ordered per device
+            self.loop.call_soon_threadsafe(
+                ingest_scheduler.submit, message_type, device_id, handler, data
+            )
+        else:
+            logger.error(f"No event loop for the {message_type} handler; dropping message from {device_id}")
     
     def _on_message(self, client, userdata, msg):
         """Callback for when a message is received."""
         try:
             topic = msg.topic
-            payload = msg.payload.decode()
-            logger.debug(f"Received message on topic {topic}: {payload}")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"Received message on topic {topic}: {msg.payload!r}")
             
-            # Parse topic to get device_id and message type
+            # Parse topic to get device_id, message type and codec suffix
+            # (shared subscriptions deliver the original topic, without $share)
             parts = topic.split('/')
             if len(parts) >= 3:
                 device_id = parts[1]
                 message_type = parts[2]
+                codec = codec_registry.for_suffix(parts[3] if len(parts) > 3 else None)
+                if codec is None:
+                    logger.warning(f"No codec for topic {topic}")
+                    return
                 
                 # Call registered handlers
                 handler_key = f"{message_type}"
                 if handler_key in self.message_handlers:
                     try:
-                        data = json.loads(payload)
+                        data = decode_payload(codec, message_type, msg.payload)
+                        codec_registry.remember(device_id, codec)
                         handler = self.message_handlers[handler_key]
                         # Check if handler is async and run it appropriately
                         if inspect.iscoroutinefunction(handler):
-                            # Run async handler in thread pool
-                            self.executor.submit(self._run_async_handler, handler, device_id, data)
+                            self._dispatch(handler, message_type, device_id, data)
                         else:
                             handler(device_id, data)
-                    except json.JSONDecodeError:
-                        logger.error(f"Failed to parse JSON payload: {payload}")
+                    except ValueError as e:
+                        logger.error(f"Invalid {codec.name} payload on {topic}: {e}")
                     except Exception as e:
                         logger.error(f"Error in message handler: {e}")
         
@@ -141,33 +271,108 @@ class MQTTClient:
         self.message_handlers[message_type] = handler
         logger.info(f"Registered handler for message type: {message_type}")
     
-    def publish(self, device_id: str, message_type: str, payload: dict):
-        """Publish a message to a device."""
+    def _encode(self, device_id: str, message_type: str, payload: dict,
+                cached: Optional[Dict[str, bytes]] = None):
+        """Topic and encoded bytes of ``payload`` for the device's codec."""
+        codec = codec_registry.for_device(device_id)
+        topic = codec_registry.topic(f"{settings.mqtt_topic_prefix}/{device_id}/{message_type}", codec)
+        message = cached.get(codec.name) if cached is not None else None
+        if message is None:
+            message = codec.encode(payload)
+            if cached is not None:
+                cached[codec.name] = message
+        return topic, message
+    
+    async def publish(self, device_id: str, message_type: str, payload: dict,
+                      cached: Optional[Dict[str, bytes]] = None, retain: bool = False,
+                      confirm: bool = False):
+        """Publish a message to a device.
+        
+        ``cached`` maps codec names to already encoded ``payload`` bytes; it is
+        used when it has the device's codec and filled in otherwise. With
+        ``retain`` the broker keeps the message for the device's next subscribe.
+        
+        Returns once paho queued the message, or with ``confirm`` once the
+        broker acknowledged it (False on timeout), see ``publish_future``.
+        """
+        if confirm:
+            return await (await self.publish_future(device_id, message_type, payload, cached, retain))
+        
+        published = self.publish_nowait(device_id, message_type, payload, cached, retain)
+        if published:
+            logger.info(f"Published to {device_id}/{message_type}: {payload}")
+        return published
+    
+    def publish_nowait(self, device_id: str, message_type: str, payload: dict,
+                       cached: Optional[Dict[str, bytes]] = None, retain: bool = False) -> bool:
+        """Queue a QoS 1 publish without awaiting anything; safe from paho's thread.
+        
+        Used by replies on the hot path (see ``handle_verify_request``), which
+        must not log their payloads.
+        """
         if not self.client or not self.is_connected:
             logger.error("Cannot publish: MQTT client not connected")
             return False
         
-        topic = f"{settings.mqtt_topic_prefix}/{device_id}/{message_type}"
         try:
-            message = json.dumps(payload)
-            result = self.client.publish(topic, message, qos=1)
+            topic, message = self._encode(device_id, message_type, payload, cached)
+            result = self.client.publish(topic, message, qos=1, retain=retain)
             if result.rc == mqtt.MQTT_ERR_SUCCESS:
-                logger.info(f"Published to {topic}: {message}")
                 return True
+            logger.error(f"Failed to publish to {topic}")
+            return False
+        except Exception as e:
+            logger.error(f"Error publishing message: {e}")
+            return False
+    
+    async def publish_future(self, device_id: str, message_type: str, payload: dict,
+                             cached: Optional[Dict[str, bytes]] = None, retain: bool = False,
+                             timeout: Optional[float] = None) -> asyncio.Future:
+        """Publish at QoS 1 and return a future of the broker's acknowledgement.
+        
+        Waits for a slot of the in-flight window first, so callers can pipeline
+        many publishes and await the futures later. The future resolves to True
+        on PUBACK and to False if the publish failed or was not acknowledged
+        within ``timeout`` (``MQTT_PUBLISH_TIMEOUT``).
+        """
+        future = asyncio.get_running_loop().create_future()
+        if not self.client or not self.is_connected:
+            logger.error("Cannot publish: MQTT client not connected")
+            future.set_result(False)
+            return future
+        
+        await self.deliveries.acquire()
+        try:
+            topic, message = self._encode(device_id, message_type, payload, cached)
+            started = self.deliveries.begin()
+            try:
+                result = self.client.publish(topic, message, qos=1, retain=retain)
+            except Exception:
+                self.deliveries.abort()
+                raise
+            if result.rc == mqtt.MQTT_ERR_SUCCESS:
+                # Also resolves it if the PUBACK already came in
+                self.deliveries.track(result.mid, message_type, future, started, timeout)
             else:
+                self.deliveries.abort()
                 logger.error(f"Failed to publish to {topic}")
-                return False
+                self.deliveries.fail(future)
         except Exception as e:
             logger.error(f"Error publishing message: {e}")
-            return False
+            self.deliveries.fail(future)
+        return future
     
-    def send_lock_command(self, device_id: str, action: str):
-        """Send lock/unlock command to a device."""
-        return self.publish(device_id, "command", {"action": action})
+    async def send_lock_command(self, device_id: str, action: str):
+        """Send lock/unlock command to a device; True once the broker acknowledged it."""
+        return await self.publish(device_id, "command", {"action": action}, confirm=True)
     
-    def request_sync(self, device_id: str):
-        """Request device to sync its access codes and RFID cards."""
-        return self.publish(device_id, "sync", {"request": "sync"})
+    def clear_retained(self, device_id: str, message_type: str):
+        """Remove the retained message of ``message_type`` for every codec suffix."""
+        if not self.client or not self.is_connected:
+            return
+        for codec in codec_registry.codecs():
+            topic = codec_registry.topic(f"{settings.mqtt_topic_prefix}/{device_id}/{message_type}", codec)
+            self.client.publish(topic, b"", qos=1, retain=True)
 
 
 # Global MQTT client instance
@@ -1,90 +1,75 @@
 import logging
+import time
 from datetime import datetime
 from sqlalchemy import select
 from app.database import async_session_maker
-from app.models import Lock, AccessLog, PendingDevice
-from app.schemas import MQTTAccessEvent, MQTTStatusUpdate
+from app.models import PendingDevice
+from app.fleet import fleet_state
+from app.liveness import liveness_tracker
+from app.ingest import access_log_writer
 from app.sse import sse_broadcaster
 
 logger = logging.getLogger(__name__)
 
 
+async def _touch(device_id: str):
+    """Mark a device as seen; returns its fleet record or None if unknown."""
+    lock = liveness_tracker.touch(device_id)
+    if lock is None and await fleet_state.refresh(device_id):
+        lock = liveness_tracker.touch(device_id)
+    return lock
+
+
 async def handle_status_update(device_id: str, data: dict):
-    """Handle status update from device."""
+    """Handle status update from device (``data`` is validated by app.payloads)."""
     try:
-        status = MQTTStatusUpdate(device_id=device_id, **data)
+        is_locked = data["is_locked"]
+        is_key_present = data.get("is_key_present")
+        is_door_open = data.get("is_door_open")
         
-        async with async_session_maker() as session:
-            # Find lock by device_id
-            result = await session.execute(
-                select(Lock).where(Lock.device_id == device_id)
-            )
-            lock = result.scalar_one_or_none()
+        await _touch(device_id)
+        lock = fleet_state.update_status(
+            device_id,
+            is_locked=is_locked,
+            is_key_present=is_key_present,
+            is_door_open=is_door_open
+        )
+        
+        if lock:
+            logger.info(f"Updated status for lock {device_id}: locked={is_locked}, key={is_key_present}, door_open={is_door_open}")
             
-            if lock:
-                lock.is_locked = status.is_locked
-                if status.is_key_present is not None:
-                    lock.is_key_present = status.is_key_present
-                if status.is_door_open is not None:
-                    lock.is_door_open = status.is_door_open
-                lock.is_online = True
-                lock.last_seen = datetime.utcnow()
-                await session.commit()
-                logger.info(f"Updated status for lock {device_id}: locked={status.is_locked}, key={status.is_key_present}, door_open={status.is_door_open}")
-                
-                # Broadcast status update to all connected SSE clients
-                await sse_broadcaster.broadcast("status_update", {
-                    "lock_id": lock.id,
-                    "device_id": device_id,
-                    "is_locked": lock.is_locked,
-                    "is_key_present": lock.is_key_present,
-                    "is_door_open": lock.is_door_open,
-                    "is_online": lock.is_online
-                })
-            else:
-                logger.warning(f"Received status from unknown device: {device_id}")
-                await _track_pending_device(session, device_id)
+            # Broadcast status update to all connected SSE clients
+            await sse_broadcaster.broadcast("status_update", lock.status_payload())
+        else:
+            logger.warning(f"Received status from unknown device: {device_id}")
+            await _track_pending_device(device_id)
     
     except Exception as e:
         logger.error(f"Error handling status update: {e}")
 
 
 async def handle_access_event(device_id: str, data: dict):
-    """Handle access event from device."""
+    """Handle access event from device (``data`` is validated by app.payloads)."""
     try:
-        event = MQTTAccessEvent(device_id=device_id, **data)
+        lock = await _touch(device_id)
         
-        async with async_session_maker() as session:
-            # Find lock by device_id
-            result = await session.execute(
-                select(Lock).where(Lock.device_id == device_id)
+        if lock:
+            # Buffered write, persisted in batches by the access log writer
+            await access_log_writer.add(
+                lock_id=lock.id,
+                access_type=data["access_type"],
+                access_method=data["access_method"],
+                success=data["success"],
+                timestamp=data.get("timestamp")
             )
-            lock = result.scalar_one_or_none()
             
-            if lock:
-                # Create access log
-                log = AccessLog(
-                    lock_id=lock.id,
-                    access_type=event.access_type,
-                    access_method=event.access_method,
-                    success=event.success,
-                    timestamp=event.timestamp or datetime.utcnow()
-                )
-                session.add(log)
-                
-                # Update last seen
-                lock.last_seen = datetime.utcnow()
-                lock.is_online = True
-                
-                await session.commit()
-                
-                logger.info(
-                    f"Logged access event for lock {device_id}: "
-                    f"type={event.access_type}, success={event.success}"
-                )
-            else:
-                logger.warning(f"Received access event from unknown device: {device_id}")
-                await _track_pending_device(session, device_id)
+            logger.info(
+                f"Logged access event for lock {device_id}: "
+                f"type={data['access_type']}, success={data['success']}"
+            )
+        else:
+            logger.warning(f"Received access event from unknown device: {device_id}")
+            await _track_pending_device(device_id)
     
     except Exception as e:
         logger.error(f"Error handling access event: {e}")
@@ -93,33 +78,31 @@ async def handle_access_event(device_id: str, data: dict):
 async def handle_heartbeat(device_id: str, data: dict):
     """Handle heartbeat from device."""
     try:
-        async with async_session_maker() as session:
-            # Find lock by device_id
-            result = await session.execute(
-                select(Lock).where(Lock.device_id == device_id)
-            )
-            lock = result.scalar_one_or_none()
-            
-            if lock:
-                lock.is_online = True
-                lock.last_seen = datetime.utcnow()
-                await session.commit()
-                logger.debug(f"Received heartbeat from lock {device_id}")
-            else:
-                logger.warning(f"Received heartbeat from unknown device: {device_id}")
-                await _track_pending_device(session, device_id)
+        if await _touch(device_id):
+            logger.debug(f"Received heartbeat from lock {device_id}")
+        else:
+            logger.warning(f"Received heartbeat from unknown device: {device_id}")
+            await _track_pending_device(device_id)
     
     except Exception as e:
         logger.error(f"Error handling heartbeat: {e}")
 
 
-from app.services import sync_device
+from app.sync_admission import sync_admission
 
 async def handle_sync_request(device_id: str, data: dict):
     """Handle sync request from device."""
     try:
         logger.info(f"Received sync request from {device_id}")
-        await sync_device(device_id)
+        # Nodes report the version of the config they hold; delta-capable
+        # nodes also report its sequence
+        version = data.get("version")
+        since = data.get("since")
+        await sync_admission.submit(
+            device_id,
+            version=str(version) if version else None,
+            since=int(since) if since is not None else None,
+        )
     except Exception as e:
         logger.error(f"Error handling sync request: {e}")
 
@@ -133,38 +116,82 @@ async def handle_alert(device_id: str, data: dict):
         
         timestamp = datetime.fromtimestamp(timestamp_raw) if timestamp_raw else datetime.utcnow()
         
-        async with async_session_maker() as session:
-            # Find lock by device_id
-            result = await session.execute(
-                select(Lock).where(Lock.device_id == device_id)
+        lock = await _touch(device_id)
+        
+        if lock:
+            # Alerts are stored as access log entries ("failures" or warnings)
+            await access_log_writer.add(
+                lock_id=lock.id,
+                access_type="alert",
+                access_method=alert_type,
+                success=False,
+                timestamp=timestamp
             )
-            lock = result.scalar_one_or_none()
-            
-            if lock:
-                # Create access log entry for the alert
-                log = AccessLog(
-                    lock_id=lock.id,
-                    access_type="alert",
-                    access_method=alert_type,
-                    success=False,  # Alerts are usually "failures" or warnings
-                    timestamp=timestamp
-                )
-                session.add(log)
-                
-                # Update last seen
-                lock.last_seen = datetime.utcnow()
-                lock.is_online = True
-                
-                await session.commit()
-                logger.warning(f"Logged alert for lock {device_id}: type={alert_type}, message={message}")
-            else:
-                logger.warning(f"Received alert from unknown device: {device_id}")
-                await _track_pending_device(session, device_id)
+            logger.warning(f"Logged alert for lock {device_id}: type={alert_type}, message={message}")
+        else:
+            logger.warning(f"Received alert from unknown device: {device_id}")
+            await _track_pending_device(device_id)
                 
     except Exception as e:
         logger.error(f"Error handling alert: {e}")
 
 
+from app.credentials import CARD, PIN, credential_index
+from app.mqtt_client import mqtt_client as _mqtt_client
+
+
+def _verify_request(data: dict):
+    """(kind, value) of a verify request, or None if it names no credential."""
+    if data.get("pin"):
+        return PIN, data["pin"]
+    if data.get("card"):
+        return CARD, data["card"]
+    return None
+
+
+def handle_verify_request(device_id: str, data: dict):
+    """Answer a node's online PIN/card check from the credential index.
+    
+    Synchronous on purpose: it runs inline in the MQTT message callback
+    instead of waiting in the ingest queues behind access logs.
+    """
+    started = time.perf_counter()
+    valid = False
+    try:
+        lock = fleet_state.get(device_id)
+        request = _verify_request(data)
+        if lock is None:
+            credential_index.unknown_devices += 1
+        valid = lock is not None and request is not None and credential_index.verify(lock.id, *request)
+    except Exception as e:
+        logger.error(f"Error handling verify request: {e}")
+    _publish_verdict(device_id, data, valid, started)
+
+
+async def handle_verify_request_db(device_id: str, data: dict):
+    """``handle_verify_request`` for shared subscriptions, answered from the database."""
+    started = time.perf_counter()
+    valid = False
+    try:
+        lock = fleet_state.get(device_id) or await fleet_state.refresh(device_id)
+        request = _verify_request(data)
+        if lock is None:
+            credential_index.unknown_devices += 1
+        valid = lock is not None and request is not None and await credential_index.verify_from_db(lock.id, *request)
+    except Exception as e:
+        logger.error(f"Error handling verify request: {e}")
+    _publish_verdict(device_id, data, valid, started)
+
+
+def _publish_verdict(device_id: str, data: dict, valid: bool, started: float):
+    """Always answer; a failed lookup is an explicit deny, not a node left waiting."""
+    try:
+        _mqtt_client.publish_nowait(device_id, "verdict", {"id": data["id"], "valid": valid})
+        credential_index.record(valid, started)
+    except Exception as e:
+        logger.error(f"Error publishing verdict: {e}")
+
+
 def setup_mqtt_handlers(mqtt_client):
     """Register MQTT message handlers."""
     mqtt_client.register_handler("status", handle_status_update)
@@ -172,17 +199,22 @@ def setup_mqtt_handlers(mqtt_client):
     mqtt_client.register_handler("heartbeat", handle_heartbeat)
     mqtt_client.register_handler("sync", handle_sync_request)
     mqtt_client.register_handler("alert", handle_alert)
-async def _track_pending_device(session, device_id: str):
+    mqtt_client.register_handler(
+        "verify", handle_verify_request if credential_index.enabled else handle_verify_request_db
+    )
+
+async def _track_pending_device(device_id: str):
     """Record or update pending domek entries."""
     clean_device_id = device_id.strip()
-    result = await session.execute(
-        select(PendingDevice).where(PendingDevice.device_id == clean_device_id)
-    )
-    pending = result.scalar_one_or_none()
-    now = datetime.utcnow()
-    if pending:
-        pending.last_seen = now
-    else:
-        pending = PendingDevice(device_id=clean_device_id, first_seen=now, last_seen=now)
-        session.add(pending)
-    await session.commit()
+    async with async_session_maker() as session:
+        result = await session.execute(
+            select(PendingDevice).where(PendingDevice.device_id == clean_device_id)
+        )
+        pending = result.scalar_one_or_none()
+        now = datetime.utcnow()
+        if pending:
+            pending.last_seen = now
+        else:
+            pending = PendingDevice(device_id=clean_device_id, first_seen=now, last_seen=now)
+            session.add(pending)
+        await session.commit()
@@ -0,0 +1,58 @@
+"""
+Fast-path decoding of hot MQTT payloads.
+
+Status updates, access events and verification requests arrive for every
+lock all the time. Their validators are compiled once at import (pydantic-core
+``TypeAdapter``s over the payload shape, mirroring ``MQTTStatusUpdate``/
+``MQTTAccessEvent`` without ``device_id``). JSON payloads are parsed and validated in a single pass with
+``validate_json``; other codecs decode first and validate the resulting dict.
+Handlers receive plain dicts with coerced values (e.g. ``timestamp`` as a
+datetime); invalid payloads raise ``ValueError``.
+"""
+from datetime import datetime
+from typing import Dict, Optional, Union
+
+from pydantic import ConfigDict, TypeAdapter
+from typing_extensions import Required, TypedDict
+
+from app.codec import Codec, JsonCodec
+
+
+class StatusPayload(TypedDict, total=False):
+    # Extra keys (e.g. key_uid) are kept for handlers that want them
+    __pydantic_config__ = ConfigDict(extra="allow")
+    is_locked: Required[bool]
+    is_key_present: Optional[bool]
+    is_door_open: Optional[bool]
+    timestamp: Optional[datetime]
+
+
+class AccessPayload(TypedDict, total=False):
+    __pydantic_config__ = ConfigDict(extra="allow")
+    access_type: Required[str]
+    access_method: Required[Optional[str]]
+    success: Required[bool]
+    timestamp: Optional[datetime]
+
+
+class VerifyPayload(TypedDict, total=False):
+    id: Required[Union[int, str]]  # echoed in the verdict
+    pin: str
+    card: str
+
+
+_validators: Dict[str, TypeAdapter] = {
+    "status": TypeAdapter(StatusPayload),
+    "access": TypeAdapter(AccessPayload),
+    "verify": TypeAdapter(VerifyPayload),
+}
+
+
+def decode_payload(codec: Codec, message_type: str, payload: bytes) -> dict:
+    """Decode ``payload`` and validate it if ``message_type`` has a fast path."""
+    validator = _validators.get(message_type)
+    if validator is None:
+        return codec.decode(payload)
+    if isinstance(codec, JsonCodec):
+        return validator.validate_json(payload)
+    return validator.validate_python(codec.decode(payload))
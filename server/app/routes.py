@@ -1,25 +1,30 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, status
 from pathlib import Path
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
 from typing import List, Optional
-from datetime import datetime
+from datetime import datetime, timedelta
 from fastapi.responses import StreamingResponse
 import asyncio
 import json
 
-from app.database import get_session
-from app.models import Lock, AccessCode, RFIDCard, AccessLog
+from app.access_logs import access_log_store
+from app.database import get_read_session, get_session
+from app.models import Lock, AccessCode, RFIDCard
 import logging
 from datetime import datetime
 from app.schemas import (
     LockCreate, LockUpdate, LockResponse,
     AccessCodeCreate, AccessCodeUpdate, AccessCodeResponse,
     RFIDCardCreate, RFIDCardUpdate, RFIDCardResponse,
-    AccessLogResponse, LockCommand
+    AccessLogResponse, AccessStatsResponse, AccessStatsHour, LockCommand, SyncJobResponse, ImportResult,
+    UTCDatetime,
 )
 from app.mqtt_client import mqtt_client
-from app.services import sync_device
+from app.fleet import fleet_state
+from app.sync_coordinator import sync_coordinator
+from app.sync_engine import sync_engine
+from app.bulk_import import FORMATS, import_stream
 from app.sse import sse_broadcaster
 
 router = APIRouter()
@@ -65,11 +70,9 @@ async def sse_endpoint():
 
 # Lock Endpoints
 @router.get("/locks", response_model=List[LockResponse])
-async def list_locks(session: AsyncSession = Depends(get_session)):
+async def list_locks():
     """Get list of all locks with their current status."""
-    result = await session.execute(select(Lock))
-    locks = result.scalars().all()
-    return locks
+    return fleet_state.all()
 
 
 @router.post("/locks", response_model=LockResponse, status_code=status.HTTP_201_CREATED)
@@ -89,14 +92,13 @@ async def create_lock(lock: LockCreate, session: AsyncSession = Depends(get_sess
     session.add(db_lock)
     await session.commit()
     await session.refresh(db_lock)
-    return db_lock
+    return fleet_state.add(db_lock)
 
 
 @router.get("/locks/{lock_id}", response_model=LockResponse)
-async def get_lock(lock_id: int, session: AsyncSession = Depends(get_session)):
+async def get_lock(lock_id: int):
     """Get a specific lock by ID."""
-    result = await session.execute(select(Lock).where(Lock.id == lock_id))
-    lock = result.scalar_one_or_none()
+    lock = fleet_state.get_by_id(lock_id)
     if not lock:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Lock not found")
     return lock
@@ -120,7 +122,7 @@ async def update_lock(
     
     await session.commit()
     await session.refresh(lock)
-    return lock
+    return fleet_state.update_metadata(lock) or fleet_state.add(lock)
 
 
 @router.delete("/locks/{lock_id}", status_code=status.HTTP_204_NO_CONTENT)
@@ -131,32 +133,31 @@ async def delete_lock(lock_id: int, session: AsyncSession = Depends(get_session)
     if not lock:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Lock not found")
     
+    await access_log_store.delete_lock(session, lock_id)
     await session.delete(lock)
     await session.commit()
+    fleet_state.remove(lock_id)
+    mqtt_client.clear_retained(lock.device_id, "config/retained")
     return None
 
 
 @router.post("/locks/{lock_id}/command")
-async def send_lock_command(
-    lock_id: int,
-    command: LockCommand,
-    session: AsyncSession = Depends(get_session)
-):
+async def send_lock_command(lock_id: int, command: LockCommand):
     """Send lock/unlock command to a device."""
-    result = await session.execute(select(Lock).where(Lock.id == lock_id))
-    lock = result.scalar_one_or_none()
+    lock = fleet_state.get_by_id(lock_id)
     if not lock:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Lock not found")
     
     # Send command via MQTT
-    success = mqtt_client.send_lock_command(lock.device_id, command.action)
+    success = await mqtt_client.send_lock_command(lock.device_id, command.action)
     if not success:
         raise HTTPException(
             status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
-            detail="Failed to send command to device"
+            detail="Command was not acknowledged by the MQTT broker"
         )
     
-    return {"status": "command_sent", "action": command.action}
+    # Only reached once the broker acknowledged the command (QoS 1)
+    return {"status": "command_sent", "action": command.action, "acknowledged": True}
 
 
 # Access Code Endpoints
@@ -164,7 +165,7 @@ async def send_lock_command(
 async def list_all_access_codes(
     lock_id: Optional[int] = None,
     master: bool = False,
-    session: AsyncSession = Depends(get_session)
+    session: AsyncSession = Depends(get_read_session)
 ):
     """Get all access codes, optionally filtered by lock_id or master status."""
     query = select(AccessCode)
@@ -180,7 +181,7 @@ async def list_all_access_codes(
 
 
 @router.get("/locks/{lock_id}/access-codes", response_model=List[AccessCodeResponse])
-async def list_access_codes(lock_id: int, session: AsyncSession = Depends(get_session)):
+async def list_access_codes(lock_id: int, session: AsyncSession = Depends(get_read_session)):
     """Get all access codes for a lock."""
     result = await session.execute(
         select(AccessCode).where(AccessCode.lock_id == lock_id)
@@ -192,6 +193,7 @@ async def list_access_codes(lock_id: int, session: AsyncSession = Depends(get_se
 @router.post("/access-codes", response_model=AccessCodeResponse, status_code=status.HTTP_201_CREATED)
 async def create_access_code(
     access_code: AccessCodeCreate,
+    response: Response,
     session: AsyncSession = Depends(get_session)
 ):
     """Create a new access code."""
@@ -232,17 +234,15 @@ async def create_access_code(
     
     # Trigger Sync
     if access_code.lock_id is None:
-        # Sync ALL locks for Master PIN
-        result = await session.execute(select(Lock))
-        locks = result.scalars().all()
-        for lock in locks:
-            await sync_device(lock.device_id)
+        # Sync ALL locks for Master PIN, in the background
+        job = sync_engine.start_job(reason="master_pin_created")
+        response.headers["X-Sync-Job-Id"] = job.id
     else:
         # Sync specific lock
         result = await session.execute(select(Lock).where(Lock.id == access_code.lock_id))
         lock = result.scalar_one_or_none()
         if lock:
-            await sync_device(lock.device_id)
+            sync_coordinator.mark_dirty(lock.device_id)
     
     return db_code
 
@@ -250,6 +250,7 @@ async def create_access_code(
 @router.delete("/access-codes/{code_id}", status_code=status.HTTP_204_NO_CONTENT)
 async def delete_access_code(
     code_id: int,
+    response: Response,
     session: AsyncSession = Depends(get_session)
 ):
     """Delete an access code."""
@@ -265,17 +266,15 @@ async def delete_access_code(
     
     # Trigger Sync
     if lock_id is None:
-        # Sync ALL locks if it was a Master PIN
-        result = await session.execute(select(Lock))
-        locks = result.scalars().all()
-        for lock in locks:
-            await sync_device(lock.device_id)
+        # Sync ALL locks if it was a Master PIN, in the background
+        job = sync_engine.start_job(reason="master_pin_deleted")
+        response.headers["X-Sync-Job-Id"] = job.id
     else:
         # Sync specific lock
         result = await session.execute(select(Lock).where(Lock.id == lock_id))
         lock = result.scalar_one_or_none()
         if lock:
-            await sync_device(lock.device_id)
+            sync_coordinator.mark_dirty(lock.device_id)
     
     return None
 
@@ -284,6 +283,7 @@ async def delete_access_code(
 async def update_access_code(
     code_id: int,
     code_update: AccessCodeUpdate,
+    response: Response,
     session: AsyncSession = Depends(get_session)
 ):
     """Update an access code."""
@@ -299,11 +299,17 @@ async def update_access_code(
     await session.commit()
     await session.refresh(code)
     
+    if code.lock_id is None:
+        # Master PIN changed: every lock needs the new config
+        job = sync_engine.start_job(reason="master_pin_updated")
+        response.headers["X-Sync-Job-Id"] = job.id
+        return code
+    
     # Get lock and request sync
     lock_result = await session.execute(select(Lock).where(Lock.id == code.lock_id))
     lock = lock_result.scalar_one_or_none()
     if lock:
-        mqtt_client.request_sync(lock.device_id)
+        sync_coordinator.mark_dirty(lock.device_id)
     
     return code
 
@@ -324,16 +330,56 @@ async def delete_access_code(code_id: int, session: AsyncSession = Depends(get_s
     lock_result = await session.execute(select(Lock).where(Lock.id == lock_id))
     lock = lock_result.scalar_one_or_none()
     if lock:
-        mqtt_client.request_sync(lock.device_id)
+        sync_coordinator.mark_dirty(lock.device_id)
     
     return None
 
 
+# Sync Job Endpoints
+@router.get("/sync-jobs/{job_id}", response_model=SyncJobResponse)
+async def get_sync_job(job_id: str):
+    """Progress of a bulk config sync (id from the X-Sync-Job-Id header)."""
+    job = sync_engine.get(job_id)
+    if not job:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Sync job not found")
+    return job.to_dict()
+
+
+@router.post("/sync-jobs", response_model=SyncJobResponse, status_code=status.HTTP_202_ACCEPTED)
+async def start_sync_job():
+    """Push the current config to every lock."""
+    return sync_engine.start_job(reason="manual").to_dict()
+
+
+# Bulk Import Endpoints
+@router.post("/import", response_model=ImportResult)
+async def bulk_import(
+    request: Request,
+    response: Response,
+    fmt: Optional[str] = Query(None, alias="format")
+):
+    """Import locks, PINs and key tags from a streamed CSV or NDJSON body.
+    
+    The format comes from ``?format=csv|ndjson`` or the Content-Type. Invalid
+    rows are reported per line; affected locks are synced once at the end
+    (``X-Sync-Job-Id``).
+    """
+    if fmt is None:
+        fmt = "csv" if "csv" in request.headers.get("content-type", "") else "ndjson"
+    if fmt not in FORMATS:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Format must be csv or ndjson")
+    
+    result = await import_stream(request.stream(), fmt)
+    if result.sync_job_id:
+        response.headers["X-Sync-Job-Id"] = result.sync_job_id
+    return result
+
+
 # RFID Card Endpoints
 @router.get("/rfid-cards", response_model=List[RFIDCardResponse])
 async def list_all_rfid_cards(
     card_type: Optional[str] = None,
-    session: AsyncSession = Depends(get_session)
+    session: AsyncSession = Depends(get_read_session)
 ):
     """Get all RFID cards, optionally filtered by type."""
     query = select(RFIDCard)
@@ -344,7 +390,7 @@ async def list_all_rfid_cards(
     cards = result.scalars().all()
     return cards
 @router.get("/locks/{lock_id}/rfid-cards", response_model=List[RFIDCardResponse])
-async def list_rfid_cards(lock_id: int, session: AsyncSession = Depends(get_session)):
+async def list_rfid_cards(lock_id: int, session: AsyncSession = Depends(get_read_session)):
     """Get all RFID cards for a lock."""
     result = await session.execute(
         select(RFIDCard).where(RFIDCard.lock_id == lock_id)
@@ -401,7 +447,7 @@ async def create_rfid_card(
         result = await session.execute(select(Lock).where(Lock.id == rfid_card.lock_id))
         lock = result.scalar_one_or_none()
         if lock:
-            await sync_device(lock.device_id)
+            sync_coordinator.mark_dirty(lock.device_id)
     
     return db_card
 
@@ -429,7 +475,7 @@ async def update_rfid_card(
     lock_result = await session.execute(select(Lock).where(Lock.id == card.lock_id))
     lock = lock_result.scalar_one_or_none()
     if lock:
-        mqtt_client.request_sync(lock.device_id)
+        sync_coordinator.mark_dirty(lock.device_id)
     
     return card
 
@@ -450,27 +496,92 @@ async def delete_rfid_card(card_id: int, session: AsyncSession = Depends(get_ses
     lock_result = await session.execute(select(Lock).where(Lock.id == lock_id))
     lock = lock_result.scalar_one_or_none()
     if lock:
-        mqtt_client.request_sync(lock.device_id)
+        sync_coordinator.mark_dirty(lock.device_id)
     
     return None
 
 
 # Access Log Endpoints
+async def _access_log_page(response: Response, session: AsyncSession, cursor: Optional[str], limit: int, **filters):
+    try:
+        logs, next_cursor = await access_log_store.page(session, cursor=cursor, limit=limit, **filters)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return logs
+
+
+@router.get("/access-logs", response_model=List[AccessLogResponse])
+async def list_all_access_logs(
+    response: Response,
+    lock_id: Optional[int] = None,
+    access_type: Optional[str] = None,
+    success: Optional[bool] = None,
+    start: Optional[UTCDatetime] = None,
+    end: Optional[UTCDatetime] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=1000),
+    session: AsyncSession = Depends(get_read_session)
+):
+    """Get access logs of all locks, newest first.
+    
+    Pages are keyset cursors: pass the ``X-Next-Cursor`` header of a response
+    as ``cursor`` (with the same filters) for the next page. There is no
+    header on the last page.
+    """
+    return await _access_log_page(
+        response, session, cursor, limit,
+        lock_id=lock_id, access_type=access_type, success=success, start=start, end=end,
+    )
+
+
 @router.get("/locks/{lock_id}/access-logs", response_model=List[AccessLogResponse])
 async def list_access_logs(
     lock_id: int,
-    limit: int = 100,
-    session: AsyncSession = Depends(get_session)
+    response: Response,
+    access_type: Optional[str] = None,
+    success: Optional[bool] = None,
+    start: Optional[UTCDatetime] = None,
+    end: Optional[UTCDatetime] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=1000),
+    session: AsyncSession = Depends(get_read_session)
 ):
-    """Get access logs for a lock."""
-    result = await session.execute(
-        select(AccessLog)
-        .where(AccessLog.lock_id == lock_id)
-        .order_by(AccessLog.timestamp.desc())
-        .limit(limit)
+    """Get access logs for a lock, newest first (paged like ``/access-logs``)."""
+    return await _access_log_page(
+        response, session, cursor, limit,
+        lock_id=lock_id, access_type=access_type, success=success, start=start, end=end,
     )
-    logs = result.scalars().all()
-    return logs
+
+
+@router.get("/access-logs/stats", response_model=AccessStatsResponse)
+async def access_log_stats(
+    lock_id: Optional[int] = None,
+    access_type: Optional[str] = None,
+    success: Optional[bool] = None,
+    start: Optional[UTCDatetime] = None,
+    end: Optional[UTCDatetime] = None,
+    session: AsyncSession = Depends(get_read_session)
+):
+    """Access attempt counts, from the rollups; ``start``/``end`` bound the time range."""
+    return await access_log_store.summary(
+        session, lock_id=lock_id, access_type=access_type, success=success, start=start, end=end
+    )
+
+
+@router.get("/access-logs/stats/hourly", response_model=List[AccessStatsHour])
+async def access_log_stats_hourly(
+    lock_id: Optional[int] = None,
+    access_type: Optional[str] = None,
+    start: Optional[UTCDatetime] = None,
+    end: Optional[UTCDatetime] = None,
+    session: AsyncSession = Depends(get_read_session)
+):
+    """Successful and failed attempts per hour (default: the last 24 hours)."""
+    end = end or datetime.utcnow()
+    start = start or end - timedelta(hours=24)
+    return await access_log_store.hourly(session, start, end, lock_id=lock_id, access_type=access_type)
 
 
 # Log Endpoints
@@ -1,7 +1,13 @@
-from pydantic import BaseModel, Field
-from typing import Optional
+from pydantic import AfterValidator, BaseModel, Field
+from typing import Dict, List, Literal, Optional, Union
+from typing_extensions import Annotated
 from datetime import datetime
 
+from app.models import naive_utc
+
+# Validity bounds from clients, compared with naive ``utcnow()`` everywhere
+UTCDatetime = Annotated[datetime, AfterValidator(naive_utc)]
+
 
 # Lock Schemas
 class LockBase(BaseModel):
@@ -39,8 +45,8 @@ class AccessCodeBase(BaseModel):
     code: str = Field(..., min_length=4, max_length=10)
     name: Optional[str] = None
     is_active: bool = True
-    valid_from: Optional[datetime] = None
-    valid_until: Optional[datetime] = None
+    valid_from: Optional[UTCDatetime] = None
+    valid_until: Optional[UTCDatetime] = None
 
 
 class AccessCodeCreate(AccessCodeBase):
@@ -51,8 +57,8 @@ class AccessCodeUpdate(BaseModel):
     code: Optional[str] = Field(None, min_length=4, max_length=10)
     name: Optional[str] = None
     is_active: Optional[bool] = None
-    valid_from: Optional[datetime] = None
-    valid_until: Optional[datetime] = None
+    valid_from: Optional[UTCDatetime] = None
+    valid_until: Optional[UTCDatetime] = None
 
 
 class AccessCodeResponse(AccessCodeBase):
@@ -70,8 +76,8 @@ class RFIDCardBase(BaseModel):
     name: Optional[str] = None
     card_type: str = "key_tag"  # Only 'key_tag' allowed (for presence detection)
     is_active: bool = True
-    valid_from: Optional[datetime] = None
-    valid_until: Optional[datetime] = None
+    valid_from: Optional[UTCDatetime] = None
+    valid_until: Optional[UTCDatetime] = None
 
 
 class RFIDCardCreate(RFIDCardBase):
@@ -82,8 +88,8 @@ class RFIDCardUpdate(BaseModel):
     name: Optional[str] = None
     card_uid: Optional[str] = None
     is_active: Optional[bool] = None
-    valid_from: Optional[datetime] = None
-    valid_until: Optional[datetime] = None
+    valid_from: Optional[UTCDatetime] = None
+    valid_until: Optional[UTCDatetime] = None
 
 
 class RFIDCardResponse(RFIDCardBase):
@@ -108,11 +114,83 @@ class AccessLogResponse(BaseModel):
         from_attributes = True
 
 
+class AccessStatsResponse(BaseModel):
+    total: int
+    successful: int
+    failed: int
+    by_access_type: Dict[str, int]
+
+
+class AccessStatsHour(BaseModel):
+    hour: datetime
+    successful: int
+    failed: int
+
+
 # Lock Command Schemas
 class LockCommand(BaseModel):
     action: str = Field(..., pattern="^(lock|unlock)$")
 
 
+# Sync Job Schemas
+class SyncJobResponse(BaseModel):
+    id: str
+    reason: str
+    status: str  # pending, running, completed, failed, cancelled
+    total: int
+    published: int
+    failed: int
+    error: Optional[str] = None
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
+
+# Bulk Import Schemas
+class ImportLockRow(BaseModel):
+    kind: Literal["lock"]
+    device_id: str = Field(..., min_length=1)
+    name: str = Field(..., min_length=1)
+    location: Optional[str] = None
+    description: Optional[str] = None
+
+
+class ImportPinRow(BaseModel):
+    kind: Literal["pin"]
+    device_id: str = Field(..., min_length=1)  # Lock the PIN belongs to
+    code: str = Field(..., min_length=4, max_length=10, pattern="^[0-9]+$")
+    name: Optional[str] = None
+    is_active: bool = True
+    valid_from: Optional[UTCDatetime] = None
+    valid_until: Optional[UTCDatetime] = None
+
+
+class ImportKeyTagRow(BaseModel):
+    kind: Literal["key_tag"]
+    device_id: str = Field(..., min_length=1)
+    card_uid: str = Field(..., min_length=1)
+    name: Optional[str] = None
+    is_active: bool = True
+
+
+ImportRow = Union[ImportLockRow, ImportPinRow, ImportKeyTagRow]
+
+
+class ImportRowError(BaseModel):
+    line: int
+    error: str
+
+
+class ImportResult(BaseModel):
+    rows: int
+    locks_created: int
+    pins_created: int
+    key_tags_created: int
+    failed: int
+    errors: List[ImportRowError]  # First IMPORT_MAX_ERRORS only
+    sync_job_id: Optional[str] = None
+
+
 # MQTT Message Schemas
 class MQTTAccessEvent(BaseModel):
     device_id: str
@@ -1,76 +1,82 @@
 import logging
-from sqlalchemy import select, or_
-from app.database import async_session_maker
-from app.models import Lock, AccessCode, RFIDCard
+from typing import Optional
+from app.database import read_session_maker
+from app.config_cache import config_cache
+from app.config_deltas import config_of, config_sequencer
+from app.fleet import fleet_state
 from app.mqtt_client import mqtt_client
+from app.sync_engine import build_payloads
 
 logger = logging.getLogger(__name__)
 
-async def sync_device(device_id: str):
+async def sync_device(device_id: str, version: Optional[str] = None, since: Optional[int] = None):
     """
     Gather configuration for a device and push it via MQTT.
     Includes:
     - Access Codes (PINs): lock-specific + master PIN
     - RFID Cards: lock-specific only
     - Key Tag: if assigned to this lock
+    Credentials outside their valid_from/valid_until window are left out;
+    ``validity_scheduler`` re-syncs locks when a window opens or closes.
+
+    The payload comes from ``config_cache`` when it is current. Changes since
+    the lock's last config sequence are recorded by ``config_sequencer``, once
+    per cached version (up-to-date requests open no write transaction):
+    nodes that understand deltas get only those (or, when they ask ``since``
+    a sequence, whatever brings them up to date). Other nodes get the full
+    config, or just ``{"up_to_date": true}`` if their ``version`` matches.
+    Fleet-wide syncs go through ``sync_engine`` instead.
     """
     try:
-        async with async_session_maker() as session:
-            # 1. Get Lock
-            result = await session.execute(select(Lock).where(Lock.device_id == device_id))
-            lock = result.scalar_one_or_none()
-            
-            if not lock:
+        lock = fleet_state.get(device_id) or await fleet_state.refresh(device_id)
+        if not lock:
+            logger.error(f"Cannot sync unknown device: {device_id}")
+            return
+
+        entry = config_cache.get(lock.id)
+        if entry is None:
+            generation = config_cache.generation()
+            async with read_session_maker() as session:
+                payloads = await build_payloads(session, [lock.id])
+            if not payloads:
                 logger.error(f"Cannot sync unknown device: {device_id}")
                 return
+            _, _, payload = payloads[0]
+            entry = config_cache.store(lock.id, device_id, payload, generation)
 
-            # 2. Get Access Codes (lock-specific + master PIN)
-            result = await session.execute(
-                select(AccessCode).where(
-                    AccessCode.is_active == True,
-                    or_(
-                        AccessCode.lock_id == lock.id,
-                        AccessCode.lock_id == None  # Master PIN
-                    )
-                )
+        if entry.recorded is not None and (since is None or entry.recorded[1]):
+            seq, delta_enabled = entry.recorded
+            advance = config_sequencer.unchanged_advance(
+                lock.id, device_id, config_of(entry.payload), seq, delta_enabled
             )
-            access_codes = [code.code for code in result.scalars().all()]
+        else:
+            advance = (await config_sequencer.advance(
+                [(lock.id, device_id, entry.payload)],
+                delta_capable=[lock.id] if since is not None else (),
+            ))[lock.id]
+            entry.recorded = (advance.seq, advance.delta_enabled)
+        if advance.changed:
+            await config_sequencer.publish_retained(advance)
+        if since is not None:
+            await config_sequencer.catch_up(advance, since)
+            return
+        if advance.delta_enabled:
+            if advance.deltas:
+                await config_sequencer.publish_deltas(device_id, advance.deltas)
+            return
 
-            # 3. Get RFID Cards
-            # We need:
-            # - Cards assigned to this lock (lock_id == lock.id)
-            # - Key tags are handled separately to identify which UID is the Key Tag
-            
-            # Fetch all active cards relevant to this lock
-            result = await session.execute(
-                select(RFIDCard).where(
-                    RFIDCard.is_active == True,
-                    RFIDCard.lock_id == lock.id
-                )
-            )
-            all_cards = result.scalars().all()
-            
-            rfid_access_list = []
-            key_tag_uid = None
-            
-            for card in all_cards:
-                if card.card_type == 'key_tag':
-                    # This is the key tag for THIS lock
-                    key_tag_uid = card.card_uid
-                else:
-                    # Regular access card for this lock
-                    rfid_access_list.append(card.card_uid)
+        if version and version == entry.version:
+            config_cache.up_to_date += 1
+            logger.info(f"Config of {device_id} is up to date (version {version})")
+            await mqtt_client.publish(device_id, "config", {"up_to_date": True, "version": version})
+            return
 
-            # 4. Construct Payload
-            payload = {
-                "access_codes": access_codes,
-                "rfid_cards": rfid_access_list,
-                "key_tag": key_tag_uid
-            }
-            
-            # 5. Publish Config
-            logger.info(f"Syncing config to {device_id}: {len(access_codes)} PINs, {len(rfid_access_list)} Cards, KeyTag: {key_tag_uid}")
-            mqtt_client.publish(device_id, "config", payload)
+        payload = entry.payload
+        logger.info(
+            f"Syncing config to {device_id}: {len(payload['access_codes'])} PINs, "
+            f"{len(payload['rfid_cards'])} Cards, KeyTag: {payload['key_tag']}, version {entry.version}"
+        )
+        await mqtt_client.publish(device_id, "config", payload, cached=entry.encoded)
 
     except Exception as e:
         logger.error(f"Error syncing device {device_id}: {e}")
@@ -0,0 +1,165 @@
+"""
+Admission control for device sync requests.
+
+After a broker or Wi-Fi outage every node reconnects at once and asks for a
+sync. Requests are queued instead of being served on arrival: a device has at
+most one pending request (a repeat replaces its ``version``/``since``), and
+the queue is drained through a token bucket of ``sync_admission_rate``
+requests per second with bursts of ``sync_admission_burst``, at most
+``sync_concurrency`` running at a time. Together with the retained config on
+``config/retained`` most nodes never need to ask.
+"""
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Optional, Set, Tuple
+
+from app.config import settings
+from app.services import sync_device
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """Classic token bucket; ``take`` returns how long to wait for a token."""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = max(rate, 0.001)
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+
+    def take(self) -> float:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class SyncAdmission:
+    """Deduplicating, rate-limited queue in front of ``sync_device``."""
+
+    def __init__(self, rate: float, burst: int, concurrency: int):
+        self.bucket = TokenBucket(rate, burst)
+        self.concurrency = max(1, concurrency)
+        # device_id -> (version, since, queued at)
+        self._pending: "OrderedDict[str, Tuple[Optional[str], Optional[int], float]]" = OrderedDict()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._task: Optional[asyncio.Task] = None
+        self._in_flight: Set[asyncio.Task] = set()
+        self.submitted = 0
+        self.deduplicated = 0
+        self.admitted = 0
+        self.max_pending = 0
+        self.max_wait = 0.0
+        # Requests that waited for a token or a free slot, and ones dropped on stop
+        self.deferred = 0
+        self.dropped = 0
+        self._last_blocked = 0.0
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._slots = asyncio.Semaphore(self.concurrency)
+        self._task = asyncio.create_task(self._run())
+        logger.info(
+            f"Sync admission started ({self.bucket.rate:g}/s, burst {self.bucket.capacity}, "
+            f"{self.concurrency} concurrent)"
+        )
+
+    async def submit(self, device_id: str, version: Optional[str] = None, since: Optional[int] = None):
+        """Queue a sync request of ``device_id``; served directly if not started."""
+        if self._task is None:
+            await sync_device(device_id, version=version, since=since)
+            return
+        try:
+            same_loop = asyncio.get_running_loop() is self._loop
+        except RuntimeError:
+            same_loop = False
+        if same_loop:
+            self._enqueue(device_id, version, since)
+        else:
+            # Called from another thread, e.g. paho's network thread
+            self._loop.call_soon_threadsafe(self._enqueue, device_id, version, since)
+
+    def _enqueue(self, device_id: str, version: Optional[str], since: Optional[int]):
+        self.submitted += 1
+        queued = self._pending.get(device_id)
+        if queued is not None:
+            # Keep the queue position, serve the newest request
+            self.deduplicated += 1
+            self._pending[device_id] = (version, since, queued[2])
+            return
+        self._pending[device_id] = (version, since, time.monotonic())
+        self.max_pending = max(self.max_pending, len(self._pending))
+        self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            if not self._pending:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            wait = self.bucket.take()
+            if wait > 0:
+                self._last_blocked = time.monotonic()
+                await asyncio.sleep(wait)
+                continue
+            if self._slots.locked():
+                self._last_blocked = time.monotonic()
+            await self._slots.acquire()
+            if not self._pending:
+                self._slots.release()
+                continue
+            device_id, (version, since, queued_at) = self._pending.popitem(last=False)
+            self.max_wait = max(self.max_wait, time.monotonic() - queued_at)
+            self.admitted += 1
+            if queued_at <= self._last_blocked:
+                self.deferred += 1
+            task = asyncio.create_task(sync_device(device_id, version=version, since=since))
+            self._in_flight.add(task)
+            task.add_done_callback(self._finished)
+
+    def _finished(self, task: asyncio.Task):
+        self._in_flight.discard(task)
+        self._slots.release()
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self._in_flight:
+            await asyncio.gather(*self._in_flight, return_exceptions=True)
+        if self._pending:
+            # Nodes ask again on their next reconnect
+            logger.info(f"Sync admission stopped with {len(self._pending)} requests pending")
+            self.dropped += len(self._pending)
+            self._pending.clear()
+
+    def stats(self) -> dict:
+        return {
+            "submitted": self.submitted,
+            "deduplicated": self.deduplicated,
+            "admitted": self.admitted,
+            "deferred": self.deferred,
+            "dropped": self.dropped,
+            "pending": len(self._pending),
+            "in_flight": len(self._in_flight),
+            "max_pending": self.max_pending,
+            "max_wait_ms": round(self.max_wait * 1000, 1),
+        }
+
+
+# Global sync admission instance
+sync_admission = SyncAdmission(
+    rate=settings.sync_admission_rate,
+    burst=settings.sync_admission_burst,
+    concurrency=settings.sync_concurrency,
+)
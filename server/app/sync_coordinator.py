@@ -0,0 +1,97 @@
+"""
+Debounced per-device config sync.
+
+API and UI edits call ``sync_coordinator.mark_dirty(device_id)`` instead of
+syncing right away. A dirty device is synced once ``sync_debounce`` seconds
+pass without another edit, but never later than ``sync_max_delay`` seconds
+after the first one, so ten edits of one lock in a row become one sync.
+Pending syncs run on shutdown before MQTT disconnects.
+"""
+import asyncio
+import logging
+import time
+from typing import Dict, Optional, Set
+
+from app.config import settings
+from app.services import sync_device
+
+logger = logging.getLogger(__name__)
+
+
+class _Pending:
+    __slots__ = ("first_marked", "marks", "timer")
+
+    def __init__(self, first_marked: float):
+        self.first_marked = first_marked
+        self.marks = 0
+        self.timer: Optional[asyncio.TimerHandle] = None
+
+
+class SyncCoordinator:
+    """Collects dirty devices and emits at most one sync per debounce window."""
+
+    def __init__(self, debounce: float, max_delay: float):
+        self.debounce = max(0.0, debounce)
+        self.max_delay = max(self.debounce, max_delay)
+        self._pending: Dict[str, _Pending] = {}
+        self._tasks: Set[asyncio.Task] = set()
+        self.marks = 0
+        self.syncs = 0
+        self.coalesced = 0
+        self.max_observed_delay = 0.0
+
+    def mark_dirty(self, device_id: str):
+        """Schedule a sync of ``device_id``. Must run on the event loop."""
+        loop = asyncio.get_running_loop()
+        now = time.monotonic()
+        pending = self._pending.get(device_id)
+        if pending is None:
+            pending = self._pending[device_id] = _Pending(now)
+        else:
+            pending.timer.cancel()
+            self.coalesced += 1
+        pending.marks += 1
+        self.marks += 1
+        # Trailing edge of the debounce window, capped by the max delay
+        fire_at = min(now + self.debounce, pending.first_marked + self.max_delay)
+        pending.timer = loop.call_later(max(0.0, fire_at - now), self._fire, device_id)
+
+    def _fire(self, device_id: str):
+        pending = self._pending.pop(device_id, None)
+        if pending is None:
+            return
+        delay = time.monotonic() - pending.first_marked
+        self.max_observed_delay = max(self.max_observed_delay, delay)
+        self.syncs += 1
+        if pending.marks > 1:
+            logger.debug(f"Syncing {device_id}: {pending.marks} edits coalesced over {delay:.2f}s")
+        task = asyncio.create_task(sync_device(device_id))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def flush(self):
+        """Sync every pending device now."""
+        for device_id, pending in list(self._pending.items()):
+            pending.timer.cancel()
+            self._fire(device_id)
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def stop(self):
+        await self.flush()
+
+    def stats(self) -> dict:
+        return {
+            "marks": self.marks,
+            "syncs": self.syncs,
+            "coalesced": self.coalesced,
+            "pending": len(self._pending),
+            "max_delay_observed": round(self.max_observed_delay, 3),
+        }
+
+
+# Global sync coordinator instance
+sync_coordinator = SyncCoordinator(
+    debounce=settings.sync_debounce,
+    max_delay=settings.sync_max_delay,
+)
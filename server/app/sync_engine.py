@@ -0,0 +1,249 @@
+"""
+Bulk config sync.
+
+Fleet-wide changes (Master PIN created, edited or deleted) used to sync every
+lock one by one, three queries each, inside the HTTP request. ``sync_engine``
+builds every device's config payload from three set-based queries, records
+the changes in one ``config_sequencer`` transaction and publishes them (deltas,
+or full configs to nodes without delta support) from a bounded pool of workers
+in the background, pipelined through the client's QoS 1 in-flight window. Callers get a
+``SyncJob`` back immediately and can poll its progress by id.
+"""
+import asyncio
+import logging
+import uuid
+from collections import OrderedDict, defaultdict
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import and_, select, or_
+
+from app.config import settings
+from app.config_cache import config_cache
+from app.config_deltas import config_sequencer
+from app.database import read_session_maker
+from app.models import Lock, AccessCode, RFIDCard
+from app.mqtt_client import mqtt_client
+
+logger = logging.getLogger(__name__)
+
+
+def valid_at(model, now: datetime):
+    """Condition: the credential's validity window contains ``now``.
+
+    ``valid_from`` is inclusive, ``valid_until`` exclusive; a missing bound is open.
+    """
+    return and_(
+        or_(model.valid_from == None, model.valid_from <= now),
+        or_(model.valid_until == None, model.valid_until > now),
+    )
+
+
+async def build_payloads(session, lock_ids: Optional[Iterable[int]] = None) -> List[Tuple[int, str, dict]]:
+    """Config payloads for ``lock_ids`` (all locks if None) as (lock_id, device_id, payload).
+
+    Same content as ``services.sync_device``: lock-specific plus master PINs,
+    lock-specific RFID cards and the lock's key tag, each only while inside its
+    ``valid_from``/``valid_until`` window (see ``validity_scheduler``).
+    """
+    ids = None if lock_ids is None else list(lock_ids)
+    now = datetime.utcnow()
+
+    query = select(Lock.id, Lock.device_id)
+    if ids is not None:
+        query = query.where(Lock.id.in_(ids))
+    locks = (await session.execute(query)).all()
+
+    # All active codes for these locks plus master PINs, grouped by lock_id
+    query = select(AccessCode.lock_id, AccessCode.code).where(
+        AccessCode.is_active == True,
+        valid_at(AccessCode, now)
+    )
+    if ids is not None:
+        query = query.where(or_(AccessCode.lock_id.in_(ids), AccessCode.lock_id == None))
+    codes: Dict[Optional[int], List[str]] = defaultdict(list)
+    for lock_id, code in (await session.execute(query.order_by(AccessCode.id))).all():
+        codes[lock_id].append(code)
+    master_codes = codes.get(None, [])
+
+    query = select(RFIDCard.lock_id, RFIDCard.card_uid, RFIDCard.card_type).where(
+        RFIDCard.is_active == True,
+        RFIDCard.lock_id != None,
+        valid_at(RFIDCard, now)
+    )
+    if ids is not None:
+        query = query.where(RFIDCard.lock_id.in_(ids))
+    cards: Dict[int, List[str]] = defaultdict(list)
+    key_tags: Dict[int, str] = {}
+    for lock_id, card_uid, card_type in (await session.execute(query.order_by(RFIDCard.id))).all():
+        if card_type == 'key_tag':
+            key_tags[lock_id] = card_uid
+        else:
+            cards[lock_id].append(card_uid)
+
+    return [
+        (lock_id, device_id, {
+            "access_codes": codes.get(lock_id, []) + master_codes,
+            "rfid_cards": cards.get(lock_id, []),
+            "key_tag": key_tags.get(lock_id),
+        })
+        for lock_id, device_id in locks
+    ]
+
+
+class SyncJob:
+    """Progress of one bulk sync."""
+
+    def __init__(self, reason: str):
+        self.id = uuid.uuid4().hex
+        self.reason = reason
+        self.status = "pending"  # pending -> running -> completed | failed | cancelled
+        self.total = 0
+        self.published = 0
+        self.failed = 0
+        self.error: Optional[str] = None
+        self.created_at = datetime.utcnow()
+        self.started_at: Optional[datetime] = None
+        self.finished_at: Optional[datetime] = None
+        self.task: Optional[asyncio.Task] = None
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "reason": self.reason,
+            "status": self.status,
+            "total": self.total,
+            "published": self.published,
+            "failed": self.failed,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class SyncEngine:
+    """Runs bulk sync jobs with bounded publish concurrency."""
+
+    def __init__(self, concurrency: int, retained_jobs: int):
+        self.concurrency = concurrency
+        self.retained_jobs = retained_jobs
+        self._jobs: "OrderedDict[str, SyncJob]" = OrderedDict()
+        self._running: Set[SyncJob] = set()
+        self.jobs_started = 0
+        self.devices_published = 0
+        self.devices_failed = 0
+
+    def start_job(self, lock_ids: Optional[Iterable[int]] = None, reason: str = "") -> SyncJob:
+        """Schedule a sync of ``lock_ids`` (every lock if None). Must run on the event loop."""
+        job = SyncJob(reason)
+        self._jobs[job.id] = job
+        while len(self._jobs) > self.retained_jobs:
+            self._jobs.popitem(last=False)
+        ids = None if lock_ids is None else list(lock_ids)
+        job.task = asyncio.create_task(self._run(job, ids))
+        self._running.add(job)
+        self.jobs_started += 1
+        return job
+
+    def get(self, job_id: str) -> Optional[SyncJob]:
+        return self._jobs.get(job_id)
+
+    async def _run(self, job: SyncJob, lock_ids: Optional[List[int]]):
+        job.status = "running"
+        job.started_at = datetime.utcnow()
+        try:
+            generation = config_cache.generation()
+            async with read_session_maker() as session:
+                payloads = await build_payloads(session, lock_ids)
+            entries = [
+                config_cache.store(lock_id, device_id, payload, generation)
+                for lock_id, device_id, payload in payloads
+            ]
+            advances = await config_sequencer.advance(
+                (lock_id, entry.device_id, entry.payload)
+                for (lock_id, _, _), entry in zip(payloads, entries)
+            )
+            job.total = len(payloads)
+            logger.info(f"Sync job {job.id} ({job.reason or 'manual'}): {job.total} devices")
+
+            pending = iter(zip(payloads, entries))
+            acknowledgements = []
+
+            def count(done: asyncio.Future):
+                if not done.cancelled() and done.exception() is None and all(done.result()):
+                    job.published += 1
+                else:
+                    job.failed += 1
+
+            async def worker():
+                # Shared iterator: each worker pulls the next device when free.
+                # Publishes are pipelined: only a free in-flight slot is awaited
+                # here, a device counts as published once the broker acked it.
+                for (lock_id, device_id, _), entry in pending:
+                    advance = advances[lock_id]
+                    try:
+                        if advance.changed:
+                            await config_sequencer.publish_retained(advance)
+                        if advance.delta_enabled:
+                            # Only what changed; nothing at all if the lock is unaffected
+                            futures = [
+                                await mqtt_client.publish_future(device_id, "delta", message)
+                                for message in config_sequencer.delta_messages(advance.deltas)
+                            ]
+                            config_sequencer.deltas_published += len(futures)
+                        else:
+                            futures = [await mqtt_client.publish_future(
+                                device_id, "config", entry.payload, cached=entry.encoded
+                            )]
+                    except Exception as e:
+                        logger.error(f"Sync job {job.id}: error publishing to {device_id}: {e}")
+                        job.failed += 1
+                        continue
+                    done = asyncio.gather(*futures)
+                    done.add_done_callback(count)
+                    acknowledgements.append(done)
+
+            await asyncio.gather(*(worker() for _ in range(min(self.concurrency, job.total) or 1)))
+            await asyncio.gather(*acknowledgements, return_exceptions=True)
+            job.status = "completed"
+        except asyncio.CancelledError:
+            job.status = "cancelled"
+            raise
+        except Exception as e:
+            job.status = "failed"
+            job.error = str(e)
+            logger.error(f"Sync job {job.id} failed: {e}")
+        finally:
+            job.finished_at = datetime.utcnow()
+            self.devices_published += job.published
+            self.devices_failed += job.failed
+            self._running.discard(job)
+            if job.status == "completed":
+                elapsed = (job.finished_at - job.started_at).total_seconds()
+                logger.info(
+                    f"Sync job {job.id} completed: {job.published}/{job.total} published, "
+                    f"{job.failed} failed in {elapsed:.2f}s"
+                )
+
+    async def stop(self):
+        tasks = [job.task for job in self._running]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._running.clear()
+
+    def stats(self) -> dict:
+        return {
+            "jobs_started": self.jobs_started,
+            "jobs_running": len(self._running),
+            "devices_published": self.devices_published,
+            "devices_failed": self.devices_failed,
+        }
+
+
+# Global sync engine instance
+sync_engine = SyncEngine(
+    concurrency=settings.sync_concurrency,
+    retained_jobs=settings.sync_jobs_retained,
+)
@@ -5,12 +5,17 @@ from fastapi.templating import Jinja2Templates
 from sqlalchemy import select, delete
 from sqlalchemy.ext.asyncio import AsyncSession
 from datetime import datetime, timedelta
+from typing import Optional
+from urllib.parse import urlencode
 import logging
 
 from app.config import settings
-from app.database import get_session
+from app.access_logs import access_log_store
+from app.database import get_read_session, get_session
 from app.models import AccessCode, Lock, PendingDevice
-from app.mqtt_client import mqtt_client
+from app.fleet import fleet_state
+from app.sync_engine import sync_engine
+from app.sync_coordinator import sync_coordinator
 
 logger = logging.getLogger(__name__)
 
@@ -37,6 +42,21 @@ def _get_user_context(request: Request) -> dict:
     return {"username": username, "user_initial": user_initial}
 
 
+def _parse_datetime_local(value: Optional[str]) -> Optional[datetime]:
+    """Value of a datetime-local input, None if empty or invalid."""
+    try:
+        return datetime.fromisoformat(value) if value else None
+    except ValueError:
+        return None
+
+
+def _page_url(request: Request, cursor: Optional[str]) -> str:
+    params = {key: value for key, value in request.query_params.items() if key != "cursor"}
+    if cursor:
+        params["cursor"] = cursor
+    return f"{request.url.path}?{urlencode(params)}" if params else request.url.path
+
+
 @router.get("/login", response_class=HTMLResponse)
 async def login_page(request: Request):
     if _is_authenticated(request):
@@ -72,7 +92,7 @@ async def dashboard(request: Request):
 
 
 @router.get("/locks", response_class=HTMLResponse)
-async def locks_list(request: Request, session: AsyncSession = Depends(get_session)):
+async def locks_list(request: Request, session: AsyncSession = Depends(get_read_session)):
     if not _is_authenticated(request):
         return _login_redirect()
     
@@ -80,18 +100,16 @@ async def locks_list(request: Request, session: AsyncSession = Depends(get_sessi
     username = request.session.get("user", "Admin")
     user_initial = username[0].upper() if username else "A"
     
-    # Get all locks
-    result = await session.execute(select(Lock))
-    locks = result.scalars().all()
+    # Get all locks from the in-memory fleet state
+    locks = fleet_state.all()
     locks_json = []
     for lock in locks:
         lock_dict = {}
-        for k, v in lock.__dict__.items():
-            if not k.startswith('_'):
-                if isinstance(v, datetime):
-                    lock_dict[k] = v.strftime("%d.%m.%Y %H:%M")
-                else:
-                    lock_dict[k] = v
+        for k, v in lock.to_dict().items():
+            if isinstance(v, datetime):
+                lock_dict[k] = v.strftime("%d.%m.%Y %H:%M")
+            else:
+                lock_dict[k] = v
         locks_json.append(lock_dict)
 
     # Calculate stats
@@ -106,21 +124,13 @@ async def locks_list(request: Request, session: AsyncSession = Depends(get_sessi
         message = "✅ Domek został usunięty"
 
     # Get recent access logs
-    from app.models import AccessLog
-    logs_result = await session.execute(
-        select(AccessLog)
-        .join(Lock)
-        .order_by(AccessLog.timestamp.desc())
-        .limit(10)
-    )
-    access_logs = logs_result.scalars().all()
+    access_logs = await access_log_store.recent(session, limit=10)
     
     # Format logs for display
     recent_logs = []
     for log in access_logs:
         # Get lock info
-        lock_result = await session.execute(select(Lock).where(Lock.id == log.lock_id))
-        lock = lock_result.scalar_one_or_none()
+        lock = fleet_state.get_by_id(log.lock_id)
         
         if lock:
             recent_logs.append({
@@ -204,6 +214,7 @@ async def create_lock_ui(
     session.add(lock)
     await session.commit()
     await session.refresh(lock)
+    fleet_state.add(lock)
     await session.execute(
         delete(PendingDevice).where(PendingDevice.device_id == device_id)
     )
@@ -218,13 +229,12 @@ async def create_lock_ui(
 async def lock_detail(
     lock_id: int,
     request: Request,
-    session: AsyncSession = Depends(get_session)
+    session: AsyncSession = Depends(get_read_session)
 ):
     if not _is_authenticated(request):
         return _login_redirect()
     
-    lock_result = await session.execute(select(Lock).where(Lock.id == lock_id))
-    lock = lock_result.scalar_one_or_none()
+    lock = fleet_state.get_by_id(lock_id)
     if not lock:
         return RedirectResponse(url="/ui/dashboard?error=not_found", status_code=status.HTTP_303_SEE_OTHER)
     
@@ -315,7 +325,7 @@ async def create_access_code_ui(
     session.add(new_code)
     await session.commit()
     await session.refresh(new_code)
-    mqtt_client.request_sync(lock.device_id)
+    sync_coordinator.mark_dirty(lock.device_id)
     return RedirectResponse(
         url=f"/ui/locks/{lock_id}?message=code_created",
         status_code=status.HTTP_303_SEE_OTHER
@@ -361,7 +371,7 @@ async def quick_pin_update_ui(
         session.add(access_code)
         message = "pin_created"
     await session.commit()
-    mqtt_client.request_sync(lock.device_id)
+    sync_coordinator.mark_dirty(lock.device_id)
     return RedirectResponse(
         url=f"/ui/dashboard?message={message}",
         status_code=status.HTTP_303_SEE_OTHER
@@ -395,10 +405,12 @@ async def update_access_code_ui(
     access_code.is_active = is_active.lower() == "true"
     await session.commit()
     await session.refresh(access_code)
+    if access_code.lock_id is None:
+        sync_engine.start_job(reason="master_pin_updated")
     lock_result = await session.execute(select(Lock).where(Lock.id == access_code.lock_id))
     lock = lock_result.scalar_one_or_none()
     if lock:
-        mqtt_client.request_sync(lock.device_id)
+        sync_coordinator.mark_dirty(lock.device_id)
     return RedirectResponse(
         url=f"/ui/locks/{access_code.lock_id}?message=code_updated",
         status_code=status.HTTP_303_SEE_OTHER
@@ -406,7 +418,7 @@ async def update_access_code_ui(
 
 
 @router.get("/access", response_class=HTMLResponse)
-async def access_management(request: Request, session: AsyncSession = Depends(get_session)):
+async def access_management(request: Request, session: AsyncSession = Depends(get_read_session)):
     if not _is_authenticated(request):
         return _login_redirect()
     
@@ -464,48 +476,52 @@ async def rfid_cards_redirect():
 
 
 @router.get("/access-logs", response_class=HTMLResponse)
-async def access_logs_list(request: Request, session: AsyncSession = Depends(get_session)):
+async def access_logs_list(request: Request, session: AsyncSession = Depends(get_read_session)):
     if not _is_authenticated(request):
         return _login_redirect()
     
-    from app.models import AccessLog, RFIDCard
-    
     # Get filter parameters
     filter_lock_id = request.query_params.get("lock_id")
     filter_access_type = request.query_params.get("access_type")
     filter_success = request.query_params.get("success")
+    filter_date_from = request.query_params.get("date_from")
+    filter_date_to = request.query_params.get("date_to")
+    
+    filters = {
+        "lock_id": int(filter_lock_id) if filter_lock_id else None,
+        "access_type": filter_access_type or None,
+        "success": True if filter_success == "true" else (False if filter_success == "false" else None),
+        "start": _parse_datetime_local(filter_date_from),
+        "end": _parse_datetime_local(filter_date_to),
+    }
     
-    # Base query
-    query = select(AccessLog).join(Lock)
-    
-    # Apply filters
-    if filter_lock_id:
-        query = query.where(AccessLog.lock_id == int(filter_lock_id))
-    if filter_access_type:
-        query = query.where(AccessLog.access_type == filter_access_type)
-    if filter_success == "true":
-        query = query.where(AccessLog.success == True)
-    elif filter_success == "false":
-        query = query.where(AccessLog.success == False)
-    
-    query = query.order_by(AccessLog.timestamp.desc()).limit(100)
-    
-    logs_result = await session.execute(query)
-    logs = logs_result.scalars().all()
+    # One keyset page; "Załaduj więcej" links to the page after its last row
+    cursor = request.query_params.get("cursor")
+    try:
+        rows, next_cursor = await access_log_store.page(session, cursor=cursor, limit=100, **filters)
+    except ValueError:
+        cursor = None
+        rows, next_cursor = await access_log_store.page(session, limit=100, **filters)
+    # Attach the lock for display (logs of deleted locks are removed with them)
+    logs = []
+    for row in rows:
+        lock = fleet_state.get_by_id(row.lock_id)
+        if lock:
+            logs.append({**row._mapping, "lock": lock})
     
     # Get all locks for filter dropdown
     locks_result = await session.execute(select(Lock).order_by(Lock.name))
     all_locks = locks_result.scalars().all()
     
-    # Calculate stats
-    total_logs = len(logs)
-    successful_attempts = sum(1 for log in logs if log.success)
-    failed_attempts = total_logs - successful_attempts
+    # Stats cards over every matching log, from the rollups
+    summary = await access_log_store.summary(session, **filters)
+    total_logs = summary["total"]
+    successful_attempts = summary["successful"]
+    failed_attempts = summary["failed"]
     
-    # Count today's logs
-    from datetime import datetime, timedelta
-    today = datetime.utcnow().date()
-    today_count = sum(1 for log in logs if log.timestamp and log.timestamp.date() == today)
+    today = datetime.combine(datetime.utcnow().date(), datetime.min.time())
+    today_filters = {**filters, "start": max(today, filters["start"] or today)}
+    today_count = (await access_log_store.summary(session, **today_filters))["total"]
     
     return templates.TemplateResponse(
         "access_logs.html",
@@ -518,10 +534,14 @@ async def access_logs_list(request: Request, session: AsyncSession = Depends(get
             "successful_attempts": successful_attempts,
             "failed_attempts": failed_attempts,
             "today_count": today_count,
-            "filter_lock_id": int(filter_lock_id) if filter_lock_id else None,
+            "filter_lock_id": filters["lock_id"],
             "filter_access_type": filter_access_type,
-            "filter_success": True if filter_success == "true" else (False if filter_success == "false" else None),
-            "has_more": False,
+            "filter_success": filters["success"],
+            "filter_date_from": filter_date_from if filters["start"] else None,
+            "filter_date_to": filter_date_to if filters["end"] else None,
+            "has_more": next_cursor is not None,
+            "next_page_url": _page_url(request, next_cursor) if next_cursor else None,
+            "first_page_url": _page_url(request, None) if cursor else None,
             "active_page": "access-logs",
             "message": request.query_params.get("message"),
             "error": request.query_params.get("error")
@@ -530,11 +550,11 @@ async def access_logs_list(request: Request, session: AsyncSession = Depends(get
 
 
 @router.get("/settings", response_class=HTMLResponse)
-async def settings_page(request: Request, session: AsyncSession = Depends(get_session)):
+async def settings_page(request: Request, session: AsyncSession = Depends(get_read_session)):
     if not _is_authenticated(request):
         return _login_redirect()
     
-    from app.models import RFIDCard, AccessLog
+    from app.models import RFIDCard
     
     username = request.session.get("user", "Admin")
     
@@ -565,8 +585,7 @@ async def settings_page(request: Request, session: AsyncSession = Depends(get_se
     rfid_count_result = await session.execute(select(RFIDCard))
     rfid_count = len(rfid_count_result.scalars().all())
     
-    logs_count_result = await session.execute(select(AccessLog))
-    logs_count = len(logs_count_result.scalars().all())
+    logs_count = (await access_log_store.summary(session))["total"]
     
     db_stats = {
         "locks_count": locks_count,
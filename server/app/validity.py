@@ -0,0 +1,271 @@
+"""
+Validity window scheduler.
+
+PINs and RFID cards with ``valid_from``/``valid_until`` only go into a lock's
+config while inside their window (``build_payloads``), so each boundary
+changes a config. ``validity_scheduler`` keeps the upcoming boundaries in a
+min-heap of (deadline, lock id) and sleeps until the earliest one; when it
+passes, the affected locks' cached configs are invalidated and one bulk sync
+job re-syncs just those locks (every lock for Master PINs).
+
+Boundaries are loaded lazily, ``validity_page_size`` at a time, from range
+queries on the indexed ``valid_from``/``valid_until`` columns; the next page is
+read when the heap runs dry, so there are no periodic table scans however many
+time-limited guest PINs exist. Commits through the ORM report new or edited
+boundaries (session events, as in ``config_cache``); an earlier deadline wakes
+the scheduler at once. Core-level bulk writes must call ``notify`` themselves.
+A boundary that was edited away still fires once, which re-syncs a config that
+did not change (nothing is sent to delta-capable nodes).
+
+On start, boundaries of the last ``validity_startup_lookback`` seconds are
+replayed so windows that opened or closed while the server was down reach the
+locks.
+
+In a consumer group only the leader runs the scheduler (``leadership``). Edits
+made through other members do not reach its heap, so it re-reads the upcoming
+boundaries every ``validity_reload_interval`` seconds; edits already past are
+synced by the member that made them.
+"""
+import asyncio
+import heapq
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.config_cache import ALL_LOCKS, config_cache
+from app.database import read_session_maker
+from app.models import AccessCode, RFIDCard, naive_utc
+from app.sync_engine import sync_engine
+
+logger = logging.getLogger(__name__)
+
+# Heap key for Master PINs (lock_id NULL); lock ids start at 1
+MASTER = 0
+
+# Longest single sleep, so a wall clock change is noticed eventually
+MAX_SLEEP = 3600.0
+
+_BOUNDARY_COLUMNS = (
+    (AccessCode, AccessCode.valid_from),
+    (AccessCode, AccessCode.valid_until),
+    (RFIDCard, RFIDCard.valid_from),
+    (RFIDCard, RFIDCard.valid_until),
+)
+
+
+class ValidityScheduler:
+    """Min-heap of upcoming validity boundaries with lazy paging."""
+
+    def __init__(self, page_size: int, startup_lookback: float, reload_interval: Optional[float] = None):
+        self.page_size = max(1, page_size)
+        self.startup_lookback = startup_lookback
+        self.reload_interval = reload_interval
+        self._next_reload = 0.0
+        self._heap: List[Tuple[datetime, int]] = []
+        self._queued: Set[Tuple[datetime, int]] = set()
+        # Every boundary before this is in the heap; None once all are loaded
+        self._loaded_until: Optional[datetime] = None
+        self._exhausted = False
+        self._wakeup: Optional[asyncio.Event] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._task: Optional[asyncio.Task] = None
+        self.pages_loaded = 0
+        self.boundaries_fired = 0
+        self.locks_synced = 0
+        self.jobs_started = 0
+        self.notified = 0
+        self.reloads = 0
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        await self._reload(datetime.utcnow() - timedelta(seconds=self.startup_lookback))
+        self._task = asyncio.create_task(self._run())
+        logger.info(f"Validity scheduler started with {len(self._heap)} upcoming boundaries")
+
+    async def stop(self):
+        # No longer fed; a later start reloads from the database. Also ends
+        # _run if wait_for swallows the cancel because a wakeup came with it.
+        self._loop = None
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _reload(self, start: datetime):
+        """Drop the heap and read boundaries from ``start`` on again."""
+        self._heap = []
+        self._queued = set()
+        self._loaded_until = start
+        self._exhausted = False
+        await self._load_page()
+        if self.reload_interval:
+            self._next_reload = time.monotonic() + self.reload_interval
+
+    def notify(self, boundaries: Iterable[Tuple[datetime, Optional[int]]]):
+        """Report new or changed (deadline, lock_id) boundaries; safe from any thread."""
+        # The heap is naive UTC; one aware deadline would break every comparison
+        boundaries = [
+            (naive_utc(deadline), MASTER if lock_id is None else lock_id) for deadline, lock_id in boundaries
+        ]
+        if boundaries and self._loop is not None:
+            self._loop.call_soon_threadsafe(self._push, boundaries)
+
+    def _push(self, boundaries: List[Tuple[datetime, int]]):
+        earliest = self._heap[0][0] if self._heap else None
+        for item in boundaries:
+            self.notified += 1
+            # Later ones are read from the database with their page
+            if not self._exhausted and item[0] >= self._loaded_until:
+                continue
+            if item in self._queued:
+                continue
+            self._queued.add(item)
+            heapq.heappush(self._heap, item)
+        if self._heap and (earliest is None or self._heap[0][0] < earliest):
+            self._wakeup.set()
+
+    async def _load_page(self):
+        """Read the next ``page_size`` boundaries of each column after ``_loaded_until``."""
+        start = self._loaded_until
+        until: Optional[datetime] = None
+        rows: List[Tuple[datetime, Optional[int]]] = []
+        async with read_session_maker() as session:
+            for model, column in _BOUNDARY_COLUMNS:
+                page = (await session.execute(
+                    select(column, model.lock_id)
+                    .where(column >= start, model.is_active == True)
+                    .order_by(column)
+                    .limit(self.page_size)
+                )).all()
+                if len(page) == self.page_size:
+                    last = page[-1][0]
+                    if last == page[0][0]:
+                        # A whole page on one instant (a checkout time): take them all
+                        page = (await session.execute(
+                            select(column, model.lock_id)
+                            .where(column == last, model.is_active == True)
+                            .distinct()
+                        )).all()
+                        last += timedelta(microseconds=1)
+                    until = last if until is None else min(until, last)
+                rows.extend(page)
+        self.pages_loaded += 1
+        for deadline, lock_id in rows:
+            item = (deadline, MASTER if lock_id is None else lock_id)
+            if (until is None or deadline < until) and item not in self._queued:
+                self._queued.add(item)
+                heapq.heappush(self._heap, item)
+        self._loaded_until = until
+        self._exhausted = until is None
+
+    async def _run(self):
+        while self._loop is not None:
+            try:
+                if self.reload_interval and time.monotonic() >= self._next_reload:
+                    # Fire what is due first; the reload starts where that left off
+                    reloaded_from = datetime.utcnow()
+                    self._fire()
+                    await self._reload(reloaded_from)
+                    self.reloads += 1
+                    continue
+                if not self._heap and not self._exhausted:
+                    await self._load_page()
+                    continue
+                self._wakeup.clear()
+                timeout = None
+                if self._heap:
+                    timeout = min(MAX_SLEEP, (self._heap[0][0] - datetime.utcnow()).total_seconds())
+                if self.reload_interval:
+                    until_reload = self._next_reload - time.monotonic()
+                    timeout = until_reload if timeout is None else min(timeout, until_reload)
+                if timeout is None or timeout > 0:
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), timeout)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                self._fire()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error in validity scheduler: {e}")
+                await asyncio.sleep(1)
+
+    def _fire(self):
+        """Re-sync the locks of every boundary that has passed."""
+        now = datetime.utcnow()
+        lock_ids: Set[int] = set()
+        while self._heap and self._heap[0][0] <= now:
+            item = heapq.heappop(self._heap)
+            self._queued.discard(item)
+            lock_ids.add(item[1])
+            self.boundaries_fired += 1
+        if not lock_ids:
+            return
+        self.jobs_started += 1
+        if MASTER in lock_ids:
+            config_cache.invalidate([ALL_LOCKS])
+            job = sync_engine.start_job(reason="validity")
+            logger.info(f"Master PIN validity window changed, syncing every lock (job {job.id})")
+            return
+        config_cache.invalidate(lock_ids)
+        self.locks_synced += len(lock_ids)
+        job = sync_engine.start_job(lock_ids=lock_ids, reason="validity")
+        logger.info(f"Validity windows changed for {len(lock_ids)} locks (job {job.id})")
+
+    def stats(self) -> dict:
+        return {
+            "upcoming": len(self._heap),
+            "next_deadline": self._heap[0][0].isoformat() if self._heap else None,
+            "loaded_until": None if self._exhausted or self._loaded_until is None else self._loaded_until.isoformat(),
+            "pages_loaded": self.pages_loaded,
+            "boundaries_fired": self.boundaries_fired,
+            "jobs_started": self.jobs_started,
+            "locks_synced": self.locks_synced,
+            "notified": self.notified,
+            "reloads": self.reloads,
+        }
+
+
+def _boundaries(session: Session) -> List[Tuple[datetime, Optional[int]]]:
+    boundaries = []
+    for obj in list(session.new) + list(session.dirty):
+        if not isinstance(obj, (AccessCode, RFIDCard)):
+            continue
+        for deadline in (obj.valid_from, obj.valid_until):
+            if deadline is not None:
+                boundaries.append((naive_utc(deadline), obj.lock_id))
+    return boundaries
+
+
+@event.listens_for(Session, "before_flush")
+def _collect_boundaries(session, flush_context, instances):
+    boundaries = _boundaries(session)
+    if boundaries:
+        session.info.setdefault("validity_boundaries", []).extend(boundaries)
+
+
+@event.listens_for(Session, "after_commit")
+def _apply_boundaries(session):
+    boundaries = session.info.pop("validity_boundaries", None)
+    if boundaries:
+        validity_scheduler.notify(boundaries)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_boundaries(session):
+    session.info.pop("validity_boundaries", None)
+
+
+# Global validity scheduler instance
+validity_scheduler = ValidityScheduler(
+    page_size=settings.validity_page_size,
+    startup_lookback=settings.validity_startup_lookback,
+    reload_interval=settings.validity_reload_interval if settings.mqtt_shared_group else None,
+)
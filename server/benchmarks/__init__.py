@@ -0,0 +1,5 @@
+"""
+PineLock server benchmarks.
+
+Run from the ``server`` directory, e.g. ``python -m benchmarks.mqtt_dispatch``.
+"""
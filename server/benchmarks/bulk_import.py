@@ -0,0 +1,120 @@
+"""
+Bulk import throughput: a generated CSV or NDJSON file with one lock and one
+PIN per ``--locks`` (plus a key tag every third lock) is streamed through
+``POST /api/v1/import`` in 64 KiB chunks, the way a client uploads a file.
+
+Reported: rows/s, rows created and failed, the sync job size and CPU/RSS. The
+body is generated lazily, so the peak RSS is the server side of the import.
+
+    python -m benchmarks.bulk_import --locks 20000 --format csv   # ~50k rows
+"""
+import argparse
+import asyncio
+import json
+import tempfile
+from pathlib import Path
+
+from benchmarks.common import ResourceMeter, configure_environment, quiet_app_logging, save_result
+
+CHUNK_SIZE = 64 * 1024
+
+
+def generate_rows(locks: int, fmt: str):
+    columns = ("kind", "device_id", "name", "location", "code", "card_uid")
+    if fmt == "csv":
+        yield ",".join(columns) + "\n"
+    for i in range(locks):
+        device_id = f"import_{i:06d}"
+        rows = [
+            ("lock", device_id, f"Domek {i}", "Import", "", ""),
+            ("pin", device_id, "", "", f"{100000 + i}", ""),
+        ]
+        if i % 3 == 0:
+            rows.append(("key_tag", device_id, "", "", "", f"{i:08X}"))
+        for row in rows:
+            if fmt == "csv":
+                yield ",".join(row) + "\n"
+            else:
+                yield json.dumps({name: value for name, value in zip(columns, row) if value}) + "\n"
+
+
+async def stream_body(locks: int, fmt: str):
+    buffer = []
+    size = 0
+    for line in generate_rows(locks, fmt):
+        buffer.append(line)
+        size += len(line)
+        if size >= CHUNK_SIZE:
+            yield "".join(buffer).encode()
+            buffer, size = [], 0
+    if buffer:
+        yield "".join(buffer).encode()
+
+
+async def run_benchmark(args) -> dict:
+    from httpx import ASGITransport, AsyncClient
+    from app.database import close_db, init_db
+    from app.main import app
+    from app.sync_engine import sync_engine
+
+    quiet_app_logging(args.verbose)
+    await init_db()
+    jobs = []
+    started = []
+    start_job = sync_engine.start_job
+
+    def record_job(lock_ids=None, reason=""):
+        # Count the job, do not publish: there is no broker in this benchmark
+        jobs.append(len(lock_ids or ()))
+        started.append(start_job(lock_ids=set(), reason=reason))
+        return started[-1]
+
+    sync_engine.start_job = record_job
+
+    meter = ResourceMeter().start()
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://bench", timeout=None) as client:
+        response = await client.post(
+            "/api/v1/import", params={"format": args.format}, content=stream_body(args.locks, args.format),
+        )
+    resources = meter.stop()
+    await asyncio.gather(*(job.task for job in started))
+    await close_db()
+    response.raise_for_status()
+    result = response.json()
+    return {
+        "rows": result["rows"],
+        "rows_per_s": round(result["rows"] / resources["wall_s"], 1),
+        "locks_created": result["locks_created"],
+        "pins_created": result["pins_created"],
+        "key_tags_created": result["key_tags_created"],
+        "failed": result["failed"],
+        "sync_jobs": jobs,
+        "resources": resources,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Streamed bulk import throughput")
+    parser.add_argument("--locks", type=int, default=20000, help="locks in the file (~2.3 rows each)")
+    parser.add_argument("--format", choices=("csv", "ndjson"), default="csv")
+    parser.add_argument("--batch-size", type=int, help="rows per transaction (default: IMPORT_BATCH_SIZE)")
+    parser.add_argument("--database-url", help="defaults to a fresh SQLite file in a temp dir")
+    parser.add_argument("--output")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    database_url = args.database_url or f"sqlite+aiosqlite:///{Path(tempfile.mkdtemp()) / 'import.db'}"
+    configure_environment(database_url, import_batch_size=args.batch_size)
+    metrics = asyncio.run(run_benchmark(args))
+
+    print(f"rows            {metrics['rows']} ({args.format}), {metrics['rows_per_s']} rows/s")
+    print(f"created         {metrics['locks_created']} locks, {metrics['pins_created']} PINs, "
+          f"{metrics['key_tags_created']} key tags, {metrics['failed']} failed")
+    print(f"sync jobs       {metrics['sync_jobs']} (locks per job)")
+    print(f"resources       {metrics['resources']}")
+    path = save_result(f"bulk_import-{args.format}", vars(args), metrics, args.output)
+    print(f"saved           {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+Payload codec benchmark: decode + validate cost per inbound message and
+encoded size of inbound and config payloads, JSON vs MessagePack, full
+pydantic models vs the fast-path validators.
+
+    python -m benchmarks.codec --iterations 100000
+"""
+import argparse
+import time
+
+from benchmarks.common import save_result
+
+STATUS = {"is_locked": True, "is_key_present": False, "timestamp": 1717000000}
+ACCESS = {"access_type": "pin", "access_method": "123456", "success": True, "timestamp": 1717000000}
+
+
+def _config_payload(codes: int) -> dict:
+    # Shape of services.sync_device output
+    return {
+        "access_codes": [
+            {"code": f"{100000 + i}", "active": True, "valid_from": 1717000000, "valid_until": 1719600000}
+            for i in range(codes)
+        ],
+        "rfid_cards": [],
+        "key_tag": {"uid": "04A1B2C3", "active": True},
+    }
+
+
+def _time_per_op(func, iterations: int) -> float:
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark MQTT payload codecs and validation")
+    parser.add_argument("--iterations", type=int, default=100000)
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    from app.codec import JsonCodec, MsgpackCodec, msgpack
+    from app.payloads import decode_payload
+    from app.schemas import MQTTAccessEvent, MQTTStatusUpdate
+
+    codecs = [JsonCodec()] + ([MsgpackCodec()] if msgpack is not None else [])
+    metrics = {}
+    for codec in codecs:
+        status_bytes = codec.encode(STATUS)
+        access_bytes = codec.encode(ACCESS)
+        paths = {
+            "full": (
+                lambda: MQTTStatusUpdate(device_id="bench", **codec.decode(status_bytes)),
+                lambda: MQTTAccessEvent(device_id="bench", **codec.decode(access_bytes)),
+            ),
+            "fast": (
+                lambda: decode_payload(codec, "status", status_bytes),
+                lambda: decode_payload(codec, "access", access_bytes),
+            ),
+        }
+        for validation, (status, access) in paths.items():
+            key = f"{codec.name}_{validation}"
+            metrics[key] = {
+                "status_us": round(_time_per_op(status, args.iterations), 3),
+                "access_us": round(_time_per_op(access, args.iterations), 3),
+            }
+            metrics[key]["status_ops_per_sec"] = round(1e6 / metrics[key]["status_us"])
+        metrics[f"{codec.name}_bytes"] = {
+            "status": len(status_bytes),
+            "access": len(access_bytes),
+            "config_10_codes": len(codec.encode(_config_payload(10))),
+            "config_50_codes": len(codec.encode(_config_payload(50))),
+        }
+
+    for key, values in metrics.items():
+        print(f"{key:<14} {values}")
+    path = save_result("codec", vars(args), metrics, args.output)
+    print(f"saved          {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""
+Helpers shared by the benchmark scripts.
+"""
+import json
+import os
+import resource
+import subprocess
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+
+RESULTS_DIR = Path(__file__).resolve().parent / "results"
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """Nearest-rank percentile; 0.0 for an empty list."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def latency_summary(seconds: List[float]) -> Dict[str, float]:
+    """p50/p95/p99/max of a list of latencies, in milliseconds."""
+    return {
+        "count": len(seconds),
+        "p50_ms": round(percentile(seconds, 50) * 1000, 3),
+        "p95_ms": round(percentile(seconds, 95) * 1000, 3),
+        "p99_ms": round(percentile(seconds, 99) * 1000, 3),
+        "max_ms": round(max(seconds) * 1000, 3) if seconds else 0.0,
+    }
+
+
+def configure_environment(database_url: Optional[str] = None, **settings):
+    """Point the app settings at benchmark resources.
+
+    Must run before anything from ``app`` is imported, since settings are read
+    at import time.
+    """
+    if database_url:
+        os.environ["DATABASE_URL"] = database_url
+    for name, value in settings.items():
+        if value is not None:
+            os.environ[name.upper()] = str(value)
+
+
+def quiet_app_logging(verbose: bool = False):
+    """Silence SQL echo and per-message app logs so they do not skew results."""
+    import logging
+    from app.database import engine, read_engine
+
+    engine.sync_engine.echo = False
+    read_engine.sync_engine.echo = False
+    level = logging.INFO if verbose else logging.CRITICAL
+    logging.getLogger("app").setLevel(level)
+    logging.getLogger("sqlalchemy").setLevel(logging.WARNING)
+
+
+class ResourceMeter:
+    """CPU time and peak RSS of this process between start() and stop()."""
+
+    def start(self):
+        self._usage = resource.getrusage(resource.RUSAGE_SELF)
+        self._wall = time.perf_counter()
+        return self
+
+    def stop(self) -> Dict[str, float]:
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        wall = time.perf_counter() - self._wall
+        cpu = (usage.ru_utime - self._usage.ru_utime) + (usage.ru_stime - self._usage.ru_stime)
+        return {
+            "wall_s": round(wall, 3),
+            "cpu_s": round(cpu, 3),
+            "cpu_pct": round(100 * cpu / wall, 1) if wall else 0.0,
+            # ru_maxrss is in kilobytes on Linux
+            "max_rss_mb": round(usage.ru_maxrss / 1024, 1),
+        }
+
+
+def _git_revision() -> Optional[str]:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=Path(__file__).resolve().parent,
+            stderr=subprocess.DEVNULL,
+        ).decode().strip()
+    except Exception:
+        return None
+
+
+def save_result(name: str, config: dict, metrics: dict, output: Optional[str] = None) -> Path:
+    """Store a run as JSON so later runs can be compared against it."""
+    path = Path(output) if output else RESULTS_DIR / f"{name}-{datetime.now():%Y%m%d-%H%M%S}.json"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    document = {
+        "benchmark": name,
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "git_revision": _git_revision(),
+        "config": config,
+        "metrics": metrics,
+    }
+    path.write_text(json.dumps(document, indent=2))
+    return path
+
+
+def _flatten(prefix: str, value, out: Dict[str, float]):
+    if isinstance(value, dict):
+        for key, item in value.items():
+            _flatten(f"{prefix}.{key}" if prefix else key, item, out)
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        out[prefix] = value
+
+
+# Metrics checked for regressions; anything else is printed for reference only
+HIGHER_IS_BETTER = ("msgs_per_sec", "processed_per_sec", "rows_per_sec", "ops_per_sec")
+LOWER_IS_BETTER = ("_ms", "cpu_s", "cpu_pct", "max_rss_mb")
+
+
+def compare_results(baseline_path: str, candidate_path: str, threshold: float = 0.10) -> int:
+    """Print metric deltas between two stored runs; returns the regression count."""
+    baseline = json.loads(Path(baseline_path).read_text())
+    candidate = json.loads(Path(candidate_path).read_text())
+    old: Dict[str, float] = {}
+    new: Dict[str, float] = {}
+    _flatten("", baseline["metrics"], old)
+    _flatten("", candidate["metrics"], new)
+
+    regressions = 0
+    print(f"baseline  {baseline_path} ({baseline.get('git_revision')})")
+    print(f"candidate {candidate_path} ({candidate.get('git_revision')})")
+    for key in sorted(set(old) & set(new)):
+        before, after = old[key], new[key]
+        change = (after - before) / before if before else 0.0
+        worse = False
+        if key.endswith(HIGHER_IS_BETTER):
+            worse = change < -threshold
+        elif key.endswith(LOWER_IS_BETTER):
+            # Sub-millisecond / sub-unit jitter is noise, not a regression
+            worse = change > threshold and abs(after - before) >= 1
+        regressions += worse
+        flag = "REGRESSION" if worse else ""
+        print(f"{key:<45} {before:>12.3f} -> {after:>12.3f}  {change:+7.1%}  {flag}")
+    return regressions
@@ -0,0 +1,183 @@
+"""
+SQLite write contention: concurrent writers and HTTP-style readers.
+
+``--writers`` tasks each commit small write transactions in a loop (a batch of
+access logs through ``access_log_store.insert`` plus a lock status update, as
+the ingest writer and the status handlers do) while ``--readers`` tasks page
+through access logs and list locks, as the API and UI do. Runs for
+``--duration`` seconds over a seeded fleet.
+
+``--profile tuned`` uses the server defaults (WAL, single writer connection,
+read-only reader pool); ``--profile legacy`` the previous setup (rollback
+journal, ``synchronous = FULL``, one shared engine opening a connection per
+session), where writers race for the file lock.
+
+Reported: write and read latency, transactions per second and how many
+transactions failed with "database is locked".
+
+    python -m benchmarks.db_contention --profile legacy --writers 8 --readers 16
+    python -m benchmarks.db_contention --profile tuned --writers 8 --readers 16
+"""
+import argparse
+import asyncio
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from benchmarks.common import (
+    ResourceMeter, configure_environment, latency_summary, quiet_app_logging, save_result,
+)
+
+PROFILES = {
+    "legacy": {
+        "database_single_writer": "false",
+        "sqlite_journal_mode": "DELETE",
+        "sqlite_synchronous": "FULL",
+        "sqlite_cache_size_kb": 2000,
+        "sqlite_mmap_size": 0,
+    },
+    "tuned": {},
+}
+
+
+async def run_benchmark(args) -> dict:
+    from sqlalchemy import insert, select, update
+    from sqlalchemy.exc import OperationalError
+    from app.access_logs import access_log_store
+    from app.database import async_session_maker, close_db, database_stats, init_db, read_session_maker
+    from app.models import Lock
+
+    quiet_app_logging(args.verbose)
+    rng = random.Random(args.seed)
+
+    # Seed: locks and a history of access logs over the last two months
+    await init_db()
+    now = datetime.utcnow()
+    async with async_session_maker() as session:
+        await session.execute(insert(Lock), [
+            {"device_id": f"contention_{i:05d}", "name": f"Contention {i}"} for i in range(args.locks)
+        ])
+        await session.commit()
+    lock_ids = [lock_id for (lock_id,) in (await _all(read_session_maker, select(Lock.id)))]
+    for start in range(0, args.history, 5000):
+        async with async_session_maker() as session:
+            await access_log_store.insert(session, [
+                _log_row(rng, lock_ids, now - timedelta(seconds=rng.randrange(60 * 86400)))
+                for _ in range(min(5000, args.history - start))
+            ])
+            await session.commit()
+
+    write_latencies, read_latencies = [], []
+    errors = {"locked": 0, "other": 0}
+    deadline = time.perf_counter() + args.duration
+
+    async def writer(worker: int):
+        worker_rng = random.Random(args.seed + worker)
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            try:
+                async with async_session_maker() as session:
+                    await access_log_store.insert(session, [
+                        _log_row(worker_rng, lock_ids, datetime.utcnow()) for _ in range(args.batch)
+                    ])
+                    await session.execute(
+                        update(Lock).where(Lock.id == worker_rng.choice(lock_ids)).values(last_seen=datetime.utcnow())
+                    )
+                    await session.commit()
+            except OperationalError as e:
+                errors["locked" if "locked" in str(e) else "other"] += 1
+                continue
+            write_latencies.append(time.perf_counter() - started)
+
+    async def reader(worker: int):
+        worker_rng = random.Random(args.seed + 1000 + worker)
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            try:
+                async with read_session_maker() as session:
+                    if worker_rng.random() < 0.5:
+                        await access_log_store.page(session, limit=50, lock_id=worker_rng.choice(lock_ids))
+                    else:
+                        rows, cursor = await access_log_store.page(session, limit=50)
+                        if cursor:
+                            await access_log_store.page(session, cursor=cursor, limit=50)
+                        (await session.execute(select(Lock).order_by(Lock.name).limit(100))).all()
+            except OperationalError as e:
+                errors["locked" if "locked" in str(e) else "other"] += 1
+                continue
+            read_latencies.append(time.perf_counter() - started)
+
+    meter = ResourceMeter().start()
+    await asyncio.gather(
+        *(writer(i) for i in range(args.writers)),
+        *(reader(i) for i in range(args.readers)),
+    )
+    resources = meter.stop()
+    database = database_stats()
+    await close_db()
+
+    return {
+        "profile": args.profile,
+        "writes": len(write_latencies),
+        "reads": len(read_latencies),
+        "locked_errors": errors["locked"],
+        "other_errors": errors["other"],
+        "write_latency": latency_summary(write_latencies),
+        "read_latency": latency_summary(read_latencies),
+        "writes_per_s": round(len(write_latencies) / resources["wall_s"], 1),
+        "reads_per_s": round(len(read_latencies) / resources["wall_s"], 1),
+        "database": database,
+        "resources": resources,
+    }
+
+
+async def _all(session_maker, query) -> list:
+    async with session_maker() as session:
+        return (await session.execute(query)).all()
+
+
+def _log_row(rng: random.Random, lock_ids: list, timestamp: datetime) -> dict:
+    return {
+        "lock_id": rng.choice(lock_ids),
+        "access_type": rng.choice(("pin", "rfid", "remote")),
+        "access_method": "benchmark",
+        "success": rng.random() < 0.9,
+        "timestamp": timestamp,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SQLite write contention")
+    parser.add_argument("--profile", choices=sorted(PROFILES), default="tuned")
+    parser.add_argument("--writers", type=int, default=8)
+    parser.add_argument("--readers", type=int, default=16)
+    parser.add_argument("--batch", type=int, default=20, help="access logs per write transaction")
+    parser.add_argument("--locks", type=int, default=500)
+    parser.add_argument("--history", type=int, default=100000, help="access logs seeded before the run")
+    parser.add_argument("--duration", type=float, default=20.0)
+    parser.add_argument("--database-url", help="defaults to a fresh SQLite file in a temp dir")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    database_url = args.database_url or f"sqlite+aiosqlite:///{Path(tempfile.mkdtemp()) / 'contention.db'}"
+    configure_environment(database_url, **PROFILES[args.profile])
+    metrics = asyncio.run(run_benchmark(args))
+
+    print(f"profile         {args.profile}, {args.writers} writers, {args.readers} readers")
+    print(f"writes          {metrics['writes']} ({metrics['writes_per_s']}/s), "
+          f"{metrics['locked_errors']} 'database is locked', {metrics['other_errors']} other errors")
+    print(f"write latency   {metrics['write_latency']}")
+    print(f"reads           {metrics['reads']} ({metrics['reads_per_s']}/s)")
+    print(f"read latency    {metrics['read_latency']}")
+    print(f"writer          {metrics['database']['writer']}")
+    print(f"resources       {metrics['resources']}")
+    path = save_result(f"db_contention-{args.profile}", vars(args), metrics, args.output)
+    print(f"saved           {path}")
+
+
+if __name__ == "__main__":
+    main()
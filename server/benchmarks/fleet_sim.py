@@ -0,0 +1,365 @@
+"""
+Simulated lock fleet for load-testing MQTT ingest.
+
+Every virtual lock speaks the protocol of ``firmware/lock_node/src/main.cpp``:
+heartbeat, status (``is_locked``/``is_key_present``/``is_door_open``), access
+events, alerts and sync requests, each at its own per-lock interval with a
+random phase. The server pipeline (fleet state, ingest scheduler, access log
+writer, liveness tracker, SSE broadcaster) runs in this process, and messages
+reach it either directly (``--transport inproc``) or through a real broker
+(``--transport broker``).
+
+Reported: sustained msgs/sec, end-to-end latency from publish to DB commit
+(access events) and to SSE delivery (status updates), scheduler drops, CPU and
+peak RSS. Every run is stored under ``benchmarks/results`` for comparison:
+
+    python -m benchmarks.fleet_sim run --locks 1000 --duration 30 --access 5
+    python -m benchmarks.fleet_sim compare results/a.json results/b.json
+"""
+import argparse
+import asyncio
+import heapq
+import json
+import random
+import sys
+import tempfile
+import time
+from collections import defaultdict, deque
+from pathlib import Path
+from types import SimpleNamespace
+
+from benchmarks.common import (
+    ResourceMeter, compare_results, configure_environment, latency_summary,
+    quiet_app_logging, save_result,
+)
+
+MESSAGE_TYPES = ("heartbeat", "status", "access", "alert", "sync")
+
+
+class VirtualLock:
+    """Produces the JSON payloads a PineLock node publishes."""
+
+    __slots__ = ("device_id", "is_locked", "is_key_present", "is_door_open")
+
+    def __init__(self, device_id: str):
+        self.device_id = device_id
+        self.is_locked = True
+        self.is_key_present = True
+        self.is_door_open = False
+
+    def heartbeat(self, seq: int) -> dict:
+        return {"timestamp": int(time.time())}
+
+    def status(self, seq: int) -> dict:
+        # Flip something every time so each status produces a visible change
+        self.is_key_present = not self.is_key_present
+        if seq % 3 == 0:
+            self.is_door_open = not self.is_door_open
+            return {"is_locked": self.is_locked, "is_door_open": self.is_door_open,
+                    "timestamp": int(time.time())}
+        return {"is_locked": self.is_locked, "is_key_present": self.is_key_present,
+                "timestamp": int(time.time())}
+
+    def access(self, seq: int) -> dict:
+        # access_method carries the sequence number so commits can be matched
+        return {"access_type": "pin", "access_method": f"bench:{seq}",
+                "success": seq % 5 != 0, "timestamp": int(time.time())}
+
+    def alert(self, seq: int) -> dict:
+        return {"type": "vibration", "message": "Vibration detected - possible tampering",
+                "timestamp": int(time.time())}
+
+    def sync(self, seq: int) -> dict:
+        return {"request": "sync"}
+
+
+class InProcTransport:
+    """Delivers messages straight into MQTTClient._on_message on the event loop."""
+
+    def __init__(self, mqtt_client, loop):
+        import paho.mqtt.client as mqtt
+        from app.mqtt_client import AsyncioTransport
+
+        self.mqtt_client = mqtt_client
+        # Same delivery path as the asyncio transport, without a socket
+        mqtt_client.transport = AsyncioTransport(mqtt.Client(), loop)
+
+    async def start(self):
+        pass
+
+    def publish(self, topic: str, payload: bytes):
+        self.mqtt_client._on_message(None, None, SimpleNamespace(topic=topic, payload=payload))
+
+    async def stop(self):
+        self.mqtt_client.transport = None
+
+
+class BrokerTransport:
+    """Publishes through a real MQTT broker to the in-process server client."""
+
+    def __init__(self, mqtt_client, loop, host: str, port: int, qos: int):
+        import paho.mqtt.client as mqtt
+
+        self.mqtt_client = mqtt_client
+        self.loop = loop
+        self.qos = qos
+        self.publisher = mqtt.Client(client_id=f"pinelock_fleet_sim_{id(self)}")
+        self.publisher.max_queued_messages_set(0)
+        self.publisher.max_inflight_messages_set(1000)
+        self.host = host
+        self.port = port
+
+    async def start(self):
+        self.mqtt_client.connect(loop=self.loop)
+        self.publisher.connect(self.host, self.port)
+        self.publisher.loop_start()
+        for _ in range(100):
+            if self.mqtt_client.is_connected:
+                break
+            await asyncio.sleep(0.05)
+        if not self.mqtt_client.is_connected:
+            raise RuntimeError(f"Server client could not connect to {self.host}:{self.port}")
+        # Let the subscriptions settle before traffic starts
+        await asyncio.sleep(0.5)
+
+    def publish(self, topic: str, payload: bytes):
+        self.publisher.publish(topic, payload, qos=self.qos)
+
+    async def stop(self):
+        self.publisher.loop_stop()
+        self.publisher.disconnect()
+        self.mqtt_client.disconnect()
+
+
+async def _create_locks(count: int):
+    from sqlalchemy import delete, insert
+    from app.access_logs import access_log_store
+    from app.database import async_session_maker, init_db
+    from app.models import Lock
+
+    await init_db()
+    await access_log_store.drop_partitions()
+    async with async_session_maker() as session:
+        await session.execute(delete(Lock))
+        await session.execute(insert(Lock), [
+            {"device_id": f"sim_{i:05d}", "name": f"Sim {i}", "is_online": True}
+            for i in range(count)
+        ])
+        await session.commit()
+    return [VirtualLock(f"sim_{i:05d}") for i in range(count)]
+
+
+async def run_benchmark(args) -> dict:
+    from app.config import settings
+    from app.fleet import fleet_state
+    from app.ingest import access_log_writer
+    from app.ingest_scheduler import ingest_scheduler
+    from app.liveness import liveness_tracker
+    from app.mqtt_client import mqtt_client
+    from app.mqtt_handlers import setup_mqtt_handlers
+    from app.sse import sse_broadcaster
+
+    quiet_app_logging(args.verbose)
+    loop = asyncio.get_running_loop()
+    rng = random.Random(args.seed)
+
+    locks = await _create_locks(args.locks)
+    await fleet_state.load()
+    await fleet_state.start()
+    await access_log_writer.start()
+    await ingest_scheduler.start()
+    await liveness_tracker.start()
+    setup_mqtt_handlers(mqtt_client)
+
+    if args.transport == "broker":
+        transport = BrokerTransport(mqtt_client, loop, args.broker_host, args.broker_port, args.qos)
+    else:
+        transport = InProcTransport(mqtt_client, loop)
+    await transport.start()
+
+    # End-to-end tracking
+    access_sent = {}
+    commit_latencies = []
+    status_sent = defaultdict(deque)
+    sse_latencies = []
+
+    def on_flush(rows):
+        now = time.perf_counter()
+        for row in rows:
+            method = row.get("access_method") or ""
+            if method.startswith("bench:"):
+                sent = access_sent.pop(int(method[6:]), None)
+                if sent is not None:
+                    commit_latencies.append(now - sent)
+
+    access_log_writer.add_flush_listener(on_flush)
+
+    sse_queue = asyncio.Queue()
+    sse_broadcaster.add_client(sse_queue)
+
+    async def consume_sse():
+        while True:
+            message = await sse_queue.get()
+            pending = status_sent.get(message["data"]["device_id"])
+            if message["type"] == "status_update" and pending:
+                sse_latencies.append(time.perf_counter() - pending.popleft())
+
+    sse_task = asyncio.create_task(consume_sse())
+
+    # Per-lock schedule: (due, lock index, message type)
+    intervals = {
+        "heartbeat": args.heartbeat, "status": args.status, "access": args.access,
+        "alert": args.alert, "sync": args.sync,
+    }
+    schedule = []
+    start = time.perf_counter()
+    for index in range(len(locks)):
+        for message_type, interval in intervals.items():
+            if interval > 0:
+                schedule.append((start + rng.uniform(0, interval), index, message_type))
+    heapq.heapify(schedule)
+
+    prefix = settings.mqtt_topic_prefix
+    sent = defaultdict(int)
+    seq = 0
+    processed_before = ingest_scheduler.stats()["processed"]
+    meter = ResourceMeter().start()
+    end = start + args.duration
+
+    while schedule:
+        now = time.perf_counter()
+        if now >= end:
+            break
+        burst = 0
+        while schedule and schedule[0][0] <= now and burst < 500:
+            due, index, message_type = heapq.heappop(schedule)
+            lock = locks[index]
+            seq += 1
+            payload = getattr(lock, message_type)(seq)
+            stamp = time.perf_counter()
+            if message_type == "access":
+                access_sent[seq] = stamp
+            elif message_type == "status":
+                status_sent[lock.device_id].append(stamp)
+            transport.publish(f"{prefix}/{lock.device_id}/{message_type}", json.dumps(payload).encode())
+            sent[message_type] += 1
+            heapq.heappush(schedule, (due + intervals[message_type], index, message_type))
+            burst += 1
+        delay = schedule[0][0] - time.perf_counter() if schedule else 0
+        await asyncio.sleep(max(0.0, min(delay, 0.01)))
+
+    sending_time = time.perf_counter() - start
+
+    # Drain: everything published must be handled and committed
+    drain_deadline = time.perf_counter() + args.drain_timeout
+    total_sent = sum(sent.values())
+    while time.perf_counter() < drain_deadline:
+        stats = ingest_scheduler.stats()
+        handled = stats["processed"] - processed_before + stats["coalesced"] + sum(stats["dropped"].values())
+        if handled >= total_sent and stats["depth"] == 0:
+            break
+        await asyncio.sleep(0.01)
+    await access_log_writer.flush()
+    drained_time = time.perf_counter() - start
+    resources = meter.stop()
+
+    sse_task.cancel()
+    sse_broadcaster.remove_client(sse_queue)
+    await transport.stop()
+    await liveness_tracker.stop()
+    await ingest_scheduler.stop()
+    await access_log_writer.stop()
+    await fleet_state.stop()
+
+    scheduler_stats = ingest_scheduler.stats()
+    processed = scheduler_stats["processed"] - processed_before
+    return {
+        "sent": dict(sent),
+        "sent_total": total_sent,
+        "send_msgs_per_sec": round(total_sent / sending_time, 1),
+        "processed": processed,
+        "processed_per_sec": round(processed / drained_time, 1),
+        "drain_s": round(drained_time - sending_time, 3),
+        "commit_latency": latency_summary(commit_latencies),
+        "commit_unmatched": len(access_sent),
+        "sse_latency": latency_summary(sse_latencies),
+        "scheduler": {
+            "coalesced": scheduler_stats["coalesced"],
+            "over_limit": scheduler_stats["over_limit"],
+            "dropped": scheduler_stats["dropped"],
+        },
+        "writer": {
+            "avg_batch_size": access_log_writer.stats()["avg_batch_size"],
+            "avg_flush_ms": access_log_writer.stats()["avg_flush_ms"],
+        },
+        "resources": resources,
+    }
+
+
+def _print_report(metrics: dict):
+    print(f"sent          {metrics['sent_total']} msgs ({metrics['send_msgs_per_sec']} msgs/s) {metrics['sent']}")
+    print(f"processed     {metrics['processed']} msgs ({metrics['processed_per_sec']} msgs/s sustained, drain {metrics['drain_s']} s)")
+    for name in ("commit_latency", "sse_latency"):
+        summary = metrics[name]
+        print(
+            f"{name:<13} n={summary['count']} p50 {summary['p50_ms']} ms  p95 {summary['p95_ms']} ms  "
+            f"p99 {summary['p99_ms']} ms  max {summary['max_ms']} ms"
+        )
+    print(f"scheduler     {metrics['scheduler']}")
+    print(f"writer        {metrics['writer']}")
+    print(f"resources     {metrics['resources']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulated PineLock fleet load test")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="run a load test and store the result")
+    run.add_argument("--locks", type=int, default=500)
+    run.add_argument("--duration", type=float, default=20.0, help="seconds of traffic")
+    run.add_argument("--transport", choices=("inproc", "broker"), default="inproc")
+    run.add_argument("--broker-host", default="localhost")
+    run.add_argument("--broker-port", type=int, default=1883)
+    run.add_argument("--qos", type=int, default=0, choices=(0, 1))
+    run.add_argument("--database-url", help="defaults to a fresh SQLite file in a temp dir")
+    # Seconds between messages of each type, per lock (0 disables the type)
+    run.add_argument("--heartbeat", type=float, default=60.0)
+    run.add_argument("--status", type=float, default=30.0)
+    run.add_argument("--access", type=float, default=20.0)
+    run.add_argument("--alert", type=float, default=600.0)
+    run.add_argument("--sync", type=float, default=0.0)
+    run.add_argument("--drain-timeout", type=float, default=30.0)
+    run.add_argument("--seed", type=int, default=1)
+    run.add_argument("--name", default="fleet_sim")
+    run.add_argument("--output", help="result file (default: benchmarks/results/<name>-<time>.json)")
+    run.add_argument("--verbose", action="store_true")
+
+    compare = commands.add_parser("compare", help="compare two stored results")
+    compare.add_argument("baseline")
+    compare.add_argument("candidate")
+    compare.add_argument("--threshold", type=float, default=0.10)
+
+    args = parser.parse_args()
+    if args.command == "compare":
+        sys.exit(1 if compare_results(args.baseline, args.candidate, args.threshold) else 0)
+
+    database_url = args.database_url
+    if not database_url:
+        database_url = f"sqlite+aiosqlite:///{Path(tempfile.mkdtemp()) / 'fleet_sim.db'}"
+    configure_environment(
+        database_url,
+        mqtt_broker_host=args.broker_host,
+        mqtt_broker_port=args.broker_port,
+        heartbeat_interval=args.heartbeat or None,
+    )
+
+    metrics = asyncio.run(run_benchmark(args))
+    _print_report(metrics)
+    config = {key: value for key, value in vars(args).items() if key not in ("command", "output", "verbose")}
+    config["database_url"] = database_url.split("@")[-1]
+    path = save_result(args.name, config, metrics, args.output)
+    print(f"saved         {path}")
+
+
+if __name__ == "__main__":
+    main()
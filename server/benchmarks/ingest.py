@@ -0,0 +1,157 @@
+"""
+Access log ingest throughput, on SQLite or PostgreSQL.
+
+``--producers`` tasks push ``--rows`` access logs (spread over ``--locks``
+locks, a few from last month) into ``access_log_writer`` as fast as it takes
+them, the way the MQTT handlers do under a burst of access events. The writer
+flushes them in batches through ``access_log_store``: executemany inserts on
+SQLite, COPY on PostgreSQL for batches of ``--copy-rows`` or more (set it above
+``--max-pending`` to compare against executemany).
+
+Reported: rows/s, add-to-commit latency, batch sizes and flush times. The
+database should be a scratch one: existing access log partitions are dropped
+first.
+
+    python -m benchmarks.ingest --rows 200000
+    python -m benchmarks.ingest --rows 200000 --database-url postgresql://pinelock@localhost/pinelock_bench
+"""
+import argparse
+import asyncio
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from benchmarks.common import (
+    ResourceMeter, configure_environment, latency_summary, quiet_app_logging, save_result,
+)
+
+
+async def run_benchmark(args) -> dict:
+    from sqlalchemy import insert, select
+    from app.access_logs import access_log_store
+    from app.database import async_session_maker, close_db, database_stats, engine, init_db
+    from app.ingest import access_log_writer
+    from app.models import Lock
+
+    quiet_app_logging(args.verbose)
+    await init_db()
+    await access_log_store.drop_partitions()
+    device_ids = [f"ingest_{i:05d}" for i in range(args.locks)]
+    async with async_session_maker() as session:
+        existing = set((await session.execute(select(Lock.device_id).where(Lock.device_id.in_(device_ids)))).scalars())
+        missing = [device_id for device_id in device_ids if device_id not in existing]
+        if missing:
+            await session.execute(insert(Lock), [{"device_id": device_id, "name": device_id} for device_id in missing])
+        await session.commit()
+        lock_ids = list((await session.execute(select(Lock.id).where(Lock.device_id.in_(device_ids)))).scalars())
+
+    added_at = {}
+    commit_latencies = []
+
+    def on_flush(rows):
+        now = time.perf_counter()
+        for row in rows:
+            started = added_at.pop(row["access_method"], None)
+            if started is not None:
+                commit_latencies.append(now - started)
+
+    access_log_writer.add_flush_listener(on_flush)
+    await access_log_writer.start()
+
+    async def producer(worker: int):
+        rng = random.Random(args.seed + worker)
+        for n in range(worker, args.rows, args.producers):
+            method = f"bench:{n}"
+            timestamp = datetime.utcnow()
+            if n % 20 == 0:
+                # Late events from last month's partition
+                timestamp -= timedelta(days=31)
+            added_at[method] = time.perf_counter()
+            await access_log_writer.add(
+                lock_id=rng.choice(lock_ids),
+                access_type=rng.choice(("pin", "rfid", "remote")),
+                access_method=method,
+                success=rng.random() < 0.9,
+                timestamp=timestamp,
+            )
+            if n % 100 < args.producers:
+                # Let the flusher run between bursts, as the event loop would
+                await asyncio.sleep(0)
+
+    meter = ResourceMeter().start()
+    await asyncio.gather(*(producer(i) for i in range(args.producers)))
+    deadline = time.perf_counter() + args.timeout
+    while access_log_writer.rows_written < args.rows and time.perf_counter() < deadline:
+        await asyncio.sleep(0.01)
+    resources = meter.stop()
+    await access_log_writer.stop()
+
+    async with async_session_maker() as session:
+        stored = (await access_log_store.summary(session))["total"]
+    writer = access_log_writer.stats()
+    database = database_stats()
+    backend = engine.dialect.name
+    await close_db()
+
+    return {
+        "backend": backend,
+        "rows": args.rows,
+        "rows_written": writer["rows_written"],
+        "rows_stored": stored,
+        "rows_per_s": round(writer["rows_written"] / resources["wall_s"], 1),
+        "commit_latency": latency_summary(commit_latencies),
+        "batches": writer["batches_flushed"],
+        "batches_copied": access_log_store.stats()["batches_copied"],
+        "flush_errors": writer["flush_errors"],
+        "avg_batch_size": writer["avg_batch_size"],
+        "max_batch_size": writer["max_batch_size"],
+        "avg_flush_ms": writer["avg_flush_ms"],
+        "max_flush_ms": writer["max_flush_ms"],
+        "database": database,
+        "resources": resources,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Access log ingest throughput")
+    parser.add_argument("--rows", type=int, default=200000)
+    parser.add_argument("--producers", type=int, default=8)
+    parser.add_argument("--locks", type=int, default=1000)
+    parser.add_argument("--batch-size", type=int, default=1000, help="ACCESS_LOG_BATCH_SIZE")
+    parser.add_argument("--max-pending", type=int, default=10000, help="ACCESS_LOG_MAX_PENDING")
+    parser.add_argument("--copy-rows", type=int, help="ACCESS_LOG_COPY_ROWS (PostgreSQL)")
+    parser.add_argument("--database-url", help="defaults to a fresh SQLite file in a temp dir")
+    parser.add_argument("--timeout", type=float, default=300.0)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    database_url = args.database_url or f"sqlite+aiosqlite:///{Path(tempfile.mkdtemp()) / 'ingest.db'}"
+    configure_environment(
+        database_url,
+        access_log_batch_size=args.batch_size,
+        access_log_max_pending=args.max_pending,
+        access_log_copy_rows=args.copy_rows,
+    )
+    metrics = asyncio.run(run_benchmark(args))
+
+    print(f"backend         {metrics['backend']}")
+    print(f"rows            {metrics['rows_written']}/{metrics['rows']} written, {metrics['rows_stored']} counted, "
+          f"{metrics['flush_errors']} flush errors")
+    print(f"throughput      {metrics['rows_per_s']} rows/s")
+    print(f"commit latency  {metrics['commit_latency']}")
+    print(f"batches         {metrics['batches']} ({metrics['batches_copied']} by COPY), "
+          f"avg {metrics['avg_batch_size']} rows / {metrics['avg_flush_ms']} ms, "
+          f"max {metrics['max_batch_size']} rows / {metrics['max_flush_ms']} ms")
+    print(f"resources       {metrics['resources']}")
+    config = {key: value for key, value in vars(args).items() if key not in ("output", "verbose")}
+    config["database_url"] = database_url.split("@")[-1]
+    path = save_result(f"ingest-{metrics['backend']}", config, metrics, args.output)
+    print(f"saved           {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+"""
+Benchmark MQTT handler dispatch: a new event loop per message (before) vs the
+server loop, fed from paho's network thread or by the asyncio transport.
+
+Messages are pushed through ``MQTTClient._on_message`` the way paho delivers
+them, so no broker is needed:
+
+- ``legacy``: the original dispatch, kept here as the baseline. Each message
+  runs its handler in a fresh event loop on a 5-thread pool.
+- ``thread``: from a separate thread (paho's network thread), handing each
+  message over to the server loop.
+- ``asyncio``: on the event loop itself, as the asyncio transport does.
+
+Payloads are valid access events (with an extra ``sent`` field), so they pass
+the fast-path validation. A run that does not see every message handled within
+``--timeout`` seconds fails instead of waiting forever.
+
+    python -m benchmarks.mqtt_dispatch --messages 20000
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+from app.config import settings
+from app.ingest_scheduler import ingest_scheduler
+from app.mqtt_client import AsyncioTransport, MQTTClient
+from benchmarks.common import percentile
+
+MODES = ("legacy", "thread", "asyncio")
+
+
+class LegacyDispatchClient(MQTTClient):
+    """The dispatch the server used before handlers moved onto its loop."""
+
+    def __init__(self):
+        super().__init__()
+        self.executor = ThreadPoolExecutor(max_workers=5)
+
+    def _dispatch(self, handler, message_type, device_id, data):
+        self.executor.submit(self._run_async_handler, handler, device_id, data)
+
+    @staticmethod
+    def _run_async_handler(handler, device_id, data):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            loop.run_until_complete(handler(device_id, data))
+        finally:
+            loop.close()
+
+
+async def run_mode(mode: str, messages: int, devices: int, timeout: float) -> dict:
+    """Feed ``messages`` access events through a client with the given transport.
+
+    Access events are used because the ingest scheduler never coalesces them.
+    """
+    loop = asyncio.get_running_loop()
+    client = LegacyDispatchClient() if mode == "legacy" else MQTTClient()
+    client.loop = loop
+    await ingest_scheduler.start()
+    if mode == "asyncio":
+        import paho.mqtt.client as mqtt
+        client.transport = AsyncioTransport(mqtt.Client(), loop)
+
+    latencies = []
+    done = asyncio.Event()
+
+    async def handler(device_id: str, data: dict):
+        # Roughly the shape of a real handler: parse, yield once, record
+        await asyncio.sleep(0)
+        latencies.append(time.perf_counter() - data["sent"])
+        if len(latencies) >= messages:
+            # Legacy handlers run in their own loops on pool threads
+            loop.call_soon_threadsafe(done.set)
+
+    client.register_handler("access", handler)
+    prefix = settings.mqtt_topic_prefix
+
+    def deliver(i):
+        payload = json.dumps({
+            "access_type": "pin",
+            "access_method": None,
+            "success": True,
+            "sent": time.perf_counter(),
+        }).encode()
+        msg = SimpleNamespace(topic=f"{prefix}/lock_{i % devices}/access", payload=payload)
+        client._on_message(None, None, msg)
+
+    def producer():
+        for i in range(messages):
+            deliver(i)
+
+    started = time.perf_counter()
+    if mode == "asyncio":
+        for i in range(messages):
+            deliver(i)
+            if i % 64 == 0:
+                # A socket read delivers a handful of packets, then yields
+                await asyncio.sleep(0)
+        handled = await _wait(done, timeout)
+        received = len(latencies)
+    else:
+        thread = threading.Thread(target=producer)
+        thread.start()
+        handled = await _wait(done, timeout)
+        received = len(latencies)
+        thread.join()
+    elapsed = time.perf_counter() - started
+    if mode == "legacy":
+        client.executor.shutdown(wait=True)
+    await ingest_scheduler.stop()
+    if not handled:
+        raise RuntimeError(
+            f"{mode}: only {received}/{messages} messages handled after {timeout}s "
+            f"(dropped or rejected by validation?)"
+        )
+
+    return {
+        "mode": mode,
+        "messages": messages,
+        "msgs_per_sec": messages / elapsed,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+    }
+
+
+async def _wait(event: asyncio.Event, timeout: float) -> bool:
+    try:
+        await asyncio.wait_for(event.wait(), timeout)
+        return True
+    except asyncio.TimeoutError:
+        return False
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--devices", type=int, default=300)
+    parser.add_argument("--timeout", type=float, default=60.0, help="seconds to wait for all messages per mode")
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=list(MODES))
+    args = parser.parse_args()
+
+    for mode in args.modes:
+        try:
+            result = await run_mode(mode, args.messages, args.devices, args.timeout)
+        except RuntimeError as e:
+            print(e, file=sys.stderr)
+            sys.exit(1)
+        print(
+            f"{result['mode']:>7}: {result['msgs_per_sec']:10.0f} msgs/s  "
+            f"p50 {result['p50_ms']:8.3f} ms  p99 {result['p99_ms']:8.3f} ms"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
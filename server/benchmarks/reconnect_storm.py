@@ -0,0 +1,262 @@
+"""
+Reconnect storm: every simulated node reconnects at the same moment, as after
+a broker restart or a site-wide Wi-Fi outage.
+
+Before the storm every lock is synced (nodes hold the current config
+sequence); then ``--changed`` of the locks get a new PIN while their nodes are
+offline, and the broker loses the retained messages of ``--lost-retained`` of
+the locks (a restart without persistence). On reconnect each node behaves like
+the firmware:
+
+- ``protected``: read the retained ``config/retained`` message; only nodes that
+  find none, or a newer sequence without the full snapshot, send a sync
+  request, which
+  goes through the token-bucket admission queue (``--repeats`` > 1 resends it,
+  like a node retrying; repeats still queued in the ingest scheduler are
+  coalesced there, later ones are deduplicated by the admission queue),
+- ``unprotected``: every node sends a sync request at once and each one is
+  served on arrival (the behaviour before admission control).
+
+Messages enter through ``MQTTClient._on_message`` and the ingest scheduler as
+in ``fleet_sim``; server publishes are captured in process. Reported: time
+until every node is current, per-node latency, sync requests sent and served,
+how many the admission queue deferred (waited for a token or a slot), turned
+away as duplicates or dropped, peak DB connections checked out, sync errors,
+CPU and RSS.
+
+    python -m benchmarks.reconnect_storm --mode protected --nodes 1000
+    python -m benchmarks.reconnect_storm --mode unprotected --nodes 1000
+"""
+import argparse
+import asyncio
+import json
+import logging
+import random
+import tempfile
+import time
+from pathlib import Path
+
+from benchmarks.common import (
+    ResourceMeter, configure_environment, latency_summary, quiet_app_logging, save_result,
+)
+
+
+class _ErrorCounter(logging.Handler):
+    def __init__(self):
+        super().__init__(logging.ERROR)
+        self.count = 0
+
+    def emit(self, record):
+        self.count += 1
+
+
+async def run_benchmark(args) -> dict:
+    from sqlalchemy import event, insert, select
+    from app.config_deltas import config_sequencer
+    from app.database import async_session_maker, engine, init_db
+    from app.fleet import fleet_state
+    from app.ingest_scheduler import ingest_scheduler
+    from app.models import AccessCode, DeviceConfigState, Lock
+    from app.mqtt_client import mqtt_client
+    from app.mqtt_handlers import setup_mqtt_handlers
+    from app.sync_admission import sync_admission
+    from app.sync_engine import build_payloads
+    from benchmarks.fleet_sim import InProcTransport
+
+    quiet_app_logging(args.verbose)
+    errors = _ErrorCounter()
+    logging.getLogger("app").addHandler(errors)
+    rng = random.Random(args.seed)
+    loop = asyncio.get_running_loop()
+
+    # Fleet: one PIN per lock plus a Master PIN
+    await init_db()
+    async with async_session_maker() as session:
+        await session.execute(insert(Lock), [
+            {"device_id": f"storm_{i:05d}", "name": f"Storm {i}", "is_online": True}
+            for i in range(args.nodes)
+        ])
+        lock_ids = (await session.execute(select(Lock.id).order_by(Lock.id))).scalars().all()
+        await session.execute(insert(AccessCode), [
+            {"lock_id": lock_id, "code": f"{100000 + lock_id}"} for lock_id in lock_ids
+        ] + [{"lock_id": None, "code": "999999"}])
+        await session.commit()
+    await fleet_state.load()
+
+    # Capture server -> node traffic; retained messages are kept like a broker would
+    retained = {}
+    node_seq = {}
+    target_seq = {}
+    current_at = {}
+    storm_start = 0.0
+
+    async def capture(device_id, message_type, payload, cached=None, retain=False):
+        if retain:
+            retained[device_id] = payload
+            return True
+        if not storm_start:
+            return True
+        seq = payload.get("seq")
+        done = (
+            (message_type == "delta" and seq == target_seq.get(device_id))
+            or (message_type == "config" and seq == target_seq.get(device_id)
+                and payload.get("chunk", 0) + 1 >= payload.get("chunks", 1))
+        )
+        if done and device_id not in current_at:
+            current_at[device_id] = time.perf_counter()
+        return True
+
+    mqtt_client.publish = capture
+
+    # Initial sync: every node holds the current sequence
+    async with async_session_maker() as session:
+        payloads = await build_payloads(session)
+    advances = await config_sequencer.advance(payloads, delta_capable=lock_ids)
+    for advance in advances.values():
+        await config_sequencer.publish_retained(advance)
+        node_seq[advance.device_id] = advance.seq
+
+    # Offline changes: a new PIN for some locks, synced while their nodes are away
+    changed_ids = rng.sample(list(lock_ids), int(len(lock_ids) * args.changed))
+    async with async_session_maker() as session:
+        if changed_ids:
+            await session.execute(insert(AccessCode), [
+                {"lock_id": lock_id, "code": f"{500000 + lock_id}"} for lock_id in changed_ids
+            ])
+            await session.commit()
+        payloads = await build_payloads(session, changed_ids)
+    for advance in (await config_sequencer.advance(payloads)).values():
+        await config_sequencer.publish_retained(advance)
+    async with async_session_maker() as session:
+        for lock_id, seq in (await session.execute(select(DeviceConfigState.lock_id, DeviceConfigState.seq))).all():
+            target_seq[fleet_state.get_by_id(lock_id).device_id] = seq
+    for lock_id in rng.sample(list(lock_ids), int(len(lock_ids) * args.lost_retained)):
+        retained.pop(fleet_state.get_by_id(lock_id).device_id, None)
+
+    # Server side of the storm
+    await ingest_scheduler.start()
+    if args.mode == "protected":
+        await sync_admission.start()
+    setup_mqtt_handlers(mqtt_client)
+    transport = InProcTransport(mqtt_client, loop)
+    await transport.start()
+
+    checked_out = 0
+    peak_checked_out = 0
+
+    def on_checkout(*_):
+        nonlocal checked_out, peak_checked_out
+        checked_out += 1
+        peak_checked_out = max(peak_checked_out, checked_out)
+
+    def on_checkin(*_):
+        nonlocal checked_out
+        checked_out -= 1
+
+    event.listen(engine.sync_engine, "checkout", on_checkout)
+    event.listen(engine.sync_engine, "checkin", on_checkin)
+
+    from app.config import settings
+    prefix = settings.mqtt_topic_prefix
+    requests_sent = 0
+    current_from_retained = 0
+    meter = ResourceMeter().start()
+    storm_start = time.perf_counter()
+    for device_id, seq in node_seq.items():
+        if args.mode == "protected":
+            message = retained.get(device_id)
+            if message is not None and (message.get("seq") == seq or "access_codes" in message):
+                current_at[device_id] = storm_start
+                current_from_retained += 1
+                continue
+        request = json.dumps({"request": "sync", "since": seq}).encode()
+        for _ in range(args.repeats):
+            transport.publish(f"{prefix}/{device_id}/sync", request)
+            requests_sent += 1
+
+    deadline = time.perf_counter() + args.timeout
+    while len(current_at) < len(node_seq) and time.perf_counter() < deadline:
+        await asyncio.sleep(0.01)
+    elapsed = time.perf_counter() - storm_start
+    resources = meter.stop()
+
+    await transport.stop()
+    await sync_admission.stop()
+    await ingest_scheduler.stop()
+
+    admission = sync_admission.stats()
+    scheduler = ingest_scheduler.stats()
+    return {
+        "nodes": len(node_seq),
+        "changed": len(changed_ids),
+        "lost_retained": int(len(lock_ids) * args.lost_retained),
+        "all_current_s": round(elapsed, 3),
+        "not_current": len(node_seq) - len(current_at),
+        "current_from_retained": current_from_retained,
+        "time_to_current": latency_summary([at - storm_start for at in current_at.values()]),
+        "sync_requests_sent": requests_sent,
+        "sync_requests_served": config_sequencer.stats()["catch_ups"],
+        "admission": {
+            "scheduler_coalesced": scheduler["coalesced"],
+            "submitted": admission["submitted"],
+            "admitted": admission["admitted"],
+            "deferred": admission["deferred"],
+            "deduplicated": admission["deduplicated"],
+            "dropped": admission["dropped"],
+            "max_pending": admission["max_pending"],
+            "max_wait_ms": admission["max_wait_ms"],
+        },
+        "peak_db_connections": peak_checked_out,
+        "sync_errors": errors.count,
+        "resources": resources,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reconnect storm of simulated PineLock nodes")
+    parser.add_argument("--mode", choices=("protected", "unprotected"), default="protected")
+    parser.add_argument("--nodes", type=int, default=1000)
+    parser.add_argument("--changed", type=float, default=0.05, help="fraction of locks changed during the outage")
+    parser.add_argument("--lost-retained", type=float, default=0.3,
+                        help="fraction of locks whose retained config the broker lost")
+    parser.add_argument("--repeats", type=int, default=2, help="sync requests per node that asks")
+    parser.add_argument("--rate", type=float, help="admission tokens/second (default: SYNC_ADMISSION_RATE)")
+    parser.add_argument("--burst", type=int, help="admission burst (default: SYNC_ADMISSION_BURST)")
+    parser.add_argument("--chunk-items", type=int, help="snapshot chunk size (default: CONFIG_SNAPSHOT_CHUNK_ITEMS)")
+    parser.add_argument("--database-url", help="defaults to a fresh SQLite file in a temp dir")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    database_url = args.database_url or f"sqlite+aiosqlite:///{Path(tempfile.mkdtemp()) / 'storm.db'}"
+    configure_environment(
+        database_url,
+        sync_admission_rate=args.rate,
+        sync_admission_burst=args.burst,
+        config_snapshot_chunk_items=args.chunk_items,
+        config_retained=args.mode == "protected",
+        sync_debounce=0,
+    )
+    metrics = asyncio.run(run_benchmark(args))
+
+    print(f"nodes           {metrics['nodes']} ({metrics['changed']} changed while offline, "
+          f"{metrics['lost_retained']} retained configs lost), mode {args.mode}")
+    print(f"all current     {metrics['all_current_s']} s, {metrics['not_current']} not current")
+    print(f"from retained   {metrics['current_from_retained']}")
+    print(f"time to current {metrics['time_to_current']}")
+    print(f"sync requests   {metrics['sync_requests_sent']} sent, {metrics['sync_requests_served']} served")
+    admission = metrics["admission"]
+    print(f"admission       {admission['submitted']} submitted, {admission['admitted']} admitted, "
+          f"{admission['deferred']} deferred, {admission['deduplicated']} rejected as duplicates, "
+          f"{admission['dropped']} dropped, {admission['scheduler_coalesced']} coalesced in the scheduler")
+    print(f"queue           max {admission['max_pending']} pending, max wait {admission['max_wait_ms']} ms")
+    print(f"db connections  peak {metrics['peak_db_connections']}, sync errors {metrics['sync_errors']}")
+    print(f"resources       {metrics['resources']}")
+    path = save_result(f"reconnect_storm-{args.mode}", vars(args), metrics, args.output)
+    print(f"saved           {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""
+Consumer-group check for MQTT shared subscriptions.
+
+Starts several server MQTT clients in one consumer group against a real
+broker (mosquitto 2.x or any MQTT v5 broker), publishes device traffic and
+checks that:
+
+- work topics (access, alert, sync) are handled exactly once across the group,
+- state topics (status, heartbeat) reach every member,
+- how many members each device's work messages landed on (1 = full affinity;
+  mosquitto distributes shared messages round-robin, brokers with a sticky or
+  client-hash strategy keep it at 1).
+
+    mosquitto -p 1883 &
+    python -m benchmarks.shared_subscriptions --members 3 --devices 50
+"""
+import argparse
+import json
+import sys
+import threading
+import time
+from collections import defaultdict
+
+from benchmarks.common import configure_environment
+
+# Valid for every message type, so fast-path validation accepts it
+PAYLOAD = {"is_locked": True, "access_type": "pin", "access_method": None, "success": True}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--broker-host", default="localhost")
+    parser.add_argument("--broker-port", type=int, default=1883)
+    parser.add_argument("--group", default="pinelock_check")
+    parser.add_argument("--members", type=int, default=3)
+    parser.add_argument("--devices", type=int, default=50)
+    parser.add_argument("--rounds", type=int, default=20, help="messages per device and topic")
+    parser.add_argument("--timeout", type=float, default=15.0)
+    args = parser.parse_args()
+
+    configure_environment(
+        mqtt_broker_host=args.broker_host,
+        mqtt_broker_port=args.broker_port,
+        mqtt_shared_group=args.group,
+        mqtt_transport="thread",
+    )
+    import paho.mqtt.client as mqtt
+    from app.config import settings
+    from app.mqtt_client import MQTTClient, STATE_TOPICS, WORK_TOPICS
+
+    lock = threading.Lock()
+    received = defaultdict(lambda: defaultdict(list))  # member -> message type -> [(device, seq)]
+
+    def counter(member: int, message_type: str):
+        def handler(device_id, data):
+            with lock:
+                received[member][message_type].append((device_id, data["seq"]))
+        return handler
+
+    members = []
+    for index in range(args.members):
+        client = MQTTClient(client_id=f"pinelock_check_{index}")
+        for message_type in STATE_TOPICS + WORK_TOPICS:
+            client.register_handler(message_type, counter(index, message_type))
+        client.connect()
+        members.append(client)
+
+    deadline = time.time() + 5
+    while not all(client.is_connected for client in members) and time.time() < deadline:
+        time.sleep(0.05)
+    if not all(client.is_connected for client in members):
+        print("Not every member connected; is the broker running with MQTT v5 support?")
+        sys.exit(2)
+    time.sleep(0.5)
+
+    publisher = mqtt.Client(client_id="pinelock_check_publisher")
+    publisher.connect(args.broker_host, args.broker_port)
+    publisher.loop_start()
+    sent = defaultdict(int)
+    for seq in range(args.rounds):
+        for device in range(args.devices):
+            for message_type in STATE_TOPICS + WORK_TOPICS:
+                topic = f"{settings.mqtt_topic_prefix}/check_{device:04d}/{message_type}"
+                publisher.publish(topic, json.dumps({**PAYLOAD, "seq": seq}), qos=1).wait_for_publish()
+                sent[message_type] += 1
+
+    expected_state = {message_type: sent[message_type] * args.members for message_type in STATE_TOPICS}
+    expected_work = {message_type: sent[message_type] for message_type in WORK_TOPICS}
+
+    def totals():
+        with lock:
+            return {
+                message_type: sum(len(received[member][message_type]) for member in received)
+                for message_type in STATE_TOPICS + WORK_TOPICS
+            }
+
+    deadline = time.time() + args.timeout
+    while time.time() < deadline:
+        counts = totals()
+        if all(counts[t] >= n for t, n in {**expected_state, **expected_work}.items()):
+            break
+        time.sleep(0.1)
+    time.sleep(0.5)  # let any duplicates arrive
+
+    publisher.loop_stop()
+    publisher.disconnect()
+    for client in members:
+        client.disconnect()
+
+    counts = totals()
+    failures = 0
+    for message_type, expected in {**expected_state, **expected_work}.items():
+        ok = counts[message_type] == expected
+        failures += not ok
+        print(f"{message_type:<10} expected {expected:>6}  received {counts[message_type]:>6}  {'ok' if ok else 'FAIL'}")
+
+    spread = []
+    devices_per_member = defaultdict(set)
+    for message_type in WORK_TOPICS:
+        owners = defaultdict(set)
+        for member, by_type in received.items():
+            for device_id, _ in by_type[message_type]:
+                owners[device_id].add(member)
+                devices_per_member[member].add(device_id)
+        spread.extend(len(members_seen) for members_seen in owners.values())
+    for member in range(args.members):
+        work = sum(len(received[member][t]) for t in WORK_TOPICS)
+        print(f"member {member}   work messages {work:>6}  devices {len(devices_per_member[member])}")
+    if spread:
+        print(f"affinity   members per device: avg {sum(spread) / len(spread):.2f}, max {max(spread)}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
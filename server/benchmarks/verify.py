@@ -0,0 +1,207 @@
+"""
+Online credential verification latency.
+
+A fleet of ``--locks`` locks with ``--pins`` PINs and ``--cards`` RFID cards
+each (a third of them time-limited, some already expired) plus a Master PIN
+is loaded; then ``--requests`` verify requests (the lock's own credentials,
+expired ones, another lock's, the Master PIN and unknown PINs) go through
+``MQTTClient._on_message`` like messages from the broker. The reply publish is
+captured at the paho client, so the measured server-side latency covers
+decoding, validation, the lookup and encoding the verdict. Every verdict is
+checked against the expected answer.
+
+``--mode index`` answers from the in-memory credential index (the default),
+``--mode db`` from indexed database queries as with ``MQTT_SHARED_GROUP``.
+
+    python -m benchmarks.verify --locks 1000 --pins 100 --cards 20
+    python -m benchmarks.verify --mode db --requests 5000
+"""
+import argparse
+import asyncio
+import json
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from types import SimpleNamespace
+
+from benchmarks.common import (
+    ResourceMeter, configure_environment, latency_summary, quiet_app_logging, save_result,
+)
+
+
+class CapturingClient:
+    """Stands in for the paho client: records each publish and when it happened."""
+
+    def __init__(self, on_publish):
+        self.on_publish = on_publish
+        self.mid = 0
+
+    def publish(self, topic, payload, qos=0, retain=False):
+        self.mid += 1
+        self.on_publish(topic, payload)
+        return SimpleNamespace(rc=0, mid=self.mid)
+
+
+async def run_benchmark(args) -> dict:
+    from sqlalchemy import insert, select
+    from app.config import settings
+    from app.credentials import credential_index
+    from app.database import async_session_maker, init_db
+    from app.fleet import fleet_state
+    from app.ingest_scheduler import ingest_scheduler
+    from app.models import AccessCode, Lock, RFIDCard
+    from app.mqtt_client import mqtt_client
+    from app.mqtt_handlers import setup_mqtt_handlers
+    from benchmarks.fleet_sim import InProcTransport
+
+    quiet_app_logging(args.verbose)
+    rng = random.Random(args.seed)
+    now = datetime.utcnow()
+    credential_index.enabled = args.mode == "index"
+
+    # Fleet: per lock PINs and cards, a third with a window (every 4th of those expired)
+    await init_db()
+    pins, cards = [], []
+    async with async_session_maker() as session:
+        await session.execute(insert(Lock), [
+            {"device_id": f"verify_{i:05d}", "name": f"Verify {i}"} for i in range(args.locks)
+        ])
+        locks = (await session.execute(select(Lock.id, Lock.device_id).order_by(Lock.id))).all()
+        for lock_id, _ in locks:
+            for n in range(args.pins + args.cards):
+                window = {}
+                if n % 3 == 0:
+                    expired = n % 4 == 0
+                    window = {
+                        "valid_from": now - timedelta(days=2),
+                        "valid_until": now + timedelta(days=-1 if expired else 1),
+                    }
+                if n < args.pins:
+                    pins.append({"lock_id": lock_id, "code": f"{lock_id:05d}{n:04d}", **window})
+                else:
+                    cards.append({
+                        "lock_id": lock_id, "card_uid": f"{lock_id:06x}{n:04x}", "card_type": "access_card", **window,
+                    })
+        pins.append({"lock_id": None, "code": "99999999"})
+        for start in range(0, len(pins), 5000):
+            await session.execute(insert(AccessCode), pins[start:start + 5000])
+        for start in range(0, len(cards), 5000):
+            await session.execute(insert(RFIDCard), cards[start:start + 5000])
+        await session.commit()
+    await fleet_state.load()
+    load_started = time.perf_counter()
+    await credential_index.load()
+    load_s = time.perf_counter() - load_started
+
+    def expected(row, lock_id):
+        if row["lock_id"] is not None and row["lock_id"] != lock_id:
+            return False
+        return row.get("valid_until") is None or row["valid_until"] > now
+
+    def payload_of(row):
+        return {"pin": row["code"]} if "code" in row else {"card": row["card_uid"]}
+
+    # Requests: (device_id, payload, expected verdict); 60% the lock's own
+    # credentials, 15% another lock's, 5% the Master PIN, 20% unknown PINs
+    by_lock = {}
+    for row in pins[:-1] + cards:
+        by_lock.setdefault(row["lock_id"], []).append(row)
+    requests = []
+    for request_id in range(args.requests):
+        lock_id, device_id = rng.choice(locks)
+        kind = rng.random()
+        if kind < 0.6:
+            row = rng.choice(by_lock[lock_id])
+        elif kind < 0.75:
+            row = rng.choice(by_lock[rng.choice(locks)[0]])
+        elif kind < 0.8:
+            row = pins[-1]
+        else:
+            row = {"lock_id": -1, "code": f"{rng.randrange(10 ** 9):09d}"}
+        requests.append((device_id, {"id": request_id, **payload_of(row)}, expected(row, lock_id)))
+
+    replies = {}
+
+    def on_publish(topic, payload):
+        reply = json.loads(payload)
+        replies[reply["id"]] = (time.perf_counter(), reply["valid"])
+
+    loop = asyncio.get_running_loop()
+    mqtt_client.client = CapturingClient(on_publish)
+    mqtt_client.is_connected = True
+    await ingest_scheduler.start()
+    setup_mqtt_handlers(mqtt_client)
+    transport = InProcTransport(mqtt_client, loop)
+    await transport.start()
+
+    prefix = settings.mqtt_topic_prefix
+    encoded = [(f"{prefix}/{device_id}/verify", json.dumps(payload).encode()) for device_id, payload, _ in requests]
+    sent_at = {}
+    meter = ResourceMeter().start()
+    for index, (topic, payload) in enumerate(encoded):
+        sent_at[index] = time.perf_counter()
+        transport.publish(topic, payload)
+        if args.mode == "db" and index % args.window == args.window - 1:
+            # Bounded number of outstanding database lookups
+            while len(replies) < index + 1 - args.window // 2:
+                await asyncio.sleep(0)
+    deadline = time.perf_counter() + args.timeout
+    while len(replies) < len(requests) and time.perf_counter() < deadline:
+        await asyncio.sleep(0.001)
+    resources = meter.stop()
+
+    await transport.stop()
+    await ingest_scheduler.stop()
+
+    latencies = [replies[index][0] - sent_at[index] for index in replies]
+    wrong = sum(1 for index, (_, _, valid) in enumerate(requests) if index in replies and replies[index][1] != valid)
+    stats = credential_index.stats()
+    return {
+        "mode": args.mode,
+        "credentials": len(pins) + len(cards),
+        "index_load_s": round(load_s, 3),
+        "requests": len(requests),
+        "answered": len(replies),
+        "wrong_verdicts": wrong,
+        "granted": stats["granted"],
+        "latency": latency_summary(latencies),
+        "handler_latency": {key: stats["latency"][key] for key in ("p50_ms", "p99_ms", "max_ms")},
+        "requests_per_s": round(len(replies) / resources["wall_s"], 1),
+        "resources": resources,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Online credential verification latency")
+    parser.add_argument("--mode", choices=("index", "db"), default="index")
+    parser.add_argument("--locks", type=int, default=1000)
+    parser.add_argument("--pins", type=int, default=100, help="PINs per lock")
+    parser.add_argument("--cards", type=int, default=20, help="RFID cards per lock")
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--window", type=int, default=64, help="outstanding requests in db mode")
+    parser.add_argument("--database-url", help="defaults to a fresh SQLite file in a temp dir")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    database_url = args.database_url or f"sqlite+aiosqlite:///{Path(tempfile.mkdtemp()) / 'verify.db'}"
+    configure_environment(database_url)
+    metrics = asyncio.run(run_benchmark(args))
+
+    print(f"credentials     {metrics['credentials']} (index loaded in {metrics['index_load_s']} s), mode {args.mode}")
+    print(f"requests        {metrics['answered']}/{metrics['requests']} answered, "
+          f"{metrics['granted']} granted, {metrics['wrong_verdicts']} wrong")
+    print(f"latency         {metrics['latency']}")
+    print(f"handler         {metrics['handler_latency']}")
+    print(f"throughput      {metrics['requests_per_s']} requests/s")
+    print(f"resources       {metrics['resources']}")
+    path = save_result(f"verify-{args.mode}", vars(args), metrics, args.output)
+    print(f"saved           {path}")
+
+
+if __name__ == "__main__":
+    main()
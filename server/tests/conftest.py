@@ -0,0 +1,6 @@
+"""Point the app at a throwaway SQLite database before any ``app`` import."""
+import os
+import tempfile
+from pathlib import Path
+
+os.environ.setdefault("DATABASE_URL", f"sqlite+aiosqlite:///{Path(tempfile.mkdtemp()) / 'test.db'}")
@@ -0,0 +1,145 @@
+"""
+Access log listings and counts over the monthly partitions.
+
+Logs are stored with naive UTC timestamps; bounds sent with an offset
+(``...Z`` or ``+01:00``) must select the same rows as their UTC equivalent.
+"""
+import asyncio
+from datetime import datetime, timedelta
+
+from httpx import ASGITransport, AsyncClient
+
+from app.access_logs import access_log_store
+from app.database import async_session_maker, close_db, init_db
+from app.main import app
+
+
+async def _seed(lock_id: int, first: datetime, count: int, step: timedelta = timedelta(minutes=10)):
+    rows = [
+        {
+            "lock_id": lock_id, "access_type": "pin", "access_method": "keypad",
+            "success": index % 2 == 0, "timestamp": first + index * step,
+        }
+        for index in range(count)
+    ]
+    async with async_session_maker() as session:
+        await access_log_store.insert(session, rows)
+        await session.commit()
+
+
+def _run(scenario):
+    async def wrapped():
+        await init_db()
+        try:
+            async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+                await scenario(client)
+        finally:
+            await close_db()
+
+    asyncio.run(wrapped())
+
+
+def test_listings_accept_offset_aware_bounds():
+    lock_id = 9100
+
+    async def scenario(client):
+        # 10:00, 10:10, ..., 11:50 UTC
+        await _seed(lock_id, datetime(2031, 3, 1, 10), 12)
+        params = {"start": "2031-03-01T11:00:00+01:00", "end": "2031-03-01T11:00:00Z"}
+        for path in ("/api/v1/access-logs", f"/api/v1/locks/{lock_id}/access-logs"):
+            response = await client.get(path, params={**params, "lock_id": lock_id})
+            assert response.status_code == 200
+            stamps = [row["timestamp"] for row in response.json()]
+            assert stamps[0] == "2031-03-01T10:50:00" and stamps[-1] == "2031-03-01T10:00:00"
+            assert len(stamps) == 6
+
+    _run(scenario)
+
+
+def test_counts_accept_offset_aware_bounds():
+    lock_id = 9101
+
+    async def scenario(client):
+        # 10:00 to 12:50 UTC, three whole hours of six logs
+        await _seed(lock_id, datetime(2031, 3, 2, 10), 18)
+        # 10:30 to 12:30 UTC: partial hours at both edges
+        params = {"lock_id": lock_id, "start": "2031-03-02T12:30:00+02:00", "end": "2031-03-02T12:30:00Z"}
+        response = await client.get("/api/v1/access-logs/stats", params=params)
+        assert response.status_code == 200
+        assert response.json()["total"] == 12
+
+        response = await client.get("/api/v1/access-logs/stats/hourly", params={
+            "lock_id": lock_id, "start": "2031-03-02T12:00:00+01:00", "end": "2031-03-02T13:00:00+01:00",
+        })
+        assert response.status_code == 200
+        assert response.json() == [{"hour": "2031-03-02T11:00:00", "successful": 3, "failed": 3}]
+
+    _run(scenario)
+
+
+def test_counts_match_the_logs_for_any_range():
+    lock_id = 9102
+    first = datetime(2031, 4, 30, 21, 7)
+    step = timedelta(minutes=13)
+    # Crosses hour and month (partition) boundaries
+    stamps = [first + index * step for index in range(40)]
+
+    async def scenario(client):
+        await _seed(lock_id, first, len(stamps), step)
+        bounds = [
+            (None, None),
+            (datetime(2031, 4, 30, 22), datetime(2031, 5, 1, 2)),
+            (datetime(2031, 4, 30, 21, 30), datetime(2031, 5, 1, 0, 5)),
+            (datetime(2031, 5, 1, 1, 1), None),
+            (None, datetime(2031, 4, 30, 23, 59)),
+        ]
+        async with async_session_maker() as session:
+            for start, end in bounds:
+                for success in (None, True, False):
+                    expected = [
+                        index for index, stamp in enumerate(stamps)
+                        if (start is None or stamp >= start) and (end is None or stamp < end)
+                        and (success is None or (index % 2 == 0) == success)
+                    ]
+                    summary = await access_log_store.summary(
+                        session, lock_id=lock_id, success=success, start=start, end=end
+                    )
+                    assert summary["total"] == len(expected), (start, end, success)
+
+            hours = await access_log_store.hourly(session, first, stamps[-1] + step, lock_id=lock_id)
+        assert sum(point["successful"] + point["failed"] for point in hours) == len(stamps)
+        assert sum(point["successful"] for point in hours) == 20
+
+    _run(scenario)
+
+
+def test_cursor_pages_walk_the_whole_history_once():
+    lock_id = 9103
+    first = datetime(2031, 5, 31, 22)
+
+    async def scenario(client):
+        await _seed(lock_id, first, 25, timedelta(minutes=7))
+        # Same timestamp as an existing log: the id breaks the tie
+        await _seed(lock_id, first + timedelta(minutes=70), 3, timedelta(0))
+
+        seen = []
+        cursor = None
+        pages = 0
+        while True:
+            params = {"limit": 4, **({"cursor": cursor} if cursor else {})}
+            response = await client.get(f"/api/v1/locks/{lock_id}/access-logs", params=params)
+            assert response.status_code == 200
+            seen.extend((row["timestamp"], row["id"]) for row in response.json())
+            pages += 1
+            cursor = response.headers.get("X-Next-Cursor")
+            if cursor is None:
+                break
+
+        assert pages == 7
+        assert len(seen) == len(set(seen)) == 28
+        assert seen == sorted(seen, reverse=True)
+
+        response = await client.get("/api/v1/access-logs", params={"cursor": "not-a-cursor"})
+        assert response.status_code == 400
+
+    _run(scenario)
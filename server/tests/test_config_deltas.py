@@ -0,0 +1,126 @@
+"""
+Sequenced delta config: sequences only move when a lock's config changes.
+
+Reconnecting nodes ask for a sync ``since`` the sequence they hold; when
+nothing changed that must be answered without a write transaction, which on
+SQLite would serialize every request of a reconnect storm.
+"""
+import asyncio
+
+from app import config_deltas, services
+from app.config_cache import config_cache
+from app.config_deltas import ConfigSequencer, config_sequencer, diff_ops
+from app.database import async_session_maker, close_db, init_db
+from app.models import AccessCode, Lock
+from app.mqtt_client import mqtt_client
+
+
+def test_diff_ops_removes_before_adding():
+    old = {"access_codes": ["1111", "2222"], "rfid_cards": ["04:01"], "key_tag": "04:aa"}
+    new = {"access_codes": ["2222", "3333"], "rfid_cards": ["04:02"], "key_tag": None}
+    assert diff_ops(old, new) == [
+        ["remove_pin", "1111"], ["remove_card", "04:01"],
+        ["add_pin", "3333"], ["add_card", "04:02"], ["key_tag", None],
+    ]
+    # Order and duplicates are not changes
+    assert diff_ops(old, {**old, "access_codes": ["2222", "1111", "1111"]}) == []
+    assert diff_ops({}, {"access_codes": ["1111"], "rfid_cards": None, "key_tag": None}) == [["add_pin", "1111"]]
+
+
+def test_snapshot_chunks_carry_every_item_once():
+    sequencer = ConfigSequencer(max_ops=4, chunk_items=3, history=10, retain=True)
+    config = {"access_codes": ["1", "2", "3", "4", "2"], "rfid_cards": ["a", "b"], "key_tag": "k"}
+    messages = sequencer.snapshot_messages(config, 7)
+
+    assert [(m["chunk"], m["chunks"], m["seq"]) for m in messages] == [(0, 2, 7), (1, 2, 7)]
+    assert [code for m in messages for code in m["access_codes"]] == ["1", "2", "3", "4"]
+    assert [uid for m in messages for uid in m["rfid_cards"]] == ["a", "b"]
+    assert messages[0]["key_tag"] == "k" and "key_tag" not in messages[1]
+    # Too big for one message: only the sequence is retained
+    assert sequencer.retained_message(config, 7) == {"seq": 7, "chunks": 2}
+
+    empty = sequencer.snapshot_messages({"access_codes": [], "rfid_cards": [], "key_tag": None}, 1)
+    assert empty == [{"seq": 1, "chunk": 0, "chunks": 1, "access_codes": [], "rfid_cards": [], "key_tag": None}]
+    assert sequencer.retained_message({"access_codes": [], "rfid_cards": [], "key_tag": None}, 1) == empty[0]
+
+
+def test_large_changes_are_split_into_sequenced_deltas():
+    async def scenario():
+        await init_db()
+        try:
+            async with async_session_maker() as session:
+                lock = Lock(device_id="deltas_split", name="Deltas split")
+                session.add(lock)
+                await session.commit()
+                lock_id = lock.id
+            sequencer = ConfigSequencer(max_ops=2, chunk_items=10, history=2)
+            empty = {"access_codes": [], "rfid_cards": [], "key_tag": None}
+
+            first = (await sequencer.advance([(lock_id, "deltas_split", empty)]))[lock_id]
+            assert first.changed and first.seq == 1 and first.deltas == []
+            five = {**empty, "access_codes": ["1", "2", "3", "4", "5"]}
+            second = (await sequencer.advance([(lock_id, "deltas_split", five)]))[lock_id]
+            assert [seq for seq, _ in second.deltas] == [2, 3, 4]
+            assert [len(ops) for _, ops in second.deltas] == [2, 2, 1]
+
+            # Only the last ``history`` deltas are kept; older nodes get a snapshot
+            assert await sequencer.deltas_since(lock_id, 2, 4) == second.deltas[1:]
+            assert await sequencer.deltas_since(lock_id, 1, 4) is None
+            assert sequencer.delta_messages(second.deltas[2:]) == [{"seq": 4, "base": 3, "ops": [["add_pin", "5"]]}]
+        finally:
+            await close_db()
+
+    asyncio.run(scenario())
+
+
+def test_up_to_date_sync_requests_do_not_write(monkeypatch):
+    published = []
+
+    async def publish(device_id, message_type, payload, cached=None, retain=False, confirm=False):
+        published.append((message_type, payload))
+        return True
+
+    monkeypatch.setattr(mqtt_client, "publish", publish)
+    writes = []
+    writer = config_deltas.async_session_maker
+
+    def counting_writer():
+        writes.append(1)
+        return writer()
+
+    monkeypatch.setattr(config_deltas, "async_session_maker", counting_writer)
+
+    async def scenario():
+        await init_db()
+        try:
+            async with async_session_maker() as session:
+                lock = Lock(device_id="deltas_storm", name="Deltas storm")
+                session.add(lock)
+                await session.flush()
+                session.add(AccessCode(code="550123", lock_id=lock.id))
+                await session.commit()
+                lock_id = lock.id
+
+            await services.sync_device("deltas_storm", since=0)
+            assert len(writes) == 1
+            seq = published[-1][1]["seq"]
+
+            # Cached version already recorded: no query at all
+            await services.sync_device("deltas_storm", since=seq)
+            assert published[-1] == ("config", {"up_to_date": True, "seq": seq})
+            # Cache gone, config unchanged: only the read session
+            config_cache.invalidate([lock_id])
+            await services.sync_device("deltas_storm", since=seq)
+            assert published[-1] == ("config", {"up_to_date": True, "seq": seq})
+            assert len(writes) == 1
+
+            async with async_session_maker() as session:
+                session.add(AccessCode(code="550124", lock_id=lock_id))
+                await session.commit()
+            await services.sync_device("deltas_storm", since=seq)
+            assert len(writes) == 2
+            assert published[-1] == ("delta", {"seq": seq + 1, "base": seq, "ops": [["add_pin", "550124"]]})
+        finally:
+            await close_db()
+
+    asyncio.run(scenario())
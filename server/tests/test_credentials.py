@@ -0,0 +1,49 @@
+"""
+Online verification never grants a key tag.
+
+A lock's key tag only reports whether its key is in the lock; presented at the
+reader it must be denied like an unknown card, by the index and by the
+database path alike.
+"""
+import asyncio
+
+from app.credentials import CARD, PIN, CredentialIndex, credential_index
+from app.database import async_session_maker, close_db, init_db
+from app.models import AccessCode, Lock, RFIDCard
+
+
+def test_key_tags_do_not_open_the_lock():
+    async def scenario():
+        await init_db()
+        try:
+            async with async_session_maker() as session:
+                lock = Lock(device_id="credentials_key_tag", name="Key tag")
+                session.add(lock)
+                await session.flush()
+                session.add_all([
+                    RFIDCard(card_uid="04:aa:00:01", lock_id=lock.id, card_type="key_tag"),
+                    RFIDCard(card_uid="04:aa:00:02", lock_id=lock.id, card_type="access"),
+                    AccessCode(code="731904", lock_id=lock.id),
+                ])
+                await session.commit()
+                lock_id = lock.id
+
+            loaded = CredentialIndex()
+            await loaded.load()
+            # Loaded at startup, kept current from commits, and from the database
+            for verify in (loaded.verify, credential_index.verify):
+                assert not verify(lock_id, CARD, "04:aa:00:01")
+                assert verify(lock_id, CARD, "04:aa:00:02")
+                assert verify(lock_id, PIN, "731904")
+            assert not await loaded.verify_from_db(lock_id, CARD, "04:aa:00:01")
+            assert await loaded.verify_from_db(lock_id, CARD, "04:aa:00:02")
+
+            async with async_session_maker() as session:
+                card = await session.get(RFIDCard, credential_index._grants[CARD]["04:aa:00:02"][0].row_id)
+                card.card_type = "key_tag"
+                await session.commit()
+            assert not credential_index.verify(lock_id, CARD, "04:aa:00:02")
+        finally:
+            await close_db()
+
+    asyncio.run(scenario())
@@ -0,0 +1,113 @@
+"""
+QoS 1 delivery tracking: acks racing ``track``, stale acks and latency.
+
+With the thread transport paho's network thread can deliver the PUBACK of a
+publish before ``track`` registered its mid; an ack of an older, untracked
+publish that happens to share the mid must not resolve a new one.
+"""
+import asyncio
+import time
+
+from app.delivery import DeliveryTracker
+
+
+def _tracker(timeout: float = 0.2) -> DeliveryTracker:
+    return DeliveryTracker(max_in_flight=8, timeout=timeout)
+
+
+def test_ack_before_track_resolves_the_publish():
+    async def scenario():
+        tracker = _tracker()
+        await tracker.acquire()
+        future = asyncio.get_running_loop().create_future()
+        started = tracker.begin()
+        time.sleep(0.005)
+        # PUBACK on paho's thread before publish() returned the mid
+        tracker.on_publish(7)
+        tracker.track(7, "command", future, started)
+
+        assert await asyncio.wait_for(future, 1) is True
+        stats = tracker.stats()
+        assert stats["early_acks"] == 1
+        assert stats["in_flight"] == 0
+        # Measured from before the publish, not from the ack
+        assert stats["ack_latency"]["command"]["max_ms"] >= 5
+
+    asyncio.run(scenario())
+
+
+def test_ack_of_an_older_untracked_publish_is_ignored():
+    async def scenario():
+        tracker = _tracker()
+        # An untracked publish (publish_nowait) got mid 7 and was acked
+        tracker.on_publish(7)
+
+        await tracker.acquire()
+        future = asyncio.get_running_loop().create_future()
+        started = tracker.begin()
+        tracker.track(7, "command", future, started)
+
+        assert await asyncio.wait_for(future, 1) is False
+        assert tracker.stats()["timeouts"] == 1
+        assert tracker.stats()["early_acks"] == 0
+
+    asyncio.run(scenario())
+
+
+def test_stale_ack_from_an_earlier_window_is_dropped():
+    async def scenario():
+        tracker = _tracker()
+        loop = asyncio.get_running_loop()
+
+        await tracker.acquire()
+        first = loop.create_future()
+        started = tracker.begin()
+        # Arrives while the first publish is in flight, but is not its ack
+        tracker.on_publish(9)
+        tracker.track(3, "config", first, started)
+        tracker.on_publish(3)
+
+        # paho wrapped around and handed out mid 9 again
+        await tracker.acquire()
+        second = loop.create_future()
+        started = tracker.begin()
+        tracker.track(9, "config", second, started)
+
+        assert await asyncio.wait_for(first, 1) is True
+        assert await asyncio.wait_for(second, 1) is False
+
+    asyncio.run(scenario())
+
+
+def test_ack_after_track_resolves_and_frees_the_slot():
+    async def scenario():
+        tracker = DeliveryTracker(max_in_flight=1, timeout=1)
+        await tracker.acquire()
+        future = asyncio.get_running_loop().create_future()
+        tracker.track(1, "config", future, tracker.begin())
+        tracker.on_publish(1)
+
+        assert await asyncio.wait_for(future, 1) is True
+        # The window slot is free again
+        await asyncio.wait_for(tracker.acquire(), 1)
+        assert tracker.stats()["window_waits"] == 0
+
+    asyncio.run(scenario())
+
+
+def test_failed_publish_resolves_false():
+    async def scenario():
+        tracker = _tracker()
+        await tracker.acquire()
+        future = asyncio.get_running_loop().create_future()
+        tracker.begin()
+        tracker.abort()
+        tracker.fail(future)
+
+        assert future.result() is False
+        assert tracker.stats()["failed"] == 1
+        # No window left open: unknown acks are not remembered
+        tracker.on_publish(4)
+        assert not tracker._early_acks
+
+    asyncio.run(scenario())
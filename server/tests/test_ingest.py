@@ -0,0 +1,73 @@
+"""
+Access log writer shutdown: a batch being inserted when ``stop`` is called
+must still be written, and so must everything queued behind it.
+"""
+import asyncio
+
+from app import ingest
+from app.access_logs import access_log_store
+from app.database import async_session_maker, close_db, init_db
+from app.ingest import AccessLogWriter
+
+
+def test_stop_keeps_the_batch_being_inserted(monkeypatch):
+    lock_id = 9001
+    insert = access_log_store.insert
+    inserting = asyncio.Event()
+
+    async def slow_insert(session, rows):
+        inserting.set()
+        await asyncio.sleep(0.2)
+        await insert(session, rows)
+
+    monkeypatch.setattr(ingest.access_log_store, "insert", slow_insert)
+
+    async def scenario():
+        await init_db()
+        writer = AccessLogWriter(batch_size=10, max_latency=30, max_pending=1000)
+        await writer.start()
+        try:
+            for _ in range(10):
+                await writer.add(lock_id, "pin", "keypad", True)
+            await asyncio.wait_for(inserting.wait(), 1)
+            # Queued behind the batch that is being written
+            for _ in range(10):
+                await writer.add(lock_id, "rfid", "card", False)
+            await writer.stop()
+
+            assert writer.stats()["pending"] == 0
+            assert writer.stats()["rows_written"] == 20
+            async with async_session_maker() as session:
+                summary = await access_log_store.summary(session, lock_id=lock_id)
+            assert summary["total"] == 20
+            assert summary["successful"] == 10
+        finally:
+            await close_db()
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_flush_puts_the_batch_back(monkeypatch):
+    async def hanging_insert(session, rows):
+        await asyncio.Event().wait()
+
+    monkeypatch.setattr(ingest.access_log_store, "insert", hanging_insert)
+
+    async def scenario():
+        await init_db()
+        writer = AccessLogWriter(batch_size=10, max_latency=30, max_pending=1000)
+        try:
+            for _ in range(3):
+                await writer.add(9002, "pin", "keypad", True)
+            flush = asyncio.ensure_future(writer.flush())
+            await asyncio.sleep(0.05)
+            flush.cancel()
+            try:
+                await flush
+            except asyncio.CancelledError:
+                pass
+            assert writer.stats()["pending"] == 3
+        finally:
+            await close_db()
+
+    asyncio.run(scenario())
@@ -0,0 +1,77 @@
+"""
+Ingest scheduling: per-device order across shards and shedding under load.
+"""
+import asyncio
+
+from app.ingest_scheduler import IngestScheduler
+
+
+def _handler(seen: list):
+    async def handle(device_id, data):
+        seen.append((device_id, data["n"]))
+    return handle
+
+
+def test_messages_of_a_device_run_in_arrival_order():
+    async def scenario():
+        scheduler = IngestScheduler(shards=4, max_queue=1000)
+        seen = []
+        handle = _handler(seen)
+        for n in range(50):
+            for device in ("lock_a", "lock_b", "lock_c"):
+                scheduler.submit("access", device, handle, {"n": n})
+        await scheduler.start()
+        await scheduler.stop()
+
+        assert len(seen) == 150
+        for device in ("lock_a", "lock_b", "lock_c"):
+            assert [n for seen_device, n in seen if seen_device == device] == list(range(50))
+        assert scheduler.stats()["processed"] == 150
+
+    asyncio.run(scenario())
+
+
+def test_full_shard_sheds_heartbeats_and_keeps_critical_messages():
+    async def scenario():
+        scheduler = IngestScheduler(shards=1, max_queue=3)
+        seen = []
+        handle = _handler(seen)
+        scheduler.submit("heartbeat", "lock_a", handle, {"n": 0})
+        scheduler.submit("status", "lock_b", handle, {"n": 1})
+        scheduler.submit("status", "lock_c", handle, {"n": 2})
+        # Full: the queued heartbeat makes room for the access event
+        assert scheduler.submit("access", "lock_d", handle, {"n": 3})
+        assert not scheduler.submit("heartbeat", "lock_e", handle, {"n": 4})
+        assert not scheduler.submit("status", "lock_f", handle, {"n": 5})
+        # Never dropped, even over the bound
+        for n, message_type in enumerate(("access", "alert", "verify"), start=6):
+            assert scheduler.submit(message_type, "lock_g", handle, {"n": n})
+        # Status is coalesced while full: the newest state of lock_b wins
+        assert scheduler.submit("status", "lock_b", handle, {"n": 9})
+
+        stats = scheduler.stats()
+        assert stats["dropped"] == {"heartbeat": 2, "status": 1}
+        assert stats["over_limit"] == 3
+        assert stats["coalesced"] == 1
+        await scheduler.start()
+        await scheduler.stop()
+        assert [n for _, n in seen] == [9, 2, 3, 6, 7, 8]
+
+    asyncio.run(scenario())
+
+
+def test_sync_requests_are_coalesced_per_device():
+    async def scenario():
+        scheduler = IngestScheduler(shards=2, max_queue=100)
+        seen = []
+        handle = _handler(seen)
+        for n in range(5):
+            scheduler.submit("sync", "lock_a", handle, {"n": n})
+        scheduler.submit("sync", "lock_b", handle, {"n": 0})
+        await scheduler.start()
+        await scheduler.stop()
+
+        assert sorted(seen) == [("lock_a", 4), ("lock_b", 0)]
+        assert scheduler.stats()["coalesced"] == 4
+
+    asyncio.run(scenario())
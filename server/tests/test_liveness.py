@@ -0,0 +1,77 @@
+"""
+Liveness: the timing wheel of heartbeat deadlines and the offline sweep.
+
+Deadlines are monotonic times; sweeps are driven with explicit ``now`` values
+so no test waits for a real timeout.
+"""
+import asyncio
+import time
+
+from app import liveness
+from app.fleet import FleetState
+from app.liveness import LivenessTracker, TimingWheel
+from app.models import Lock
+
+
+def test_wheel_expires_keys_once_their_tick_passed():
+    now = time.monotonic()
+    wheel = TimingWheel(tick=1.0, horizon=10.0)
+    wheel.schedule(1, now + 3)
+    wheel.schedule(2, now + 5)
+    wheel.schedule(3, now + 5)
+    wheel.cancel(3)
+
+    assert wheel.advance(now + 2) == []
+    assert wheel.advance(now + 4.5) == [1]
+    # Rescheduled before its deadline: moves to the later slot
+    wheel.schedule(2, now + 8)
+    assert wheel.advance(now + 6.5) == []
+    assert wheel.advance(now + 9.5) == [2]
+    assert len(wheel) == 0
+
+
+def test_wheel_catches_up_after_a_stall():
+    now = time.monotonic()
+    wheel = TimingWheel(tick=1.0, horizon=5.0)
+    for key in range(20):
+        wheel.schedule(key, now + 1 + key % 5)
+    # Far more than one revolution later every key still expires exactly once
+    assert sorted(wheel.advance(now + 100)) == list(range(20))
+    assert wheel.advance(now + 200) == []
+
+
+def test_sweep_marks_silent_devices_offline(monkeypatch):
+    events = []
+
+    async def broadcast(event_type, data):
+        events.append((data["device_id"], data["is_online"]))
+
+    monkeypatch.setattr(liveness.sse_broadcaster, "broadcast", broadcast)
+
+    async def scenario():
+        fleet = FleetState(flush_interval=60)
+        for lock_id in (1, 2):
+            fleet.add(Lock(id=lock_id, device_id=f"lock_{lock_id}", name=f"Lock {lock_id}", is_online=False))
+        tracker = LivenessTracker(fleet, flush_interval=60, timeout=30, tick=1.0)
+        now = time.monotonic()
+
+        tracker.touch("lock_1")
+        tracker.touch("lock_2")
+        assert tracker.touch("unknown") is None
+        await tracker.sweep(now)
+        assert sorted(events) == [("lock_1", True), ("lock_2", True)]
+
+        # lock_2 keeps sending heartbeats, lock_1 goes silent
+        monkeypatch.setattr(liveness.time, "monotonic", lambda: now + 20)
+        tracker.touch("lock_2")
+        events.clear()
+        await tracker.sweep(now + 35)
+        assert events == [("lock_1", False)]
+        assert not fleet.get("lock_1").is_online and fleet.get("lock_2").is_online
+        assert tracker.stats()["went_offline"] == 1
+        assert tracker.stats()["last_sweep_expired"] == 1
+
+        await tracker.sweep(now + 55)
+        assert events == [("lock_1", False), ("lock_2", False)]
+
+    asyncio.run(scenario())
@@ -0,0 +1,102 @@
+"""
+Access log partitions: migrating the single legacy table (migrations 4 and 5)
+and retention dropping whole months together with their rollups.
+"""
+import asyncio
+import sqlite3
+import tempfile
+from datetime import datetime
+from pathlib import Path
+
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from app.access_logs import AccessLogStore
+from app.database import async_session_maker, close_db, init_db
+from app.migrations import head, migrate
+
+
+def test_legacy_access_logs_are_partitioned_and_rolled_up():
+    path = Path(tempfile.mkdtemp()) / "legacy.db"
+    engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+
+    async def scenario():
+        try:
+            await migrate(engine)
+            # Back to a version 3 database with the single access_logs table
+            db = sqlite3.connect(path)
+            db.execute("DELETE FROM schema_version WHERE version >= 4")
+            db.execute(
+                "CREATE TABLE access_logs (id INTEGER PRIMARY KEY, lock_id INTEGER NOT NULL, "
+                "access_type VARCHAR NOT NULL, access_method VARCHAR, success BOOLEAN NOT NULL, timestamp DATETIME)"
+            )
+            db.executemany("INSERT INTO access_logs VALUES (?, ?, ?, ?, ?, ?)", [
+                (1, 1, "pin", "keypad", 1, "2025-11-20 10:15:00.000000"),
+                (2, 1, "pin", "keypad", 0, "2025-11-20 10:45:00.000000"),
+                (3, 2, "rfid", "card", 1, "2025-12-31 23:59:59.000000"),
+                (4, 1, "pin", "keypad", 1, "2026-01-02 08:00:00.000000"),
+                # No timestamp: filed with the oldest log
+                (5, 2, "rfid", "card", 0, None),
+            ])
+            db.commit()
+            db.close()
+
+            await migrate(engine)
+        finally:
+            await engine.dispose()
+
+    asyncio.run(scenario())
+
+    db = sqlite3.connect(path)
+    tables = {name for (name,) in db.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    assert "access_logs" not in tables
+    partitions = {
+        name: [row_id for (row_id,) in db.execute(f"SELECT id FROM {name} ORDER BY id")]
+        for name in sorted(tables) if name.startswith("access_logs_")
+    }
+    # Ids are kept
+    assert partitions == {"access_logs_202511": [1, 2, 5], "access_logs_202512": [3], "access_logs_202601": [4]}
+    assert db.execute("SELECT max(version) FROM schema_version").fetchone()[0] == head()
+    rollups = db.execute(
+        "SELECT lock_id, hour, access_type, success, count FROM access_log_rollups ORDER BY hour, lock_id, success"
+    ).fetchall()
+    assert rollups == [
+        (1, "2025-11-20 10:00:00.000000", "pin", 0, 1),
+        (1, "2025-11-20 10:00:00.000000", "pin", 1, 1),
+        (2, "2025-11-20 10:00:00.000000", "rfid", 0, 1),
+        (2, "2025-12-31 23:00:00.000000", "rfid", 1, 1),
+        (1, "2026-01-02 08:00:00.000000", "pin", 1, 1),
+    ]
+    totals = db.execute("SELECT lock_id, access_type, success, count FROM access_log_totals ORDER BY 1, 3").fetchall()
+    assert totals == [(1, "pin", 0, 1), (1, "pin", 1, 2), (2, "rfid", 0, 1), (2, "rfid", 1, 1)]
+    db.close()
+
+
+def test_retention_drops_old_months_and_their_counts():
+    lock_id = 9200
+
+    async def scenario():
+        await init_db()
+        store = AccessLogStore(retention_months=3)
+        try:
+            rows = [
+                {"lock_id": lock_id, "access_type": "pin", "access_method": "keypad", "success": True, "timestamp": ts}
+                for ts in (datetime(2019, 10, 5, 12), datetime(2019, 10, 6, 9), datetime(2019, 11, 1), datetime(2020, 1, 31, 23))
+            ]
+            async with async_session_maker() as session:
+                await store.insert(session, rows)
+                await session.commit()
+
+            # Three full months before February 2020 are kept, from November 2019
+            assert await store.apply_retention(now=datetime(2020, 2, 10)) == ["access_logs_201910"]
+            assert "access_logs_201910" not in [table.name for table in store.partitions()]
+            async with async_session_maker() as session:
+                assert (await store.summary(session, lock_id=lock_id))["total"] == 2
+                hours = await store.hourly(session, datetime(2019, 10, 1), datetime(2020, 2, 1), lock_id=lock_id)
+                listed = await store.recent(session, lock_id=lock_id)
+            assert [point["hour"] for point in hours] == [datetime(2019, 11, 1), datetime(2020, 1, 31, 23)]
+            assert [row.timestamp for row in listed] == [datetime(2020, 1, 31, 23), datetime(2019, 11, 1)]
+            assert store.stats()["partitions_dropped"] == 1
+        finally:
+            await close_db()
+
+    asyncio.run(scenario())
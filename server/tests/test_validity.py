@@ -0,0 +1,66 @@
+"""
+Validity boundaries with offset-aware timestamps.
+
+Clients send ISO timestamps such as ``2030-01-01T00:00:00Z``; the scheduler heap
+and the database hold naive UTC, so aware values must be converted on the way in.
+"""
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+from httpx import ASGITransport, AsyncClient
+from sqlalchemy import select
+
+from app.database import async_session_maker, close_db, init_db
+from app.main import app
+from app.models import AccessCode
+from app.validity import validity_scheduler
+
+
+async def _with_scheduler(scenario):
+    await init_db()
+    await validity_scheduler.start()
+    try:
+        return await scenario()
+    finally:
+        await validity_scheduler.stop()
+        # Pooled connections belong to this test's event loop
+        await close_db()
+
+
+def test_z_suffixed_valid_until_is_scheduled_as_naive_utc():
+    async def scenario():
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+            response = await client.post("/api/v1/locks", json={"device_id": "validity_z", "name": "Validity Z"})
+            assert response.status_code == 201
+            lock_id = response.json()["id"]
+            response = await client.post("/api/v1/access-codes", json={
+                "code": "482913", "lock_id": lock_id, "valid_until": "2030-01-01T00:00:00Z",
+            })
+            assert response.status_code == 201
+        # notify hands boundaries to the loop with call_soon_threadsafe
+        await asyncio.sleep(0)
+
+        assert (datetime(2030, 1, 1), lock_id) in validity_scheduler._heap
+        assert all(deadline.tzinfo is None for deadline, _ in validity_scheduler._heap)
+        async with async_session_maker() as session:
+            stored = (await session.execute(
+                select(AccessCode.valid_until).where(AccessCode.lock_id == lock_id)
+            )).scalar_one()
+        assert stored == datetime(2030, 1, 1)
+        assert validity_scheduler._task is not None and not validity_scheduler._task.done()
+
+    asyncio.run(_with_scheduler(scenario))
+
+
+def test_notify_converts_aware_deadlines():
+    async def scenario():
+        naive = datetime.utcnow() + timedelta(hours=1)
+        aware = (naive + timedelta(minutes=1)).replace(tzinfo=timezone.utc).astimezone(timezone(timedelta(hours=2)))
+        validity_scheduler.notify([(naive, 1), (aware, 2)])
+        await asyncio.sleep(0)
+
+        assert (naive, 1) in validity_scheduler._heap
+        assert (naive + timedelta(minutes=1), 2) in validity_scheduler._heap
+        assert validity_scheduler.stats()["upcoming"] >= 2
+
+    asyncio.run(_with_scheduler(scenario))